@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+
+# Per-table executemany batch sizing.
+#
+# Every insert batch reports its row count, elapsed time and a sample row. The
+# sizer estimates bytes and seconds per row and moves the batch size towards the
+# largest size that stays inside both the memory budget and the latency target,
+# at most doubling or halving per batch. The size reached is saved per table and
+# used as the starting size on the next run.
+#
+# A batch size set by the operator for the loader (LOADER_<NAME>_SQL_BATCH_SIZE) is
+# passed with cap=True: the sizer starts there instead of at the saved size, only
+# ever shrinks from it, and leaves the saved size alone.
+
+history_lock = threading.Lock()
+
+
+def estimate_row_bytes(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+
+class AdaptiveBatchSizer:
+    def __init__(self, table, initial_size, memory_budget_bytes, latency_target_seconds,
+                 history_path=None, enabled=True, min_size=500, max_size=200000, cap=False):
+        self.table = table
+        self.memory_budget_bytes = memory_budget_bytes
+        self.latency_target_seconds = latency_target_seconds
+        self.history_path = history_path
+        self.enabled = enabled
+        self.cap = cap
+        self.max_size = initial_size if cap else max(max_size, initial_size)
+        self.min_size = min(min_size, self.max_size)
+        self.size = initial_size
+        self.batches = 0
+        if enabled and not cap:
+            self.size = self.load_history().get(table, initial_size)
+
+    def load_history(self):
+        if not self.history_path or not os.path.exists(self.history_path):
+            return {}
+        try:
+            with open(self.history_path) as history_file:
+                return json.load(history_file)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, rows, seconds, sample_row=None):
+        self.batches += 1
+        if not self.enabled or rows <= 0:
+            return self.size
+
+        targets = [self.max_size]
+        if sample_row is not None:
+            rowBytes = estimate_row_bytes(sample_row)
+            targets.append(self.memory_budget_bytes // max(rowBytes, 1))
+        if seconds > 0:
+            targets.append(int(self.latency_target_seconds * rows / seconds))
+        target = min(targets)
+
+        # Smooth the change so one slow batch does not collapse the size
+        target = max(self.size // 2, min(self.size * 2, target))
+        self.size = max(self.min_size, min(self.max_size, int(target)))
+        return self.size
+
+    def save(self):
+        if not self.enabled or self.cap or not self.history_path or self.batches == 0:
+            return
+        with history_lock:
+            history = self.load_history()
+            history[self.table] = self.size
+            folder = os.path.dirname(self.history_path) or '.'
+            handle, tmpPath = tempfile.mkstemp(dir=folder, suffix='.tmp')
+            with os.fdopen(handle, 'w') as tmpFile:
+                json.dump(history, tmpFile, indent=2, sort_keys=True)
+            os.replace(tmpPath, self.history_path)
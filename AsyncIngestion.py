@@ -0,0 +1,83 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# asyncio plumbing for FileLoader.load_async().
+#
+# pyodbc, boto3 and the parsers are blocking, so each step runs on a thread pool;
+# asyncio only schedules them. Every kind of work has its own semaphore so that,
+# for example, eight downloads can be in flight while four files are being parsed
+# and inserted, whatever the number of files:
+#
+#     limiter = ResourceLimiter({'list': 4, 'download': 8, 'process': 4})
+#     path = await limiter.run('download', s3_download, s3_client, key, etag)
+#     await limiter.run('process', loader.timed_process_file, path, key, fileDate, startDate)
+
+LIST = 'list'
+DOWNLOAD = 'download'
+PROCESS = 'process'
+
+
+class ResourceLimiter:
+    def __init__(self, limits, executor=None):
+        self.limits = dict(limits)
+        self.semaphores = {resource: asyncio.Semaphore(limit) for resource, limit in self.limits.items()}
+        self.own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=sum(self.limits.values()),
+                                                       thread_name_prefix='TrustIngest')
+
+    async def run(self, resource, func, *args, **kwargs):
+        """Run a blocking call on the pool once a slot for resource is free."""
+        async with self.semaphores[resource]:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        if self.own_executor:
+            self.executor.shutdown(wait=True)
+
+
+async def run_all(coroutines):
+    """Run every coroutine to the end, then raise the first failure, so one bad file
+    neither cancels the others half way nor leaves their temp files behind."""
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def s3_pages(s3_client, bucket, prefix):
+    # All list_objects_v2 pages for a prefix; S3 returns at most 1000 keys per page
+    pages = []
+    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    while True:
+        pages.append(response)
+        if not response['IsTruncated']:
+            return pages
+        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, ContinuationToken=response['NextContinuationToken'])
+
+
+async def list_s3_objects(limiter, s3_client, bucket, prefix, file_object_check, startDate, endDate):
+    """(key, etag, fileDate) of the objects file_object_check accepts. The checks run
+    concurrently because filtering on modified time costs a head_object per key."""
+    pages = await limiter.run(LIST, s3_pages, s3_client, bucket, prefix)
+    fileObjects = [fileObject for page in pages for fileObject in page.get('Contents', [])]
+    checks = await run_all([limiter.run(LIST, file_object_check, fileObject, startDate, endDate, s3_client)
+                            for fileObject in fileObjects])
+    return [(fileObject['Key'], fileObject.get('ETag'), fileDate)
+            for fileObject, (doProcess, fileDate) in zip(fileObjects, checks) if doProcess]
+
+
+def directory_entries(fileDir, dir_entry_check, startDate, endDate):
+    entries = []
+    for dirEntry in os.scandir(fileDir):
+        doProcess, fileDate = dir_entry_check(dirEntry, startDate, endDate)
+        if doProcess:
+            entries.append((dirEntry.path, dirEntry.path, fileDate))
+    return entries
+
+
+async def list_directory(limiter, fileDir, dir_entry_check, startDate, endDate):
+    """(path, name, fileDate) of the files dir_entry_check accepts."""
+    return await limiter.run(LIST, directory_entries, fileDir, dir_entry_check, startDate, endDate)
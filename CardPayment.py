@@ -1,11 +1,67 @@
 from logging import Logger
+from datetime import datetime, timedelta
 from DBLoader import DBLoader
+from IncrementalStats import StatsAccumulator
+from Instrumentation import metrics
+from RowBuffer import RowBuffer
+from Money import SCALED_AMOUNT, to_cents, from_cents, cents_array
+from LoadVerifier import Checksum
+from LoaderWatermark import LoaderWatermark
+
+
+INSERT_COLUMNS = [
+    'AMOUNT', 'CARD_TYPE', 'PAYMENT_TYPE', 'MERCHANT_ID', 'MERCHANT_REF_NBR', 'REQUEST_ID',
+    'TRANSACTION_DATE', 'CARD_SUFFIX', 'BIN', 'TRANSACTION_TIME', 'TRANSACTION_ID'
+]
+
+# Query to select data; WATERMARK is the change marker for incremental loads
+SELECT_SQL = """
+    SELECT
+        AMOUNT AS AMOUNT,
+        CASE
+            WHEN CARDBRAND = 'VISA' THEN 'VISA'
+            WHEN CARDBRAND = 'MASTERCARD' THEN 'MCRD'
+            WHEN CARDBRAND = 'AMERICANEXPRESS' THEN 'AMEX'
+            WHEN CARDBRAND = 'DISCOVER' THEN 'DISC'
+            ELSE 'OTHER'
+        END AS CARD_TYPE,
+        CARDBRAND AS PAYMENT_TYPE,
+        ALSACMERCHANTID AS MERCHANT_ID,
+        TRANSACTIONKEY AS MERCHANT_REF_NBR,
+        PROCESSORTRANSACTIONID AS REQUEST_ID,
+        CONVERT(CHAR(10), DATECREATED, 126) AS TRANSACTION_DATE,
+        CARDLASTFOUR AS CARD_SUFFIX,
+        CARDBIN AS BIN,
+        RIGHT(CONVERT(CHAR(19), DATECREATED, 120), 8) AS TRANSACTION_TIME,
+        clientTransactionId AS TRANSACTION_ID,
+        DATECREATED AS WATERMARK
+    FROM CARDPAYMENT.TRANSACTIONS WITH (NOLOCK)
+    WHERE {where}
+    AND PROCESSORRESPONSETEXT = 'AUTHORIZED'
+    ORDER BY DATECREATED ASC
+"""
+
+DELTA_TABLE = '#CARDPAYMENT_DELTA'
 
 
 class CardPayment(DBLoader):
     def __init__(self, name, log: Logger, startDate, endDate) -> None:
         super().__init__(name, log, startDate, endDate)
         self.matching_tables_to_clean = ['CS_CARDPAYMENT', 'CARDPAYMENT_DMS']
+        self.matching_source_tables = ['TRUST.CYBERSOURCE', 'TRUST.DMS']
+        self.reconcile_date_field = 'TRANSACTION_DATE'
+        # Incremental loads (load.py --incremental) pull DATECREATED after the watermark, re-reading
+        # a few minutes before it for transactions committed late
+        self.watermark = LoaderWatermark(self.name)
+        self.watermark_overlap_minutes = 5
+        self.verification = (
+            Checksum('CARDPAYMENT.TRANSACTIONS', 'DATECREATED', 'AMOUNT',
+                     ['PROCESSORTRANSACTIONID', 'TRANSACTIONKEY', 'clientTransactionId'],
+                     "DATECREATED >= ? AND DATECREATED < ? AND PROCESSORRESPONSETEXT = 'AUTHORIZED'"),
+            Checksum(self.target_table, 'TRANSACTION_DATE', 'AMOUNT',
+                     ['REQUEST_ID', 'MERCHANT_REF_NBR', 'TRANSACTION_ID'],
+                     'TRANSACTION_DATE >= ? AND TRANSACTION_DATE < ?')
+        )
         self.stat_queries = {
             self.UNMATCHED_STATS: """
                 SELECT 
@@ -38,98 +94,39 @@ class CardPayment(DBLoader):
             """
         }
 
+        # UNMATCHED_STATS and STATS read the stats captured while loading
+        stats = StatsAccumulator('CARDPAYMENT', 'TRUST.CARDPAYMENT')
+        self.use_incremental_stats(stats, {
+            self.UNMATCHED_STATS: stats.unmatched_stats_query(),
+            self.UNMATCHED: self.stat_queries[self.UNMATCHED],
+            self.STATS: stats.stats_query()
+        })
+
     def load(self):
-        recordCount = 0
-        totalAmount = 0
+        if self.incremental:
+            self.load_incremental()
+            return
 
         self.log.info(
             f"Started CARDPAYMENT load from DATADB for {self.startDate} to but not including {self.endDate}"
         )
 
         # Establish database connections
-        connDataDb = self.db_conn(
-            self.sql_datastore_server, self.sql_datastore_database,
-            self.sql_datastore_username, self.sql_datastore_password
-        )
-        conn = self.db_conn(
-            self.sql_server, self.sql_working_database,
-            self.sql_working_username, self.sql_working_password
-        )
+        connDataDb = self.connect_datastore()
+        conn = self.connect_working()
 
         cursorDataDb = connDataDb.cursor()
         cursor = conn.cursor()
 
         try:
-            cursor.fast_executemany = True
-
-            # Query to insert data
-            sql = """
-                INSERT INTO TRUST.CARDPAYMENT (
-                    AMOUNT, CARD_TYPE, PAYMENT_TYPE, MERCHANT_ID, 
-                    MERCHANT_REF_NBR, REQUEST_ID, TRANSACTION_DATE, 
-                    CARD_SUFFIX, BIN, TRANSACTION_TIME, TRANSACTION_ID
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-
-            # Query to select data
-            selectSql = """
-                SELECT
-                    AMOUNT AS AMOUNT,
-                    CASE
-                        WHEN CARDBRAND = 'VISA' THEN 'VISA'
-                        WHEN CARDBRAND = 'MASTERCARD' THEN 'MCRD'
-                        WHEN CARDBRAND = 'AMERICANEXPRESS' THEN 'AMEX'
-                        WHEN CARDBRAND = 'DISCOVER' THEN 'DISC'
-                        ELSE 'OTHER'
-                    END AS CARD_TYPE,
-                    CARDBRAND AS PAYMENT_TYPE,
-                    ALSACMERCHANTID AS MERCHANT_ID,
-                    TRANSACTIONKEY AS MERCHANT_REF_NBR,
-                    PROCESSORTRANSACTIONID AS REQUEST_ID,
-                    CONVERT(CHAR(10), DATECREATED, 126) AS TRANSACTION_DATE,
-                    CARDLASTFOUR AS CARD_SUFFIX,
-                    CARDBIN AS BIN,
-                    RIGHT(CONVERT(CHAR(19), DATECREATED, 120), 8) AS TRANSACTION_TIME,
-                    clientTransactionId AS TRANSACTION_ID
-                FROM CARDPAYMENT.TRANSACTIONS WITH (NOLOCK)
-                WHERE DATECREATED >= ?
-                AND DATECREATED < ?
-                AND PROCESSORRESPONSETEXT = 'AUTHORIZED'
-                ORDER BY DATECREATED ASC
-            """
-
-            cursorDataDb.execute(selectSql, [self.startDate, self.endDate])
-
-            # Process rows
-            tuples = []
-            for row in cursorDataDb:
-                tuple = [
-                    float(row.AMOUNT),
-                    row.CARD_TYPE,
-                    row.PAYMENT_TYPE,
-                    row.MERCHANT_ID,
-                    row.MERCHANT_REF_NBR,
-                    row.REQUEST_ID,
-                    row.TRANSACTION_DATE,
-                    row.CARD_SUFFIX,
-                    row.BIN,
-                    row.TRANSACTION_TIME,
-                    row.TRANSACTION_ID
-                ]
-                recordCount += 1
-                totalAmount += row.AMOUNT
-                tuples.append(tuple)
-
-                if len(tuples) >= self.sql_batch_size:
-                    cursor.executemany(sql, tuples)
-                    conn.commit()
-                    tuples = []
+            recordCount, totalCents, _ = self.extract(
+                cursorDataDb, cursor, conn, self.load_table,
+                "DATECREATED >= ? AND DATECREATED < ?", [self.startDate, self.endDate]
+            )
 
-            # Insert any remaining rows
-            if tuples:
-                cursor.executemany(sql, tuples)
-                conn.commit()
+            totalAmount = from_cents(totalCents)
+            self.loaded_count = recordCount
+            self.loaded_amount = totalAmount
 
             self.log.info(
                 f"Finished CARDPAYMENT load. Records: {recordCount}, Amount: {totalAmount:,.2f}"
@@ -137,6 +134,7 @@ class CardPayment(DBLoader):
 
         except Exception as e:
             conn.rollback()
+            self.load_failed = True
             self.log.error(f"Error inserting records into database: {repr(e)}")
 
         finally:
@@ -145,6 +143,123 @@ class CardPayment(DBLoader):
             connDataDb.close()
             conn.close()
 
+    def extract(self, cursorDataDb, cursor, conn, table, where, parameters):
+        """Copy the authorized transactions matching where into table a batch at a time.
+        Returns the row count, the total in cents and the last DATECREATED copied."""
+        recordCount = 0
+        totalCents = 0
+        watermark = None
+        cursor.fast_executemany = True
+
+        # Query to insert data
+        sql = f"""
+            INSERT INTO {table} ({', '.join(INSERT_COLUMNS)})
+            VALUES ({SCALED_AMOUNT}, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+        with metrics.timer(self.name, 'extract'):
+            cursorDataDb.execute(SELECT_SQL.format(where=where), parameters)
+
+        # The SELECT already returns the INSERT's columns in order; AMOUNT goes over as cents
+        buffer = RowBuffer.from_description(cursorDataDb.description, INSERT_COLUMNS, {0: to_cents})
+        columns = [column[0].upper() for column in cursorDataDb.description]
+        watermarkIndex = columns.index('WATERMARK') if 'WATERMARK' in columns else None
+
+        # Process rows a batch at a time
+        while True:
+            with metrics.timer(self.name, 'extract'):
+                rows = cursorDataDb.fetchmany(self.batch_sizer.size)
+            if not rows:
+                break
+
+            with metrics.timer(self.name, 'transform'):
+                if watermarkIndex is not None:
+                    # Rows come ordered by DATECREATED
+                    watermark = rows[-1][watermarkIndex]
+                batch = buffer.fill(rows)
+                # The pyodbc Rows are not needed once copied into the buffer
+                rows = None
+                cents = cents_array(buffer.column(0))
+                recordCount += len(batch)
+                totalCents += sum(cents)
+                self.incremental_stats.add_cents(buffer.column(6), buffer.column(3), cents)
+
+            self.insert_batch(cursor, conn, sql, batch)
+
+        return recordCount, totalCents, watermark
+
+    def incremental_start(self, cursor):
+        """Where an incremental extract starts: the stored watermark less the overlap, but
+        never after the newest row in TRUST.CARDPAYMENT, so rows a trim removed are
+        extracted again. The window start when there is neither."""
+        stored = self.watermark.get(cursor)
+        starts = [datetime.fromisoformat(stored)] if stored else []
+        cursor.execute(f"""
+            SELECT TOP 1 TRANSACTION_DATE, TRANSACTION_TIME FROM {self.target_table} WITH (NOLOCK)
+            ORDER BY TRANSACTION_DATE DESC, TRANSACTION_TIME DESC
+        """)
+        newest = cursor.fetchone()
+        if newest:
+            starts.append(datetime.fromisoformat(f"{str(newest[0])[:10]} {newest[1] or '00:00:00'}"))
+        if not starts:
+            return datetime.strptime(self.startDate, "%Y-%m-%d")
+        return min(starts) - timedelta(minutes=self.watermark_overlap_minutes)
+
+    def load_incremental(self):
+        # New transactions since the watermark are copied into a temp table and merged
+        # into TRUST.CARDPAYMENT on REQUEST_ID, with the new watermark in the same commit
+        connDataDb = self.connect_datastore()
+        conn = self.connect_working()
+        cursorDataDb = connDataDb.cursor()
+        cursor = conn.cursor()
+
+        try:
+            start = self.incremental_start(cursor)
+            self.log.info(f"Started CARDPAYMENT incremental load from DATADB for DATECREATED after {start}")
+
+            cursor.execute(f"DROP TABLE IF EXISTS {DELTA_TABLE}")
+            cursor.execute(f"SELECT TOP 0 {', '.join(INSERT_COLUMNS)} INTO {DELTA_TABLE} FROM {self.target_table}")
+            recordCount, totalCents, watermark = self.extract(
+                cursorDataDb, cursor, conn, DELTA_TABLE, "DATECREATED > ?", [start]
+            )
+            # The merged rows' stats are rebuilt from the table below
+            self.incremental_stats.clear()
+
+            if recordCount:
+                cursor.execute(f"SELECT DISTINCT TRANSACTION_DATE FROM {DELTA_TABLE}")
+                dates = sorted(str(row[0])[:10] for row in cursor.fetchall())
+                self.affected_dates.update(dates)
+                with metrics.timer(self.name, 'merge'):
+                    cursor.execute(f"""
+                        MERGE {self.target_table} AS T
+                        USING {DELTA_TABLE} AS S
+                        ON T.REQUEST_ID = S.REQUEST_ID
+                        WHEN MATCHED THEN
+                            UPDATE SET {', '.join(f'{column} = S.{column}' for column in INSERT_COLUMNS if column != 'REQUEST_ID')}
+                        WHEN NOT MATCHED THEN
+                            INSERT ({', '.join(INSERT_COLUMNS)}) VALUES ({', '.join('S.' + column for column in INSERT_COLUMNS)});
+                    """)
+                    merged = cursor.rowcount
+                    self.watermark.set(cursor, watermark)
+                    self.incremental_stats.rebuild(cursor, dates)
+                    conn.commit()
+                self.log.info(f"Finished CARDPAYMENT incremental load. Records: {recordCount}, merged: {merged}, "
+                              f"Amount: {from_cents(totalCents):,.2f}, dates: {', '.join(dates)}, watermark: {watermark}")
+            else:
+                self.log.info("Finished CARDPAYMENT incremental load. No new records")
+            cursor.execute(f"DROP TABLE {DELTA_TABLE}")
+
+        except Exception as e:
+            conn.rollback()
+            self.load_failed = True
+            self.log.error(f"Error merging incremental records into database: {repr(e)}")
+
+        finally:
+            cursorDataDb.close()
+            cursor.close()
+            connDataDb.close()
+            conn.close()
+
     def get_matchers(self, matchDate):
         return {
             'CyberSource->CARDPAYMENT': {
@@ -0,0 +1,221 @@
+import os
+import sys
+import socket
+from os.path import expanduser, join
+from datetime import datetime, timedelta
+
+# Typed TRUST configuration.
+#
+# TrustConfig.from_environment() does the environment parsing, hostname sniffing
+# and date defaults once; the result is frozen and can be passed to loaders,
+# pickled to worker processes and copied with overrides:
+#
+#     config = TrustConfig.from_environment(log=log)
+#     runConfig = config.replace(start_date='2024-01-01', end_date='2024-01-02')
+#     loader.configure(runConfig.for_loader('Benevity'))
+#
+# Per-loader overrides come from LOADER_<NAME>_<SETTING> environment variables,
+# e.g. LOADER_BENEVITY_SQL_BATCH_SIZE=2000 or LOADER_CYBERSOURCE_USE_S3_BUCKETS=true,
+# for the settings in LOADER_OVERRIDABLE. PARALLELISM is how many files a loader
+# processes at once in async ingestion (ASYNC_INGESTION=true).
+
+LOADER_OVERRIDABLE = {
+    'SQL_BATCH_SIZE': ('sql_batch_size', int),
+    'PARALLELISM': ('parallelism', int),
+    'ASYNC_INGESTION': ('async_ingestion', lambda value: value.lower() == 'true'),
+    'USE_S3_BUCKETS': ('use_s3_buckets_enabled', lambda value: value.lower() == 'true'),
+    'DATA_INPUT_FOLDER': ('data_input_folder', str),
+}
+
+
+class TrustConfig:
+    __slots__ = (
+        'sql_driver', 'sql_server', 'sql_trusted_connection_enabled',
+        'sql_working_database', 'sql_working_username', 'sql_working_password',
+        'sql_datastore_server', 'sql_datastore_database', 'sql_datastore_username', 'sql_datastore_password',
+        'sql_batch_size', 'sql_batch_adaptive', 'sql_batch_memory_mb', 'sql_batch_target_seconds',
+        'batch_size_history_path', 'matching_window_in_days', 'stats_parallelism', 'parallelism',
+        'data_input_folder', 'use_s3_buckets_enabled', 'aws_bucket_name', 'aws_access_key_id', 'aws_secret_access_key',
+        's3_cache_folder', 's3_cache_max_mb', 's3_max_pool_connections', 's3_max_concurrency',
+        's3_multipart_threshold_mb', 's3_multipart_chunksize_mb', 's3_retry_attempts',
+        'async_ingestion', 'async_list_concurrency', 'async_download_concurrency',
+        'daemon_port', 'daemon_pool_size', 'daemon_pool_timeout', 'daemon_token',
+        'debug_enabled', 'log_to_db', 'log_error_level', 'log_file_path', 'db_tbl_log',
+        'metrics_report_path', 'metrics_prometheus_path', 'use_test_dates_enabled', 'start_date', 'end_date',
+        'loader_name', 'loader_overrides',
+    )
+
+    def __init__(self, **values):
+        unknown = set(values) - set(self.__slots__)
+        if unknown:
+            raise TypeError(f"Unknown configuration settings: {', '.join(sorted(unknown))}")
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+        if self.loader_overrides is None:
+            object.__setattr__(self, 'loader_overrides', ())
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"TrustConfig is frozen; use replace({name}=...)")
+
+    def __delattr__(self, name):
+        raise AttributeError("TrustConfig is frozen")
+
+    def __reduce__(self):
+        return (TrustConfig._restore, (self.as_dict(),))
+
+    @staticmethod
+    def _restore(values):
+        return TrustConfig(**values)
+
+    def __eq__(self, other):
+        return isinstance(other, TrustConfig) and self.as_dict() == other.as_dict()
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        # Never print the secrets
+        hidden = ('sql_working_password', 'sql_datastore_password', 'aws_secret_access_key', 'daemon_token')
+        values = ', '.join(f"{name}={'***' if name in hidden and getattr(self, name) else repr(getattr(self, name))}"
+                           for name in self.__slots__)
+        return f"TrustConfig({values})"
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def replace(self, **overrides):
+        values = self.as_dict()
+        values.update(overrides)
+        return TrustConfig(**values)
+
+    def for_loader(self, loader_name):
+        """The configuration a single loader runs with: the run settings plus that
+        loader's overrides."""
+        overrides = dict(dict(self.loader_overrides).get(loader_name.upper(), ()))
+        return self.replace(loader_name=loader_name, **overrides)
+
+    def loader_override(self, field):
+        """The value a LOADER_<NAME>_<SETTING> variable sets for field in this loader's
+        configuration, or None when the run setting applies."""
+        if not self.loader_name:
+            return None
+        return dict(dict(self.loader_overrides).get(self.loader_name.upper(), ())).get(field)
+
+    @classmethod
+    def from_environment(cls, environ=None, log=None, hostname=None, platform=None, now=None):
+        environ = os.environ if environ is None else environ
+        hostname = socket.gethostname() if hostname is None else hostname
+        platform = sys.platform if platform is None else platform
+        now = datetime.now() if now is None else now
+
+        def warn(message):
+            if log:
+                log.warning(message)
+
+        def env(name, default):
+            return environ.get(name, default)
+
+        def env_bool(name, default):
+            return env(name, default).lower() == 'true'
+
+        def env_number(name, default, kind=int, minimum=None, invalid=None):
+            # invalid: the value used when the variable is set but unparsable, if not default
+            text = env(name, str(default))
+            try:
+                value = kind(text)
+            except ValueError:
+                fallback = default if invalid is None else invalid
+                warn(f'Invalid {name} [{text}], defaulting to {fallback}')
+                return fallback
+            return value if minimum is None else max(minimum, value)
+
+        if platform.startswith("win"):
+            sqlDriver, trustedConnection, dataInputFolder = 'ODBC Driver 17 for SQL Server', 'yes', '\\\\alsac.local\\crm\\Reconciliation\\'
+        elif platform.startswith("linux"):
+            sqlDriver, trustedConnection, dataInputFolder = 'ODBC Driver 18 for SQL Server', 'no', './data/'
+        else:
+            sqlDriver, trustedConnection, dataInputFolder = 'unknown', 'no', './'
+
+        sqlServer = 'DATAETLD181'
+        if 'ALSAC' in hostname or 'TRUSTD' in hostname:
+            sqlServer = 'DATAETLD1S1'
+        elif 'TRUSTQ' in hostname:
+            sqlServer = 'DATAETLQ1S1'
+        elif 'TRUSTP' in hostname:
+            sqlServer = 'DATAETLP1S4'
+
+        useTestDates = env_bool('USE_TEST_DATES', 'true')
+        if useTestDates:
+            startDate, endDate = '2022-12-01', '2023-02-08'
+        else:
+            startDate = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+            endDate = now.strftime("%Y-%m-%d")
+
+        home = expanduser("~")
+        return cls(
+            sql_driver=env('SQL_DRIVER', sqlDriver),
+            sql_server=env('SQL_SERVER', sqlServer),
+            sql_trusted_connection_enabled=env_bool('SQL_TRUSTED_CONNECTION', trustedConnection),
+            sql_working_database=env('SQL_WORKING_DATABASE', 'Reconciliation'),
+            sql_working_username=env('SQL_WORKING_USERNAME', ''),
+            sql_working_password=env('SQL_WORKING_PASSWORD', ''),
+            sql_datastore_server=env('SQL_DATASTORE_SERVER', 'DATADB'),
+            sql_datastore_database=env('SQL_DATASTORE_DATABASE', 'DATASTORE'),
+            sql_datastore_username=env('SQL_DATASTORE_USERNAME', 'DATADB'),
+            sql_datastore_password=env('SQL_DATASTORE_PASSWORD', ''),
+            sql_batch_size=env_number('SQL_BATCH_SIZE', 10000, minimum=1),
+            sql_batch_adaptive=env_bool('SQL_BATCH_ADAPTIVE', 'true'),
+            sql_batch_memory_mb=env_number('SQL_BATCH_MEMORY_MB', 64, minimum=1),
+            sql_batch_target_seconds=env_number('SQL_BATCH_TARGET_SECONDS', 5.0, float),
+            batch_size_history_path=env('BATCH_SIZE_HISTORY_PATH', join(home, 'TRUST_BATCH_SIZES.json')),
+            matching_window_in_days=env_number('MATCHING_WINDOW_IN_DAYS', 120, invalid=60),
+            stats_parallelism=env_number('STATS_PARALLELISM', 4, minimum=1),
+            parallelism=env_number('PARALLELISM', 4, minimum=1),
+            data_input_folder=env('DATA_INPUT_FOLDER', dataInputFolder),
+            use_s3_buckets_enabled=env_bool('USE_S3_BUCKETS', 'false'),
+            aws_bucket_name=env('AWS_BUCKET_NAME', ''),
+            aws_access_key_id=env('AWS_ACCESS_KEY_ID', ''),
+            aws_secret_access_key=env('AWS_SECRET_ACCESS_KEY', ''),
+            s3_cache_folder=env('S3_CACHE_FOLDER', join(home, 'TRUST_S3_CACHE')),
+            s3_cache_max_mb=env_number('S3_CACHE_MAX_MB', 2048, minimum=0),
+            s3_max_pool_connections=env_number('S3_MAX_POOL_CONNECTIONS', 32, minimum=1),
+            s3_max_concurrency=env_number('S3_MAX_CONCURRENCY', 10, minimum=1),
+            s3_multipart_threshold_mb=env_number('S3_MULTIPART_THRESHOLD_MB', 16, minimum=5),
+            s3_multipart_chunksize_mb=env_number('S3_MULTIPART_CHUNKSIZE_MB', 16, minimum=5),
+            s3_retry_attempts=env_number('S3_RETRY_ATTEMPTS', 5, minimum=1),
+            async_ingestion=env_bool('ASYNC_INGESTION', 'false'),
+            async_list_concurrency=env_number('ASYNC_LIST_CONCURRENCY', 4, minimum=1),
+            async_download_concurrency=env_number('ASYNC_DOWNLOAD_CONCURRENCY', 8, minimum=1),
+            daemon_port=env_number('DAEMON_PORT', 47801, minimum=1),
+            daemon_pool_size=env_number('DAEMON_POOL_SIZE', 32, minimum=1),
+            daemon_pool_timeout=env_number('DAEMON_POOL_TIMEOUT', 300.0, float, minimum=1),
+            daemon_token=env('DAEMON_TOKEN', ''),
+            debug_enabled=env_bool('DEBUG_ENABLED', 'false'),
+            log_to_db=env_bool('LOG_TO_DB', 'true'),
+            log_error_level='DEBUG',
+            log_file_path=join(home, 'TRUST_JOB_LOG.txt'),
+            db_tbl_log='TRUST.JOB_LOG',
+            metrics_report_path=env('METRICS_REPORT_PATH', join(home, 'TRUST_RUN_METRICS.json')),
+            metrics_prometheus_path=env('METRICS_PROMETHEUS_PATH', ''),
+            use_test_dates_enabled=useTestDates,
+            start_date=startDate,
+            end_date=endDate,
+            loader_overrides=parse_loader_overrides(environ, warn),
+        )
+
+
+def parse_loader_overrides(environ, warn):
+    # LOADER_<NAME>_<SETTING>; loader names may contain underscores (SHIFT4_ACH), settings are matched from the end
+    overrides = {}
+    for name, text in environ.items():
+        if not name.startswith('LOADER_'):
+            continue
+        for setting, (field, kind) in LOADER_OVERRIDABLE.items():
+            if name.endswith('_' + setting) and len(name) > len('LOADER_') + len(setting) + 1:
+                loaderName = name[len('LOADER_'):-len(setting) - 1].upper()
+                try:
+                    overrides.setdefault(loaderName, {})[field] = kind(text)
+                except ValueError:
+                    warn(f'Invalid {name} [{text}], ignoring the override')
+                break
+    return tuple(sorted((loader, tuple(sorted(values.items()))) for loader, values in overrides.items()))
@@ -0,0 +1,87 @@
+import queue
+import threading
+
+
+class PooledConnection:
+    """Wraps a pyodbc connection; close() hands it back to the pool instead of closing it."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PoolTimeout(TimeoutError):
+    pass
+
+
+class ConnectionPool:
+    """A bounded pool of connections created on demand by connect(). acquire() waits at
+    most timeout seconds (forever when None) for a connection to be handed back."""
+
+    def __init__(self, connect, size, timeout=None):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.available = threading.BoundedSemaphore(size)
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        # A caller that already holds every connection would otherwise wait on itself forever
+        if not self.available.acquire(timeout=timeout):
+            raise PoolTimeout(f"No pooled connection was released within {timeout} seconds (pool size {self.size})")
+        try:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+                with self.lock:
+                    self.created += 1
+            return PooledConnection(self, conn)
+        except Exception:
+            self.available.release()
+            raise
+
+    def release(self, conn):
+        try:
+            # Never hand out a connection with an open transaction
+            conn.rollback()
+            self.idle.put(conn)
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+        finally:
+            self.available.release()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self.lock:
+                self.created -= 1
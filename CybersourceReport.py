@@ -0,0 +1,166 @@
+from decimal import Decimal, InvalidOperation
+from xml.etree.ElementTree import iterparse
+
+# Streaming reader for Cybersource TransactionDetailReport_Daily_Classic_*.xml.
+#
+# The report is one <Report> holding <Requests> with one <Request> per transaction.
+# iterparse hands each <Request> over as soon as it is complete; it is turned into a
+# TRUST.CYBERSOURCE row and removed from the tree, so memory stays flat however big
+# the month-end report is.
+#
+#     reader = TransactionDetailReader()
+#     for rows in reader.batches(mapped.stream(), 10000):
+#         cursor.executemany(reader.insert_sql(), rows)
+
+CYBERSOURCE_COLUMNS = [
+    'TRANSACTION_DATE', 'REQUEST_ID', 'MERCHANT_REF_NBR', 'MERCHANT_ID', 'CARD_TYPE', 'AMOUNT',
+    'PAYMENT_TYPE', 'APG_ID', 'APPLICATION_NAME', 'CARD_SUFFIX', 'EXPIRY', 'BIN', 'TRANSACTION_TIME',
+    'RECONCILIATION_ID', 'CARD_NBR', 'PROCESSOR'
+]
+
+# Where each column comes from in a <Request>: '@Name' is an attribute of the Request,
+# anything else a path below it (namespace added by the reader). Columns mapped to
+# None are written as NULL; loaders can pass their own mapping.
+REQUEST_FIELDS = {
+    'REQUEST_ID': '@RequestID',
+    'MERCHANT_REF_NBR': '@MerchantReferenceNumber',
+    'RECONCILIATION_ID': '@TransactionReferenceNumber',
+    'CARD_TYPE': 'PaymentMethod/Card/CardType',
+    'CARD_SUFFIX': 'PaymentMethod/Card/AccountSuffix',
+    'BIN': 'PaymentMethod/Card/BIN',
+    'AMOUNT': 'PaymentData/Amount',
+    'PROCESSOR': 'PaymentData/PaymentProcessor',
+    'APG_ID': None,
+    'CARD_NBR': None,
+}
+
+
+def namespace_of(tag):
+    return tag[1:].split('}', 1)[0] if tag.startswith('{') else ''
+
+
+def to_amount(text):
+    if not text:
+        return None
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        return None
+
+
+class TransactionDetailReader:
+    def __init__(self, fields=None, columns=None):
+        self.fields = dict(REQUEST_FIELDS if fields is None else fields)
+        self.columns = list(CYBERSOURCE_COLUMNS if columns is None else columns)
+        self.merchant_id = None
+        self.compile_paths('')
+
+        # Per-file results, filled in by rows()
+        self.records = 0
+        self.total_amount = Decimal(0)
+
+    def insert_sql(self, table='TRUST.CYBERSOURCE'):
+        return f"INSERT INTO {table} ({', '.join(self.columns)}) VALUES ({', '.join('?' * len(self.columns))})"
+
+    def compile_paths(self, namespace):
+        # The element paths become a tree of namespaced tags walked once per request
+        # with Element.find on single tags, which stays in C
+        prefix = f'{{{namespace}}}' if namespace else ''
+        self.request_tag = prefix + 'Request'
+        self.requests_tag = prefix + 'Requests'
+        self.attributes = {column: source[1:] for column, source in self.fields.items() if source and source.startswith('@')}
+        paths = {column: source for column, source in self.fields.items() if source and not source.startswith('@')}
+        paths.setdefault('_EXPIRY_MONTH', 'PaymentMethod/Card/ExpirationMonth')
+        paths.setdefault('_EXPIRY_YEAR', 'PaymentMethod/Card/ExpirationYear')
+        self.tree = {}
+        for column, source in paths.items():
+            node = self.tree
+            parts = source.split('/')
+            for part in parts[:-1]:
+                node = node.setdefault(prefix + part, {})
+            node.setdefault(prefix + parts[-1], []).append(column)
+        self.application_replies = prefix + 'ApplicationReplies'
+
+    def extract(self, element, tree, values):
+        for tag, node in tree.items():
+            child = element.find(tag)
+            if child is None:
+                continue
+            if isinstance(node, list):
+                for column in node:
+                    values[column] = child.text
+            else:
+                self.extract(child, node, values)
+
+    def request_row(self, request):
+        values = {column: request.get(attribute) for column, attribute in self.attributes.items()}
+        self.extract(request, self.tree, values)
+
+        # RequestDate is local time with an offset: 2024-01-31T23:15:02-06:00
+        requestDate = request.get('RequestDate') or ''
+        values['TRANSACTION_DATE'] = requestDate[:10] or None
+        values['TRANSACTION_TIME'] = requestDate[11:19] or None
+        values['MERCHANT_ID'] = request.get('MerchantID') or self.merchant_id
+
+        if 'PAYMENT_TYPE' not in self.fields:
+            values['PAYMENT_TYPE'] = values['CARD_TYPE'].upper() if values.get('CARD_TYPE') else None
+        if 'EXPIRY' not in self.fields:
+            month, year = values.get('_EXPIRY_MONTH'), values.get('_EXPIRY_YEAR')
+            values['EXPIRY'] = f"{month}/{year}" if month and year else None
+        if 'APPLICATION_NAME' not in self.fields:
+            replies = request.find(self.application_replies)
+            reply = replies[0] if replies is not None and len(replies) else None
+            values['APPLICATION_NAME'] = reply.get('Name', '').replace('_', ' ').upper() if reply is not None else None
+        values['AMOUNT'] = to_amount(values.get('AMOUNT'))
+        return tuple([values.get(column) for column in self.columns])
+
+    def rows(self, source):
+        """Yield one row per <Request> from a path or file object."""
+        self.records = 0
+        self.total_amount = Decimal(0)
+        self.merchant_id = None
+        amountIndex = self.columns.index('AMOUNT') if 'AMOUNT' in self.columns else None
+
+        events = iterparse(source, events=('start', 'end'))
+        for event, root in events:
+            # The root <Report> carries the namespace and the merchant
+            self.compile_paths(namespace_of(root.tag))
+            self.merchant_id = root.get('MerchantID')
+            break
+        requestTag = self.request_tag
+        requestsTag = self.requests_tag
+
+        parent = None
+        for event, element in events:
+            if element.tag != requestTag:
+                if event == 'start' and element.tag == requestsTag:
+                    parent = element
+                continue
+            if event == 'start':
+                continue
+
+            row = self.request_row(element)
+            self.records += 1
+            if amountIndex is not None and row[amountIndex] is not None:
+                self.total_amount += row[amountIndex]
+            yield row
+
+            # Drop the finished request so the tree never holds more than one
+            element.clear()
+            if parent is not None:
+                try:
+                    parent.remove(element)
+                except ValueError:
+                    pass
+
+    def batches(self, source, batch_size):
+        """Lists of rows for executemany. batch_size may be an int or a callable."""
+        size = batch_size if callable(batch_size) else (lambda: batch_size)
+        rows = []
+        for row in self.rows(source):
+            rows.append(row)
+            if len(rows) >= size():
+                yield rows
+                rows = []
+        if rows:
+            yield rows
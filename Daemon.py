@@ -0,0 +1,164 @@
+import os
+import sys
+import hmac
+import json
+import time
+import socket
+import traceback
+
+from Globals import *
+from Utils import *
+from Instrumentation import metrics
+from LoaderRegistry import TRUSTED_LOADERS, get_loader_class, import_times
+import Utils
+
+# Resident load.py worker.
+#
+#     python Daemon.py serve                                  # listen on 127.0.0.1:DAEMON_PORT
+#     python Daemon.py run -l CardPayment --incremental       # run load.py in the worker
+#     python Daemon.py stop
+#
+# The worker imports the loaders once, parses the settings once and keeps database
+# connections in pools (DAEMON_POOL_SIZE per server, database and login), so a
+# targeted rerun skips interpreter start, imports and logins. Any local user can
+# connect to the port, so the worker only starts with DAEMON_TOKEN set and only serves
+# requests carrying the same token; clients read it from the same environment. A run
+# waits at most DAEMON_POOL_TIMEOUT seconds for a pooled connection. Runs are executed one
+# at a time; each gets fresh load.py globals, a fresh metrics report and logger, and
+# `run` waits for it and prints the status and report. Settings are read when the
+# worker starts; restart it to pick up changed environment variables. Micro-batch
+# refreshes (--interval) never return, so they run as their own process instead.
+
+LOAD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load.py')
+HOST = '127.0.0.1'
+# A client that connects and sends nothing must not hold up the worker
+REQUEST_TIMEOUT = 10
+
+
+def preload(log):
+    for loaderName in TRUSTED_LOADERS:
+        try:
+            get_loader_class(loaderName, log)
+        except Exception as e:
+            log.warning(f"Could not preload {loaderName}: {repr(e)}")
+
+
+def reset_run_context():
+    # A run that failed before term_logger() leaves the logger initialised
+    while Utils.logging_init_count:
+        term_logger()
+    metrics.reset()
+    import_times.clear()
+
+
+def run_load(code, argv):
+    reset_run_context()
+    savedArgv = sys.argv
+    sys.argv = [LOAD_SCRIPT] + list(argv)
+    startTime = time.perf_counter()
+    result = {'status': 'ok', 'exit_code': 0}
+    try:
+        exec(code, {'__name__': '__main__', '__file__': LOAD_SCRIPT})
+    except SystemExit as e:
+        # load.py always ends with sys.exit: 1 when the run or a load failed (it logs and
+        # catches the error itself), 0 otherwise; argparse exits 2 on bad arguments
+        exitCode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        result = {'status': 'ok' if exitCode == 0 else 'failed', 'exit_code': exitCode}
+        if exitCode:
+            result['error'] = f"load.py exited with {exitCode}; see the job log"
+    except Exception as e:
+        result = {'status': 'failed', 'exit_code': 1, 'error': repr(e)}
+        log.error(f"Daemon run {argv} failed: {repr(e)}")
+        log.error(str(traceback.format_exc().splitlines())[0:2000])
+    finally:
+        sys.argv = savedArgv
+    result['seconds'] = time.perf_counter() - startTime
+    result['report'] = metrics.report()
+    return result
+
+
+def authorized(request, token):
+    requestToken = request.get('token')
+    return isinstance(requestToken, str) and hmac.compare_digest(requestToken.encode(), token.encode())
+
+
+def handle(request, code):
+    command = request.get('command')
+    if command == 'ping':
+        return {'status': 'ok'}
+    if command == 'run':
+        argv = [str(arg) for arg in request.get('args', [])]
+        if any(arg.split('=')[0] == '--interval' for arg in argv):
+            return {'status': 'rejected', 'error': 'Run micro-batch refreshes (--interval) as their own process'}
+        return run_load(code, argv)
+    return {'status': 'rejected', 'error': f"Unknown command: {command!r}"}
+
+
+def serve(port=daemon_port, pool_size=daemon_pool_size, token=daemon_token, pool_timeout=daemon_pool_timeout):
+    if not token:
+        raise ValueError("Set DAEMON_TOKEN before starting the TRUST daemon")
+    with open(LOAD_SCRIPT) as loadFile:
+        code = compile(loadFile.read(), LOAD_SCRIPT, 'exec')
+    install_connection_pool(pool_size, pool_timeout)
+    preload(log)
+
+    server = socket.create_server((HOST, port))
+    # Wake up every second so Ctrl+C is noticed on Windows
+    server.settimeout(1)
+    log.info(f"TRUST daemon listening on {HOST}:{port}")
+    try:
+        running = True
+        while running:
+            try:
+                client, _ = server.accept()
+            except socket.timeout:
+                continue
+            client.settimeout(REQUEST_TIMEOUT)
+            with client, client.makefile('rwb') as stream:
+                try:
+                    request = json.loads(stream.readline() or b'{}')
+                except (ValueError, OSError):
+                    request = {}
+                client.settimeout(None)
+                if not isinstance(request, dict) or not authorized(request, token):
+                    log.warning("Rejected a daemon request without a valid token")
+                    response = {'status': 'rejected', 'error': 'Invalid or missing DAEMON_TOKEN'}
+                elif request.get('command') == 'stop':
+                    running = False
+                    response = {'status': 'ok'}
+                else:
+                    response = handle(request, code)
+                try:
+                    stream.write((json.dumps(response, default=str) + '\n').encode())
+                    stream.flush()
+                except OSError as e:
+                    log.warning(f"Could not answer the daemon client: {repr(e)}")
+    finally:
+        server.close()
+        close_connection_pools()
+        log.info("TRUST daemon stopped")
+
+
+def send(request, port=daemon_port, token=daemon_token):
+    request = dict(request, token=token)
+    with socket.create_connection((HOST, port)) as client, client.makefile('rwb') as stream:
+        stream.write((json.dumps(request) + '\n').encode())
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+def main(argv):
+    command = argv[0] if argv else 'serve'
+    if command == 'serve':
+        serve()
+        return 0
+    if command not in ('run', 'stop', 'ping'):
+        print("Usage: Daemon.py serve | run <load.py arguments> | stop | ping")
+        return 2
+    response = send({'command': command, 'args': argv[1:]})
+    print(json.dumps(response, indent=2, default=str))
+    return 0 if response.get('status') == 'ok' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
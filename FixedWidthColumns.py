@@ -0,0 +1,265 @@
+from collections import namedtuple
+
+from MappedFile import MappedFile
+from Money import SCALED_AMOUNT
+
+# numpy is optional: with it, fixed-length files are sliced a block of records at a
+# time as a 2-D byte array; without it, fields are sliced out of the map directly
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Columnar parsing of fixed-width bank/processor files for FileLoader subclasses.
+#
+#     parser = FixedWidthColumnParser([
+#         FixedWidthColumn('TRANSACTION_DATE', 1, 8),
+#         FixedWidthColumn('MERCHANT_ID', 9, 10),
+#         FixedWidthColumn('REFERENCE', 19, 20),
+#         FixedWidthColumn('AMOUNT', 39, 12, MONEY),
+#     ], trailer_count=(1, 10), trailer_total=(11, 15), total_column='AMOUNT')
+#     sql = parser.insert_sql('TRUST.X')
+#     for rows in parser.batches(path, 10000):
+#         cursor.executemany(sql, rows)
+#
+# Offsets are 0-based within the record. Only the listed fields are decoded.
+# MONEY fields hold implied-decimal amounts; they are yielded as integer cents and
+# insert_sql() scales them back with SCALED_AMOUNT, so no amount passes through a
+# float. CENTS fields are integer cents stored as they are.
+# trailer_count/trailer_total are (start, length) of the trailer's record count and
+# total in cents; the count is checked before the first batch, the total after the last.
+
+TEXT = 'text'
+INT = 'int'
+CENTS = 'cents'
+MONEY = 'money'
+COLUMN_KINDS = (TEXT, INT, CENTS, MONEY)
+
+FixedWidthColumn = namedtuple('FixedWidthColumn', ['name', 'start', 'length', 'kind'], defaults=[TEXT])
+
+
+class FixedWidthValidationError(ValueError):
+    def __init__(self, message, path=None, expected=None, actual=None):
+        super().__init__(message)
+        self.path = path
+        self.expected = expected
+        self.actual = actual
+
+
+def convert_field(kind, raw, encoding):
+    if kind == TEXT:
+        return raw.decode(encoding).strip()
+    return int(raw) if raw.strip() else 0
+
+
+def convert_column(kind, raws, encoding):
+    if kind == TEXT:
+        return [raw.decode(encoding).strip() for raw in raws]
+    try:
+        return list(map(int, raws))
+    except ValueError:
+        # Blank amounts count as zero
+        return [int(raw) if raw.strip() else 0 for raw in raws]
+
+
+class FixedWidthColumnParser:
+    def __init__(self, columns, record_type='D', header_type='H', trailer_type='T', type_offset=0,
+                 trailer_count=None, trailer_total=None, total_column=None, encoding='ascii', use_numpy=True):
+        for column in columns:
+            if column.kind not in COLUMN_KINDS:
+                raise ValueError(f"Unknown column kind {column.kind} for {column.name}")
+        self.columns = list(columns)
+        self.record_type = record_type.encode(encoding)
+        self.header_type = header_type.encode(encoding) if header_type else None
+        self.trailer_type = trailer_type.encode(encoding) if trailer_type else None
+        self.type_offset = type_offset
+        self.trailer_count = trailer_count
+        self.trailer_total = trailer_total
+        self.total_index = None
+        if total_column is not None:
+            self.total_index = [column.name for column in self.columns].index(total_column)
+            if self.columns[self.total_index].kind not in (CENTS, MONEY, INT):
+                raise ValueError(f"Total column {total_column} is not numeric")
+        self.encoding = encoding
+        self.use_numpy = use_numpy and np is not None
+        self.record_width = max(column.start + column.length for column in self.columns)
+
+        # Per-file results, filled in by batches()
+        self.header = None
+        self.trailer = None
+        self.records = 0
+        self.total_cents = 0
+
+    @property
+    def column_names(self):
+        return [column.name for column in self.columns]
+
+    def insert_sql(self, table):
+        placeholders = ', '.join(SCALED_AMOUNT if column.kind == MONEY else '?' for column in self.columns)
+        return f"INSERT INTO {table} ({', '.join(self.column_names)}) VALUES ({placeholders})"
+
+    def batches(self, path, batch_size):
+        """Yield lists of row tuples in column order. path may be a file path or an open
+        MappedFile; batch_size may be an int or a callable returning the current batch
+        size (e.g. an AdaptiveBatchSizer's size)."""
+        self.header = None
+        self.trailer = None
+        self.records = 0
+        self.total_cents = 0
+        size = batch_size if callable(batch_size) else (lambda: batch_size)
+
+        if isinstance(path, MappedFile):
+            yield from self.batches_mapped(path.path, path, size)
+        else:
+            with MappedFile(path, self.encoding) as mapped:
+                yield from self.batches_mapped(path, mapped, size)
+
+    def batches_mapped(self, path, mapped, size):
+        if len(mapped) == 0:
+            self.validate(path, 0)
+            return
+        stride = mapped.fixed_stride(self.record_width)
+        if stride:
+            yield from self.batches_fixed(path, mapped, stride, size)
+        else:
+            yield from self.batches_lines(path, mapped, size)
+
+    def record_types(self, mapped, stride):
+        return mapped[self.type_offset::stride]
+
+    def read_header_trailer(self, mapped, stride, types):
+        if self.header_type is not None and types[:1] == self.header_type:
+            self.header = mapped[:stride].rstrip(b'\r\n').decode(self.encoding)
+        if self.trailer_type is not None:
+            lastRecord = types.rfind(self.trailer_type)
+            if lastRecord >= 0:
+                self.trailer = mapped[lastRecord * stride:(lastRecord + 1) * stride].rstrip(b'\r\n').decode(self.encoding)
+
+    def trailer_value(self, field):
+        start, length = field
+        return int(self.trailer[start:start + length])
+
+    def validate_count(self, path, count):
+        if self.trailer_count is None:
+            return
+        if self.trailer is None:
+            raise FixedWidthValidationError(f"{path}: no trailer record", path)
+        expected = self.trailer_value(self.trailer_count)
+        if expected != count:
+            raise FixedWidthValidationError(f"{path}: trailer count {expected} but {count} detail records",
+                                            path, expected, count)
+
+    def validate_total(self, path):
+        if self.trailer_total is None or self.total_index is None:
+            return
+        if self.trailer is None:
+            raise FixedWidthValidationError(f"{path}: no trailer record", path)
+        expected = self.trailer_value(self.trailer_total)
+        if expected != self.total_cents:
+            raise FixedWidthValidationError(f"{path}: trailer total {expected} but detail records total {self.total_cents}",
+                                            path, expected, self.total_cents)
+
+    def validate(self, path, count):
+        self.validate_count(path, count)
+        self.validate_total(path)
+
+    def batches_fixed(self, path, mapped, stride, size):
+        types = self.record_types(mapped, stride)
+        self.read_header_trailer(mapped, stride, types)
+        self.validate_count(path, types.count(self.record_type))
+
+        if self.use_numpy:
+            yield from self.batches_numpy(mapped, stride, types, size)
+        else:
+            detailType = self.record_type[0]
+            offsets = [(i * stride, (i + 1) * stride) for i, recordType in enumerate(types) if recordType == detailType]
+            yield from self.batches_offsets(mapped, offsets, size)
+        self.validate_total(path)
+
+    def batches_offsets(self, mapped, offsets, size, bounded=False):
+        # One list per column, then zip into rows: each pass is a tight comprehension
+        # instead of a Python call per field
+        position = 0
+        while position < len(offsets):
+            batchOffsets = offsets[position:position + max(1, size())]
+            position += len(batchOffsets)
+            columns = []
+            for column in self.columns:
+                start, end = column.start, column.start + column.length
+                if bounded:
+                    raws = [mapped[offset + start:min(offset + end, lineEnd)] for offset, lineEnd in batchOffsets]
+                else:
+                    raws = [mapped[offset + start:offset + end] for offset, lineEnd in batchOffsets]
+                columns.append(convert_column(column.kind, raws, self.encoding))
+            self.count_columns(columns, len(batchOffsets))
+            yield list(zip(*columns))
+
+    def count_columns(self, columns, count):
+        self.records += count
+        if self.total_index is not None:
+            self.total_cents += sum(columns[self.total_index])
+
+    def batches_numpy(self, mapped, stride, types, size):
+        records = np.frombuffer(mapped.buffer, dtype=np.uint8).reshape(-1, stride)
+        try:
+            detailRows = np.flatnonzero(np.frombuffer(types, dtype=np.uint8) == self.record_type[0])
+            position = 0
+            while position < len(detailRows):
+                block = records[detailRows[position:position + max(1, size())]]
+                position += len(block)
+                columns = [self.numpy_column(block[:, column.start:column.start + column.length], column)
+                           for column in self.columns]
+                if self.total_index is not None:
+                    self.total_cents += int(self.numpy_cents(block, self.columns[self.total_index]))
+                self.records += len(block)
+                yield list(zip(*[column.tolist() for column in columns]))
+        finally:
+            # The mmap cannot be closed while numpy still holds views of it
+            del records
+
+    def numpy_digits(self, field):
+        digits = field.astype(np.int64) - 48
+        digits[field == 32] = 0
+        if ((digits < 0) | (digits > 9)).any():
+            return None
+        powers = 10 ** np.arange(field.shape[1] - 1, -1, -1, dtype=np.int64)
+        return digits @ powers
+
+    def numpy_cents(self, block, column):
+        field = block[:, column.start:column.start + column.length]
+        values = self.numpy_digits(field)
+        if values is None:
+            values = np.array([int(value) if value.strip() else 0 for value in self.numpy_bytes(field).tolist()], dtype=np.int64)
+        return values.sum()
+
+    def numpy_bytes(self, field):
+        return np.ascontiguousarray(field).view(f'S{field.shape[1]}').ravel()
+
+    def numpy_column(self, field, column):
+        if column.kind == TEXT:
+            return np.char.strip(np.char.decode(self.numpy_bytes(field), self.encoding))
+        values = self.numpy_digits(field)
+        if values is None:
+            # Signs, decimal points or other characters: parse this batch value by value
+            return np.array([convert_field(column.kind, value, self.encoding) for value in self.numpy_bytes(field).tolist()],
+                            dtype=object)
+        return values
+
+    def batches_lines(self, path, mapped, size):
+        # Records of varying length: find them by newline, still slicing only the listed fields
+        offsets = []
+        detailType = self.record_type[0]
+        lastRecord = None
+        for lineStart, lineEnd in mapped.line_spans():
+            recordType = mapped[lineStart + self.type_offset] if lineStart + self.type_offset < lineEnd else None
+            if recordType == detailType:
+                offsets.append((lineStart, lineEnd))
+            elif self.header_type is not None and lineStart == 0 and recordType == self.header_type[0]:
+                self.header = mapped[lineStart:lineEnd].decode(self.encoding)
+            elif self.trailer_type is not None and recordType == self.trailer_type[0]:
+                lastRecord = (lineStart, lineEnd)
+        if lastRecord:
+            self.trailer = mapped[lastRecord[0]:lastRecord[1]].decode(self.encoding)
+        self.validate_count(path, len(offsets))
+        yield from self.batches_offsets(mapped, offsets, size, bounded=True)
+        self.validate_total(path)
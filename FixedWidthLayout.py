@@ -0,0 +1,149 @@
+from functools import lru_cache
+from itertools import starmap
+
+# Fixed-width record layouts compiled once into a str.format template, for writing
+# GL/export files a batch at a time:
+#
+#     layout = FixedWidthLayout([('ACCOUNT', 10), ('AMOUNT', 12, 'R'), ('MEMO', 30)])
+#     with open(path, 'w', newline='') as exportFile:
+#         layout.write_records(exportFile, rows)
+#
+# Justification is 'L', 'R' or 'C' per field (the layout default otherwise).
+# overflow decides what happens to a value longer than its field: 'error' raises
+# FixedWidthFieldError, 'truncate' cuts it to the field length and 'keep' writes it
+# whole (the old FixedWidthFieldLine behaviour, which shifts the rest of the line).
+
+ERROR = 'error'
+TRUNCATE = 'truncate'
+KEEP = 'keep'
+OVERFLOW_MODES = (ERROR, TRUNCATE, KEEP)
+
+ALIGNMENT = {'L': '<', 'R': '>', 'C': '^'}
+
+
+class FixedWidthFieldError(ValueError):
+    def __init__(self, message, record_number=None, field_index=None, field_name=None, value=None, length=None):
+        super().__init__(message)
+        self.record_number = record_number
+        self.field_index = field_index
+        self.field_name = field_name
+        self.value = value
+        self.length = length
+
+
+class FixedWidthLayout:
+    def __init__(self, fields, justify='L', overflow=ERROR, newline='\n'):
+        """fields = [(name, length) or (name, length, justify) [,...]]"""
+        if overflow not in OVERFLOW_MODES:
+            raise ValueError(f"Unknown overflow mode: {overflow}")
+        if justify not in ALIGNMENT:
+            justify = 'L'
+        self.names = []
+        self.lengths = []
+        self.justify = []
+        for field in fields:
+            name, length = field[0], field[1]
+            fieldJustify = field[2] if len(field) > 2 and field[2] in ALIGNMENT else justify
+            self.names.append(name)
+            self.lengths.append(int(length))
+            self.justify.append(fieldJustify)
+        self.overflow = overflow
+        self.newline = newline
+        self.width = sum(self.lengths)
+
+        # str.center and format's '^' put the odd pad on different sides, so centred
+        # fields are padded with str.center before formatting to keep the old output
+        self.centered = [i for i, fieldJustify in enumerate(self.justify) if fieldJustify == 'C']
+        specs = []
+        for i, (length, fieldJustify) in enumerate(zip(self.lengths, self.justify)):
+            precision = f'.{length}' if overflow == TRUNCATE else ''
+            align = '<' if fieldJustify == 'C' else ALIGNMENT[fieldJustify]
+            specs.append(f'{{{i}:{align}{length}{precision}}}')
+        self.template = ''.join(specs)
+        self.line_template = self.template + newline
+        self.line_width = self.width + len(newline)
+
+    def prepare(self, values):
+        if self.overflow == TRUNCATE:
+            values = [value if isinstance(value, str) or value is None else str(value) for value in values]
+        else:
+            values = list(values)
+        for i in self.centered:
+            if values[i] is not None:
+                value = str(values[i])
+                if self.overflow == TRUNCATE:
+                    value = value[:self.lengths[i]]
+                values[i] = value.center(self.lengths[i])
+        return values
+
+    def check_field_count(self, values, record_number=None):
+        # str.format ignores surplus values and prepare() indexes the centred fields,
+        # so the count is checked before either sees the record
+        if len(values) != len(self.lengths):
+            where = 'Record' if record_number is None else f'Record {record_number}'
+            raise FixedWidthFieldError(f"{where} has {len(values)} fields, layout has {len(self.lengths)}",
+                                       record_number)
+
+    def check(self, values, record_number=None):
+        """Raise FixedWidthFieldError for the first field of values that cannot be written."""
+        where = 'Record' if record_number is None else f'Record {record_number}'
+        self.check_field_count(values, record_number)
+        for i, (value, length) in enumerate(zip(values, self.lengths)):
+            if value is None:
+                raise FixedWidthFieldError(f"{where} field {self.names[i]} is None",
+                                           record_number, i, self.names[i], value, length)
+            if self.overflow == ERROR and len(str(value)) > length:
+                raise FixedWidthFieldError(f"{where} field {self.names[i]}: {value} exceeds {length}",
+                                           record_number, i, self.names[i], value, length)
+
+    def format(self, values, record_number=None):
+        """One record as a line without the newline."""
+        self.check_field_count(values, record_number)
+        if self.centered or self.overflow == TRUNCATE:
+            values = self.prepare(values)
+        try:
+            line = self.template.format(*values)
+        except (TypeError, ValueError, IndexError):
+            self.check(values, record_number)
+            raise
+        if len(line) != self.width:
+            self.check(values, record_number)
+        return line
+
+    def format_records(self, records, first_record_number=1):
+        """All records as one string, each line followed by the layout newline."""
+        if not isinstance(records, (list, tuple)):
+            records = list(records)
+        fieldCount = len(self.lengths)
+        if any(len(values) != fieldCount for values in records):
+            for recordNumber, values in enumerate(records, first_record_number):
+                self.check_field_count(values, recordNumber)
+        if self.centered or self.overflow == TRUNCATE:
+            records = [self.prepare(values) for values in records]
+        try:
+            text = ''.join(starmap(self.line_template.format, records))
+        except (TypeError, ValueError, IndexError):
+            self.find_bad_record(records, first_record_number)
+            raise
+        # Every line is exactly line_width unless a value overflowed its field
+        if len(text) != self.line_width * len(records):
+            self.find_bad_record(records, first_record_number)
+        return text
+
+    def find_bad_record(self, records, first_record_number=1):
+        for recordNumber, values in enumerate(records, first_record_number):
+            self.check(values, recordNumber)
+
+    def write_records(self, file, records, batch_size=100000):
+        """Write records to an open text file with one write per batch. Returns the number of records written."""
+        if not isinstance(records, (list, tuple)):
+            records = list(records)
+        for i in range(0, len(records), batch_size):
+            file.write(self.format_records(records[i:i + batch_size], i + 1))
+        return len(records)
+
+
+@lru_cache(maxsize=256)
+def compiled_layout(lengths, justify='L', overflow=KEEP):
+    """Layouts for FixedWidthFieldLine, cached by field lengths."""
+    return FixedWidthLayout([(f'FIELD{i + 1}', length) for i, length in enumerate(lengths)], justify, overflow)
@@ -0,0 +1,137 @@
+from Money import SCALED_AMOUNT, to_cents, aggregate_cents
+
+# Per-date / per-merchant statistics captured from the loaders' own insert batches.
+#
+# Loaders feed every batch they insert into a StatsAccumulator. After the load is
+# published the aggregates are merged into TRUST.LOADER_STATS, and the loader's
+# UNMATCHED_STATS / STATS queries read that small table instead of scanning and
+# grouping the whole TRUST table on every run:
+#
+#   CREATE TABLE TRUST.LOADER_STATS (
+#       SOURCE VARCHAR(50) NOT NULL,
+#       TRANSACTION_DATE DATE NOT NULL,
+#       MERCHANT_ID VARCHAR(50) NOT NULL,
+#       CNT INT NOT NULL,
+#       AMOUNT DECIMAL(19, 2) NOT NULL,
+#       PRIMARY KEY (SOURCE, TRANSACTION_DATE, MERCHANT_ID)
+#   )
+#
+# Amounts are aggregated as integer cents (see Money) and scaled back in SQL.
+#
+# rebuild() recomputes a source from its TRUST table for the first run or after a
+# failed load; the original full-table queries stay available on demand.
+
+STATS_TABLE = 'TRUST.LOADER_STATS'
+
+
+def date_key(date):
+    return str(date)[:10]
+
+
+def merchant_key(merchant):
+    return '' if merchant is None else str(merchant)
+
+
+class StatsAccumulator:
+    def __init__(self, source, table, date_field='TRANSACTION_DATE', merchant_field='MERCHANT_ID', amount_field='AMOUNT'):
+        self.source = source
+        self.table = table
+        self.date_field = date_field
+        self.merchant_field = merchant_field
+        self.amount_field = amount_field
+        # {(date, merchant): [count, cents]}
+        self.aggregates = {}
+
+    def add(self, date, merchant, amount):
+        self.add_cents([date], [merchant], [to_cents(amount) if amount else 0])
+
+    def add_batch(self, rows, date_index, merchant_index, amount_index):
+        self.add_cents([row[date_index] for row in rows], [row[merchant_index] for row in rows],
+                       [to_cents(row[amount_index]) if row[amount_index] else 0 for row in rows])
+
+    def add_cents(self, dates, merchants, cents):
+        """Add a batch given as columns, the amounts already in cents."""
+        aggregate_cents(zip(map(date_key, dates), map(merchant_key, merchants)), cents, self.aggregates)
+
+    def dates(self):
+        return sorted({date for date, _ in self.aggregates})
+
+    def totals(self, start_date, end_date):
+        """(count, cents) accumulated for the dates from start_date up to but not including end_date."""
+        count = cents = 0
+        for (date, _), (dateCount, dateCents) in self.aggregates.items():
+            if start_date <= date < end_date:
+                count += dateCount
+                cents += dateCents
+        return count, cents
+
+    def clear(self):
+        self.aggregates = {}
+
+    def merge(self, cursor, replace_from_date=None):
+        """Fold the accumulated aggregates into the stats table. Dates on or after
+        replace_from_date were trimmed and reloaded, so their stats are replaced;
+        earlier dates only had rows appended, so their stats are added to."""
+        cursor.execute("""
+            CREATE TABLE #LOADER_STATS (
+                TRANSACTION_DATE DATE NOT NULL, MERCHANT_ID VARCHAR(50) NOT NULL,
+                CNT INT NOT NULL, AMOUNT DECIMAL(19, 2) NOT NULL
+            )
+        """)
+        try:
+            if self.aggregates:
+                cursor.fast_executemany = True
+                cursor.executemany(f"INSERT INTO #LOADER_STATS (TRANSACTION_DATE, MERCHANT_ID, CNT, AMOUNT) VALUES (?, ?, ?, {SCALED_AMOUNT})",
+                                   [[date, merchant, count, cents]
+                                    for (date, merchant), (count, cents) in self.aggregates.items()])
+            if replace_from_date is not None:
+                cursor.execute(f"DELETE FROM {STATS_TABLE} WHERE SOURCE = ? AND TRANSACTION_DATE >= ?",
+                               [self.source, replace_from_date])
+            cursor.execute(f"""
+                MERGE {STATS_TABLE} AS T
+                USING #LOADER_STATS AS S
+                ON T.SOURCE = ? AND T.TRANSACTION_DATE = S.TRANSACTION_DATE AND T.MERCHANT_ID = S.MERCHANT_ID
+                WHEN MATCHED THEN
+                    UPDATE SET CNT = T.CNT + S.CNT, AMOUNT = T.AMOUNT + S.AMOUNT
+                WHEN NOT MATCHED THEN
+                    INSERT (SOURCE, TRANSACTION_DATE, MERCHANT_ID, CNT, AMOUNT)
+                    VALUES (?, S.TRANSACTION_DATE, S.MERCHANT_ID, S.CNT, S.AMOUNT);
+            """, [self.source, self.source])
+        finally:
+            cursor.execute("DROP TABLE #LOADER_STATS")
+
+    def rebuild(self, cursor, dates=None):
+        # dates limits the rebuild to those days, e.g. after reloading them
+        if dates is not None and not dates:
+            return
+        placeholders = ', '.join('?' * len(dates)) if dates else ''
+        statsFilter = f" AND TRANSACTION_DATE IN ({placeholders})" if dates else ''
+        tableFilter = f" AND {self.date_field} IN ({placeholders})" if dates else ''
+        cursor.execute(f"DELETE FROM {STATS_TABLE} WHERE SOURCE = ?{statsFilter}", [self.source] + list(dates or []))
+        cursor.execute(f"""
+            INSERT INTO {STATS_TABLE} (SOURCE, TRANSACTION_DATE, MERCHANT_ID, CNT, AMOUNT)
+            SELECT ?, {self.date_field}, ISNULL(CAST({self.merchant_field} AS VARCHAR(50)), ''),
+                COUNT(*), ISNULL(SUM({self.amount_field}), 0)
+            FROM {self.table} WITH (NOLOCK)
+            WHERE {self.date_field} IS NOT NULL{tableFilter}
+            GROUP BY {self.date_field}, ISNULL(CAST({self.merchant_field} AS VARCHAR(50)), '')
+        """, [self.source] + list(dates or []))
+
+    def unmatched_stats_query(self):
+        # Same columns as the full-table UNMATCHED_STATS queries
+        return f"""
+            SELECT '{self.source}' AS SOURCE, TRANSACTION_DATE, NULLIF(MERCHANT_ID, '') AS {self.merchant_field},
+                SUM(AMOUNT) AS AMOUNT, SUM(CNT) AS COUNT
+            FROM {STATS_TABLE} WITH (NOLOCK)
+            WHERE SOURCE = '{self.source}'
+            GROUP BY TRANSACTION_DATE, MERCHANT_ID
+        """
+
+    def stats_query(self):
+        # Same columns as the full-table STATS queries
+        return f"""
+            SELECT TRANSACTION_DATE, '{self.source}' AS SOURCE, SUM(CNT) AS CNT, SUM(AMOUNT) AS AMOUNT
+            FROM {STATS_TABLE} WITH (NOLOCK)
+            WHERE SOURCE = '{self.source}'
+            GROUP BY TRANSACTION_DATE
+        """
@@ -0,0 +1,55 @@
+import hashlib
+
+# Content-addressed record of the files each FileLoader has loaded.
+#
+#   CREATE TABLE TRUST.INGESTION_LEDGER (
+#       LOADER VARCHAR(50) NOT NULL,
+#       CONTENT_HASH VARCHAR(100) NOT NULL,
+#       FILE_KEY VARCHAR(1024) NOT NULL,
+#       FILE_DATE DATE NULL,
+#       ROW_COUNT INT NULL,
+#       INGESTED_AT DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+#       PRIMARY KEY (LOADER, CONTENT_HASH)
+#   )
+#
+# CONTENT_HASH is 'sha256:<hex>' for local files (hashed while streaming) and
+# 'etag:<etag>' for S3 objects, whose ETag comes free with the listing. A file is
+# skipped when its hash is already recorded for the loader, whatever it is called.
+
+LEDGER_TABLE = 'TRUST.INGESTION_LEDGER'
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as hashedFile:
+        for chunk in iter(lambda: hashedFile.read(chunk_size), b''):
+            digest.update(chunk)
+    return 'sha256:' + digest.hexdigest()
+
+
+def etag_hash(etag):
+    return 'etag:' + etag.strip('"')
+
+
+class IngestionLedger:
+    def __init__(self, loader_name, table=LEDGER_TABLE):
+        self.loader_name = loader_name
+        self.table = table
+
+    def hashes(self, cursor):
+        cursor.execute(f"SELECT CONTENT_HASH FROM {self.table} WHERE LOADER = ?", [self.loader_name])
+        return {row[0] for row in cursor.fetchall()}
+
+    def hashes_from(self, cursor, startDate):
+        cursor.execute(f"SELECT CONTENT_HASH FROM {self.table} WHERE LOADER = ? AND FILE_DATE >= ?",
+                       [self.loader_name, startDate])
+        return {row[0] for row in cursor.fetchall()}
+
+    def record(self, cursor, content_hash, file_key, file_date, row_count=None):
+        # No commit: callers commit it with the rows it describes
+        cursor.execute(f"INSERT INTO {self.table} (LOADER, CONTENT_HASH, FILE_KEY, FILE_DATE, ROW_COUNT) VALUES (?, ?, ?, ?, ?)",
+                       [self.loader_name, content_hash, str(file_key)[:1024],
+                        str(file_date)[:10] if file_date else None, row_count])
+
+    def clear_from(self, cursor, startDate):
+        cursor.execute(f"DELETE FROM {self.table} WHERE LOADER = ? AND FILE_DATE >= ?", [self.loader_name, startDate])
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import socket
+import tempfile
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+# Per-run timing and throughput for load.py.
+#
+# Code on the hot path records into the module level `metrics` object:
+#     with metrics.timer(self.name, 'insert'):
+#         cursor.executemany(sql, rows)
+#     metrics.count(self.name, rows=len(rows), bytes=rowBytes)
+# Phases used by the loaders: trim, extract, transform, insert, commit, publish,
+# match, stats and file_io. load.py writes the report at the end of every run.
+
+
+class RunMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.phases = {}
+            self.counters = {}
+            self.run_info = {}
+
+    def add_time(self, loader, phase, seconds):
+        with self.lock:
+            phases = self.phases.setdefault(loader, {})
+            timing = phases.get(phase)
+            if timing is None:
+                phases[phase] = {'seconds': seconds, 'calls': 1, 'max_seconds': seconds}
+            else:
+                timing['seconds'] += seconds
+                timing['calls'] += 1
+                timing['max_seconds'] = max(timing['max_seconds'], seconds)
+
+    @contextmanager
+    def timer(self, loader, phase):
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(loader, phase, time.perf_counter() - startTime)
+
+    def count(self, loader, rows=0, bytes=0):
+        with self.lock:
+            counter = self.counters.setdefault(loader, {'rows': 0, 'bytes': 0})
+            counter['rows'] += rows
+            counter['bytes'] += bytes
+
+    def report(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            loaders = {}
+            for loader in sorted(set(self.phases) | set(self.counters)):
+                phases = {phase: dict(timing) for phase, timing in self.phases.get(loader, {}).items()}
+                counter = self.counters.get(loader, {'rows': 0, 'bytes': 0})
+                # Throughput over the time spent writing rows, and over the whole loader
+                writeSeconds = sum(phases.get(phase, {}).get('seconds', 0) for phase in ('insert', 'commit'))
+                loadSeconds = phases.get('load', {}).get('seconds', 0)
+                loaders[loader] = {
+                    'phases': phases,
+                    'rows': counter['rows'],
+                    'bytes': counter['bytes'],
+                    'insert_rows_per_second': counter['rows'] / writeSeconds if writeSeconds else None,
+                    'insert_bytes_per_second': counter['bytes'] / writeSeconds if writeSeconds else None,
+                    'load_rows_per_second': counter['rows'] / loadSeconds if loadSeconds else None,
+                }
+            return {
+                'host': socket.gethostname(),
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'elapsed_seconds': elapsed,
+                'run': dict(self.run_info),
+                'loaders': loaders,
+            }
+
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.report(), indent=2, default=str))
+
+    def write_prometheus(self, path):
+        # Text exposition format, suitable for the node_exporter textfile collector
+        report = self.report()
+        lines = [
+            '# TYPE trust_load_elapsed_seconds gauge',
+            f'trust_load_elapsed_seconds {report["elapsed_seconds"]:.3f}',
+            '# TYPE trust_load_phase_seconds gauge',
+        ]
+        for loader, values in report['loaders'].items():
+            for phase, timing in values['phases'].items():
+                lines.append(f'trust_load_phase_seconds{{loader="{loader}",phase="{phase}"}} {timing["seconds"]:.3f}')
+        lines.append('# TYPE trust_load_rows gauge')
+        for loader, values in report['loaders'].items():
+            lines.append(f'trust_load_rows{{loader="{loader}"}} {values["rows"]}')
+        lines.append('# TYPE trust_load_bytes gauge')
+        for loader, values in report['loaders'].items():
+            lines.append(f'trust_load_bytes{{loader="{loader}"}} {values["bytes"]}')
+        write_atomic(path, '\n'.join(lines) + '\n')
+
+
+def write_atomic(path, text):
+    folder = os.path.dirname(path) or '.'
+    handle, tmpPath = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(handle, 'w') as tmpFile:
+        tmpFile.write(text)
+    os.replace(tmpPath, path)
+
+
+metrics = RunMetrics()
@@ -0,0 +1,92 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Per-date verification of a loaded TRUST table against its DATADB source.
+#
+# A loader describes both sides with a Checksum and sets loader.verification to
+# (source, target). Each side is reduced in SQL to one row per date:
+#
+#     VERIFY_DATE, CNT, CENTS (sum of the amount in cents), KEY_HASH
+#
+# KEY_HASH is the sum of the first 8 bytes of SHA2_256 over each row's key columns
+# and amount, so it does not depend on row order and changes when a row is missing,
+# duplicated or altered. Both sides run at the same time; dates whose rows differ
+# are returned so loader.reload_dates() can re-extract just those days:
+#
+#     mismatched = LoadVerifier.verify_loaders(loaders, log, parallelism)
+#     for loaderName, dates in mismatched.items():
+#         loaders[loaderName].reload_dates(dates)
+#
+# where is a condition with two parameters, the start and end of the window;
+# parameters(startDate, endDate) converts them when the column is not a date
+# (EMAF's ALSAC_FILE_ID is YYYYMMDD).
+
+Checksum = namedtuple('Checksum', ['table', 'date', 'amount', 'keys', 'where', 'parameters'], defaults=[None])
+
+
+def cents_expression(amount):
+    return f"CAST(ROUND({amount} * 100, 0) AS BIGINT)"
+
+
+def checksum_query(checksum):
+    date = f"CONVERT(CHAR(10), {checksum.date}, 126)"
+    cents = cents_expression(checksum.amount)
+    # CONCAT treats NULL as ''; VARCHAR so NVARCHAR and VARCHAR sources hash alike
+    parts = [f"CAST({key} AS VARCHAR(200))" for key in checksum.keys] + [f"CAST({cents} AS VARCHAR(20))"]
+    concatenated = ", '|', ".join(parts)
+    return f"""
+        SELECT {date} AS VERIFY_DATE, COUNT(*) AS CNT, COALESCE(SUM({cents}), 0) AS CENTS,
+            COALESCE(SUM(CAST(CAST(CONVERT(BINARY(8), HASHBYTES('SHA2_256', CONCAT({concatenated}))) AS BIGINT)
+                AS DECIMAL(38, 0))), 0) AS KEY_HASH
+        FROM {checksum.table} WITH (NOLOCK)
+        WHERE {checksum.where}
+        GROUP BY {date}
+    """
+
+
+def run_checksum(connect, checksum, startDate, endDate):
+    """{date: (count, cents, key hash)} for one side."""
+    parameters = checksum.parameters(startDate, endDate) if checksum.parameters else [startDate, endDate]
+    conn = connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(checksum_query(checksum), parameters)
+        return {str(row[0]).strip(): (int(row[1]), int(row[2]), int(row[3])) for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def differing_dates(source, target):
+    return sorted(date for date in set(source) | set(target) if source.get(date) != target.get(date))
+
+
+def verify_loaders(loaders, log, parallelism=4):
+    """{loader name: dates that differ} for the loaders that define a verification."""
+    checked = {name: loader for name, loader in loaders.items() if getattr(loader, 'verification', None)}
+    if not checked:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max(parallelism, 2)) as executor:
+        futures = {name: (executor.submit(run_checksum, loader.connect_datastore, loader.verification[0],
+                                          loader.startDate, loader.endDate),
+                          executor.submit(run_checksum, loader.connect_working, loader.verification[1],
+                                          loader.startDate, loader.endDate))
+                   for name, loader in checked.items()}
+
+        mismatched = {}
+        for name, (sourceFuture, targetFuture) in futures.items():
+            try:
+                source, target = sourceFuture.result(), targetFuture.result()
+            except Exception as e:
+                log.error(f"{name}: verification failed: {repr(e)}")
+                continue
+            dates = differing_dates(source, target)
+            if dates:
+                for date in dates:
+                    log.warning(f"{name}: {date} differs from the source: source (count, cents, hash) "
+                                f"{source.get(date)}, target {target.get(date)}")
+                mismatched[name] = dates
+            else:
+                log.info(f"{name}: {len(source)} dates match the source")
+    return mismatched
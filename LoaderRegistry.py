@@ -0,0 +1,35 @@
+import time
+import importlib
+
+from Instrumentation import metrics
+
+# The loaders load.py is allowed to run. A loader module is imported only when it
+# is scheduled, so `load.py -l CardPayment` does not pay for the other 24.
+TRUSTED_LOADERS = (
+    "BAI", "ACH", "Wires", "EFT", "Amazon", "AMEX", "APG", "ApplePay", "Benevity", "CardPayment",
+    "ChargeProcessing", "Cybersource", "EMAF", "EPP", "GooglePay", "IPay", "Metavante", "Paypal",
+    "SHIFT4", "SHIFT4_ACH", "Telecheck", "VSD", "ReceiptLedger", "BAIEnrichment", "TriangleMatch"
+)
+
+# Seconds spent in each import made through import_timed
+import_times = {}
+
+
+def import_timed(module_name, log=None):
+    """Import a module and record how long the first import took."""
+    startTime = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if module_name not in import_times:
+        elapsed = time.perf_counter() - startTime
+        import_times[module_name] = elapsed
+        metrics.add_time('imports', module_name, elapsed)
+        if log:
+            log.debug(f"Imported {module_name} in {elapsed * 1000:.0f} ms")
+    return module
+
+
+def get_loader_class(loader_name, log=None):
+    if loader_name not in TRUSTED_LOADERS:
+        raise ValueError(f"Unauthorized loader: {loader_name}.")
+    module = import_timed(f"loaders.{loader_name}", log)
+    return getattr(module, loader_name)
@@ -0,0 +1,39 @@
+# Per-loader high-water marks for incremental extracts.
+#
+#   CREATE TABLE TRUST.LOADER_WATERMARK (
+#       LOADER VARCHAR(50) NOT NULL PRIMARY KEY,
+#       WATERMARK VARCHAR(50) NOT NULL,
+#       UPDATED_AT DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+#   )
+#
+# WATERMARK is the largest source change marker already merged, e.g. CardPayment's
+# DATECREATED as 'YYYY-MM-DD HH:MM:SS.fff'. It is written in the same transaction as
+# the rows it covers, so a failed merge leaves the previous mark in place.
+
+WATERMARK_TABLE = 'TRUST.LOADER_WATERMARK'
+
+
+class LoaderWatermark:
+    def __init__(self, loader_name, table=WATERMARK_TABLE):
+        self.loader_name = loader_name
+        self.table = table
+
+    def get(self, cursor):
+        cursor.execute(f"SELECT WATERMARK FROM {self.table} WHERE LOADER = ?", [self.loader_name])
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def set(self, cursor, watermark):
+        # No commit: callers commit it with the rows it covers
+        cursor.execute(f"""
+            MERGE {self.table} AS T
+            USING (SELECT ? AS LOADER, ? AS WATERMARK) AS S
+            ON T.LOADER = S.LOADER
+            WHEN MATCHED THEN
+                UPDATE SET WATERMARK = S.WATERMARK, UPDATED_AT = SYSUTCDATETIME()
+            WHEN NOT MATCHED THEN
+                INSERT (LOADER, WATERMARK) VALUES (S.LOADER, S.WATERMARK);
+        """, [self.loader_name, str(watermark)])
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {self.table} WHERE LOADER = ?", [self.loader_name])
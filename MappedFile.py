@@ -0,0 +1,101 @@
+import os
+import mmap
+
+# Read-only memory-mapped access to local input files and S3 temp downloads.
+#
+#     with MappedFile(file_path) as mapped:
+#         for line in mapped.lines():            # memoryview per line, no copy
+#             if line[0:1] == b'D':
+#                 amount = mapped.field(line, 39, 12)   # only this field is decoded
+#
+# The views handed out point into the map: copy anything needed after the file is
+# closed with bytes(view) or field(). close() leaves the map to the garbage
+# collector when views are still alive rather than failing.
+
+
+class MappedFile:
+    def __init__(self, path, encoding='ascii'):
+        self.path = path
+        self.encoding = encoding
+        self.size = os.path.getsize(path)
+        self.file = open(path, 'rb')
+        if self.size:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # mmap refuses empty files
+            self.buffer = b''
+        self.view = memoryview(self.buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        # Slicing the map copies just that range into bytes
+        return self.buffer[key]
+
+    def close(self):
+        if self.view is None:
+            return
+        try:
+            self.view.release()
+            if isinstance(self.buffer, mmap.mmap):
+                self.buffer.close()
+        except BufferError:
+            pass
+        self.view = None
+        self.file.close()
+
+    def find(self, sub, start=0, end=None):
+        return self.buffer.find(sub, start, self.size if end is None else end)
+
+    def stream(self):
+        """File-like access (read/readline/seek) for parsers that want a file object."""
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.seek(0)
+            return self.buffer
+        self.file.seek(0)
+        return self.file
+
+    def line_spans(self, start=0):
+        """(start, end) of each line, end excluding the line ending."""
+        buffer = self.buffer
+        size = self.size
+        position = start
+        while position < size:
+            lineEnd = buffer.find(b'\n', position)
+            nextLine = lineEnd + 1
+            if lineEnd < 0:
+                lineEnd = nextLine = size
+            end = lineEnd - 1 if lineEnd > position and buffer[lineEnd - 1:lineEnd] == b'\r' else lineEnd
+            yield position, end
+            position = nextLine
+
+    def lines(self, start=0):
+        view = self.view
+        for lineStart, lineEnd in self.line_spans(start):
+            yield view[lineStart:lineEnd]
+
+    def fixed_stride(self, min_width=0):
+        """The record length including the line ending when every line has the same
+        length, otherwise None."""
+        stride = self.find(b'\n') + 1
+        if stride <= min_width or self.size % stride:
+            return None
+        if self.buffer[stride - 1::stride] != b'\n' * (self.size // stride):
+            return None
+        return stride
+
+    def records(self, stride):
+        view = self.view
+        for position in range(0, self.size, stride):
+            yield view[position:position + stride]
+
+    def field(self, record, start, length, strip=True):
+        value = bytes(record[start:start + length]).decode(self.encoding)
+        return value.strip() if strip else value
@@ -0,0 +1,50 @@
+from array import array
+from decimal import Decimal, ROUND_HALF_UP
+
+# Money as integer cents.
+#
+# Loaders convert amounts to cents once, as they are read, and keep each batch's
+# amounts in an array('q'). Totals and per-date/merchant aggregates are integer sums,
+# so they are exact however many rows are added up, and the INSERTs bind a BIGINT
+# that SQL Server scales back to the DECIMAL column:
+#
+#     INSERT INTO TRUST.X (AMOUNT, ...) VALUES (CAST(? AS DECIMAL(19, 0)) / 100, ...)
+#
+# from_cents() turns a total back into a Decimal for logging and for comparing with
+# SUM(AMOUNT) on the table.
+
+SCALED_AMOUNT = 'CAST(? AS DECIMAL(19, 0)) / 100'
+HUNDRED = Decimal(100)
+
+
+def to_cents(value):
+    if not isinstance(value, Decimal):
+        if isinstance(value, int):
+            return value * 100
+        # repr() gives the shortest string that reads back as the same float
+        value = Decimal(repr(value) if isinstance(value, float) else str(value).strip())
+    scaled = value * HUNDRED
+    cents = int(scaled)
+    # Source amounts have at most two decimals; anything finer is rounded half up
+    return cents if scaled == cents else int(scaled.to_integral_value(ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def cents_array(values):
+    return array('q', values)
+
+
+def aggregate_cents(keys, cents, aggregates=None):
+    """Add each (key, cents) pair into aggregates {key: [count, cents]}."""
+    aggregates = {} if aggregates is None else aggregates
+    for key, amount in zip(keys, cents):
+        aggregate = aggregates.get(key)
+        if aggregate is None:
+            aggregates[key] = [1, amount]
+        else:
+            aggregate[0] += 1
+            aggregate[1] += amount
+    return aggregates
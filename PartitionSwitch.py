@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+# Helpers for date-partitioned TRUST tables.
+#
+# A partitioned loader keeps three objects on the same partition scheme
+# (RANGE RIGHT on the trim date column, one boundary per day):
+#   TRUST.<NAME>        the live table read by the matchers and dashboards
+#   TRUST.<NAME>_STAGE  identical columns and indexes, loaded by the loader
+# Whole days are moved between the two with ALTER TABLE ... SWITCH, which is a
+# metadata operation, instead of a DELETE + INSERT of every row.
+
+format_yyyy_mm_dd = "%Y-%m-%d"
+
+
+def validate_date(value):
+    # Boundary values are written into DDL, so only accept real dates
+    return datetime.strptime(str(value)[:10], format_yyyy_mm_dd).strftime(format_yyyy_mm_dd)
+
+
+def partition_boundaries(cursor, partition_function):
+    cursor.execute("""
+        SELECT CONVERT(CHAR(10), prv.value, 126)
+        FROM sys.partition_range_values prv
+        JOIN sys.partition_functions pf ON pf.function_id = prv.function_id
+        WHERE pf.name = ?
+        ORDER BY prv.boundary_id
+    """, [partition_function])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_daily_boundaries(cursor, partition_function, partition_scheme, filegroup, dates):
+    """Split the partition function so every date in dates (and the day after the
+    last one) starts its own partition."""
+    if not dates:
+        return
+    dates = sorted({validate_date(date) for date in dates})
+    lastDate = datetime.strptime(dates[-1], format_yyyy_mm_dd) + timedelta(days=1)
+    dates.append(lastDate.strftime(format_yyyy_mm_dd))
+
+    existing = set(partition_boundaries(cursor, partition_function))
+    for date in dates:
+        if date in existing:
+            continue
+        cursor.execute(f"ALTER PARTITION SCHEME {partition_scheme} NEXT USED [{filegroup}]")
+        cursor.execute(f"ALTER PARTITION FUNCTION {partition_function}() SPLIT RANGE ('{date}')")
+        existing.add(date)
+
+
+def partition_number(cursor, partition_function, date):
+    cursor.execute(f"SELECT $PARTITION.{partition_function}(?)", [validate_date(date)])
+    return cursor.fetchone()[0]
+
+
+def populated_partitions(cursor, table):
+    cursor.execute("""
+        SELECT partition_number
+        FROM sys.partitions
+        WHERE object_id = OBJECT_ID(?) AND index_id IN (0, 1) AND rows > 0
+        ORDER BY partition_number
+    """, [table])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def staged_dates(cursor, staging_table, date_field):
+    cursor.execute(f"SELECT DISTINCT CONVERT(CHAR(10), {date_field}, 126) FROM {staging_table} WITH (NOLOCK)")
+    return [row[0] for row in cursor.fetchall() if row[0] is not None]
+
+
+def truncate_partitions(cursor, table, partitions):
+    if partitions:
+        cursor.execute(f"TRUNCATE TABLE {table} WITH (PARTITIONS ({', '.join(str(p) for p in partitions)}))")
+
+
+def switch_in(cursor, staging_table, target_table, partition_function, date_field, start_date):
+    """Replace every partition of target_table on or after start_date with the
+    staged partitions. Staged rows dated before start_date are appended, which
+    mirrors what trim() + load() would have done. Returns the switched dates."""
+    dates = staged_dates(cursor, staging_table, date_field)
+    firstPartition = partition_number(cursor, partition_function, start_date)
+
+    # Everything on or after the start date is replaced, as trim() would have deleted it
+    truncate_partitions(cursor, target_table,
+                        [p for p in populated_partitions(cursor, target_table) if p >= firstPartition])
+
+    cursor.execute(f"INSERT INTO {target_table} WITH (TABLOCK) SELECT * FROM {staging_table} WHERE {date_field} < ?",
+                   [validate_date(start_date)])
+
+    for partition in populated_partitions(cursor, staging_table):
+        if partition >= firstPartition:
+            cursor.execute(f"ALTER TABLE {staging_table} SWITCH PARTITION {partition} TO {target_table} PARTITION {partition}")
+
+    cursor.execute(f"TRUNCATE TABLE {staging_table}")
+    return [date for date in dates if date >= validate_date(start_date)]
+
+
+def switch_out_expired(cursor, tables, partition_function, cutoff_date):
+    """Empty the partitions wholly before cutoff_date on every table sharing the
+    partition function, then merge the now empty boundaries away."""
+    cutoff = validate_date(cutoff_date)
+    cutoffPartition = partition_number(cursor, partition_function, cutoff)
+    if cutoffPartition <= 1:
+        return []
+
+    for table in tables:
+        truncate_partitions(cursor, table,
+                            [p for p in populated_partitions(cursor, table) if p < cutoffPartition])
+
+    # Keep the boundary that starts the cutoff partition so no rows have to move
+    boundaries = partition_boundaries(cursor, partition_function)
+    expired = boundaries[:cutoffPartition - 2]
+    for boundary in expired:
+        cursor.execute(f"ALTER PARTITION FUNCTION {partition_function}() MERGE RANGE ('{boundary}')")
+    return expired
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+# Opt-in profiling of a single loader run (load.py --profile).
+#
+#   sample   - a background thread samples the loader's stack every few ms and
+#              writes <loader>.folded (one "frame;frame;frame count" line per
+#              stack), which flamegraph.pl and speedscope read directly
+#   cprofile - deterministic cProfile, written as <loader>.prof for snakeviz,
+#              flameprof or pstats
+# Both modes also trace allocations and write the peak and the top allocation
+# sites to <loader>.alloc.txt.
+
+SAMPLE = 'sample'
+CPROFILE = 'cprofile'
+PROFILE_MODES = (SAMPLE, CPROFILE)
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='SamplingProfiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def write_folded(self, path):
+        with open(path, 'w') as foldedFile:
+            for stack, count in sorted(self.stacks.items()):
+                foldedFile.write(f"{stack} {count}\n")
+
+
+class PeakSnapshotter:
+    """Keeps the tracemalloc snapshot taken closest to the allocation peak, so the
+    report shows what was alive at the peak rather than after the loader returned."""
+
+    def __init__(self, interval=0.25, growth=1.1):
+        self.interval = interval
+        self.growth = growth
+        self.snapshot = None
+        self.snapshot_size = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='PeakSnapshotter', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.check()
+
+    def check(self):
+        current = tracemalloc.get_traced_memory()[0]
+        if self.snapshot is None or current > self.snapshot_size * self.growth:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = current
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+
+def write_allocations(path, snapshot, peak, limit=25):
+    with open(path, 'w') as allocFile:
+        allocFile.write(f"Peak traced memory: {peak / (1024 * 1024):,.1f} MiB\n")
+        allocFile.write("Largest allocation sites near the peak:\n\n")
+        for stat in snapshot.statistics('lineno')[:limit]:
+            allocFile.write(f"{stat}\n")
+
+
+def profile_call(name, func, output_dir, mode=SAMPLE, log=None):
+    """Run func() under the selected profiler and write the profile files for name
+    into output_dir. Returns whatever func returns."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode}")
+    os.makedirs(output_dir, exist_ok=True)
+    basePath = os.path.join(output_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    tracingAlready = tracemalloc.is_tracing()
+    if not tracingAlready:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    snapshotter = PeakSnapshotter()
+    snapshotter.start()
+    startTime = time.perf_counter()
+    try:
+        if mode == CPROFILE:
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(func)
+            finally:
+                profiler.dump_stats(f"{basePath}.prof")
+        else:
+            sampler = SamplingProfiler(threading.get_ident())
+            sampler.start()
+            try:
+                return func()
+            finally:
+                sampler.stop()
+                sampler.write_folded(f"{basePath}.folded")
+    finally:
+        elapsed = time.perf_counter() - startTime
+        snapshotter.stop()
+        peak = tracemalloc.get_traced_memory()[1]
+        write_allocations(f"{basePath}.alloc.txt", snapshotter.snapshot, peak)
+        if not tracingAlready:
+            tracemalloc.stop()
+        if log:
+            log.info(f"Profiled {name} ({mode}) in {elapsed:.1f}s, peak traced memory "
+                     f"{peak / (1024 * 1024):,.1f} MiB: {basePath}.*")
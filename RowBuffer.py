@@ -0,0 +1,68 @@
+from operator import itemgetter
+
+# Reusable batch container for DBLoader loads.
+#
+# A loader used to build a new list per fetched row and keep the batch alive next
+# to the pyodbc Rows it came from. RowBuffer keeps one list per row slot and refills
+# the same lists for every batch: the columns are picked out of each source row in
+# C by itemgetter, converters run only on the columns that need them, and the
+# source rows can be dropped before the batch is inserted.
+#
+#     buffer = RowBuffer.from_description(cursor.description, ['AMOUNT', 'CARD_TYPE', ...], {0: float})
+#     while True:
+#         rows = cursor.fetchmany(batchSize)
+#         if not rows:
+#             break
+#         batch = buffer.fill(rows)
+#         del rows
+#         self.insert_batch(cursor, conn, sql, batch)
+#
+# The lists handed out are overwritten by the next fill(), so copy anything that
+# has to outlive the batch.
+
+
+class RowBuffer:
+    __slots__ = ('width', 'getter', 'converters', 'slots', 'count')
+
+    def __init__(self, source_indexes, converters=None):
+        self.width = len(source_indexes)
+        getter = itemgetter(*source_indexes)
+        # itemgetter of one index returns the value itself rather than a 1-tuple
+        self.getter = getter if self.width > 1 else (lambda row: (getter(row),))
+        self.converters = sorted((converters or {}).items())
+        self.slots = []
+        self.count = 0
+
+    @classmethod
+    def from_description(cls, description, columns, converters=None):
+        """Buffer taking the named columns, in that order, from rows whose layout is
+        the cursor description; converters maps output position to a function."""
+        positions = {column[0].upper(): index for index, column in enumerate(description)}
+        return cls([positions[column.upper()] for column in columns], converters)
+
+    def fill(self, rows):
+        """Copy rows into the slots and return the filled part as a list of lists."""
+        count = len(rows)
+        slots = self.slots
+        if count > len(slots):
+            width = self.width
+            slots.extend([None] * width for _ in range(count - len(slots)))
+        elif count < len(slots) // 2:
+            # The batch size came down; let the unused slots go
+            del slots[max(count, 1):]
+
+        getter = self.getter
+        for target, row in zip(slots, rows):
+            target[:] = getter(row)
+        for index, convert in self.converters:
+            for target in slots[:count]:
+                value = target[index]
+                if value is not None:
+                    target[index] = convert(value)
+
+        self.count = count
+        return slots if count == len(slots) else slots[:count]
+
+    def column(self, index):
+        """The values of one column of the current batch."""
+        return [target[index] for target in self.slots[:self.count]]
@@ -0,0 +1,116 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+# Local disk cache of S3 objects, keyed by bucket, key and ETag.
+#
+# An object is downloaded once into <folder>/<2 hex>/<sha256 of bucket/key/etag>; a
+# rerun or backfill that lists the same object with the same ETag reads the cached
+# copy instead. A changed object gets a new ETag and so a new entry. Every hit
+# touches the file's modified time, and the least recently used files are evicted
+# once the folder grows past max_bytes.
+#
+# fetch() pins the path it returns until release(path) is called, and eviction
+# skips pinned paths, so a concurrent worker's download never deletes a file
+# another worker is still reading.
+
+
+class S3Cache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # {path: number of callers using it}; guarded by lock, as is eviction
+        self.pinned = {}
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def path_for(self, bucket, key, etag):
+        etag = etag.strip('"')
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode('utf-8')).hexdigest()
+        extension = os.path.splitext(key)[1][:16]
+        return os.path.join(self.folder, digest[:2], digest + extension)
+
+    def get(self, bucket, key, etag):
+        path = self.path_for(bucket, key, etag)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        self.hits += 1
+        return path
+
+    def fetch(self, bucket, key, etag, download):
+        """Path of the cached object, calling download(path) to fill the cache on a miss.
+        The path stays pinned until release(path)."""
+        with self.lock:
+            path = self.get(bucket, key, etag)
+            if path:
+                self.pin(path)
+                return path
+            self.misses += 1
+
+        path = self.path_for(bucket, key, etag)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Download next to the final name and rename, so a crash never leaves a partial entry
+        handle, tmpPath = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(path))
+        os.close(handle)
+        try:
+            download(tmpPath)
+            with self.lock:
+                os.replace(tmpPath, path)
+                self.pin(path)
+        except BaseException:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+        self.evict()
+        return path
+
+    def pin(self, path):
+        self.pinned[path] = self.pinned.get(path, 0) + 1
+
+    def release(self, path):
+        with self.lock:
+            count = self.pinned.get(path, 0) - 1
+            if count > 0:
+                self.pinned[path] = count
+            else:
+                self.pinned.pop(path, None)
+
+    def contains(self, path):
+        return os.path.commonpath([os.path.abspath(path), os.path.abspath(self.folder)]) == os.path.abspath(self.folder)
+
+    def entries(self):
+        for root, dirs, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith('.part'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        with self.lock:
+            return self.evict_unpinned()
+
+    def evict_unpinned(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in self.pinned:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # Another process may have it open; it goes on a later eviction
+                pass
+        return total
@@ -0,0 +1,90 @@
+# Helpers for stage-and-swap loading of non-partitioned TRUST tables.
+#
+# The loader bulk inserts into TRUST.<NAME>_LOAD, an unindexed heap, while the
+# live table stays untouched. Once the load is validated the heap is indexed and
+#   'swap'  - the rows kept from the live table are copied into the heap first and
+#             the heap is renamed over the live table inside one transaction, so
+#             readers (including NOLOCK readers) only ever see a complete table
+#   'merge' - the trimmed range is deleted and the heap is inserted into the live
+#             table in one short transaction
+# Swap mode recreates only the indexes listed by the loader, so it is meant for
+# tables without named constraints or grants on the table itself.
+
+SWAP = 'swap'
+MERGE = 'merge'
+
+
+class StagingValidationError(Exception):
+    pass
+
+
+def table_columns(cursor, table):
+    # Computed columns cannot be inserted into
+    cursor.execute("""
+        SELECT name, is_identity
+        FROM sys.columns
+        WHERE object_id = OBJECT_ID(?) AND is_computed = 0
+        ORDER BY column_id
+    """, [table])
+    return [(row[0], bool(row[1])) for row in cursor.fetchall()]
+
+
+def create_heap(cursor, heap_table, live_table):
+    cursor.execute(f"DROP TABLE IF EXISTS {heap_table}")
+    cursor.execute(f"SELECT TOP 0 * INTO {heap_table} FROM {live_table}")
+
+
+def copy_rows(cursor, source_table, target_table, where=None, parameters=None, keep_identity=True):
+    # keep_identity copies identity values as they are; otherwise the target generates new ones
+    columns = table_columns(cursor, target_table)
+    hasIdentity = keep_identity and any(isIdentity for _, isIdentity in columns)
+    columnList = ', '.join(f'[{column}]' for column, isIdentity in columns if keep_identity or not isIdentity)
+    whereClause = f" WHERE {where}" if where else ""
+    if hasIdentity:
+        cursor.execute(f"SET IDENTITY_INSERT {target_table} ON")
+    try:
+        cursor.execute(f"INSERT INTO {target_table} WITH (TABLOCK) ({columnList}) "
+                       f"SELECT {columnList} FROM {source_table}{whereClause}", parameters or [])
+    finally:
+        if hasIdentity:
+            cursor.execute(f"SET IDENTITY_INSERT {target_table} OFF")
+
+
+def totals(cursor, table, amount_field):
+    if amount_field:
+        cursor.execute(f"SELECT COUNT(*), COALESCE(SUM({amount_field}), 0) FROM {table}")
+        count, amount = cursor.fetchone()
+        return count, amount
+    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+    return cursor.fetchone()[0], None
+
+
+def validate(staged, expected_count, expected_amount, label='Staged'):
+    count, amount = staged
+    if expected_count is not None and count != expected_count:
+        raise StagingValidationError(f"{label} {count} rows but the loader reported {expected_count}")
+    if expected_amount is not None and amount is not None and amount != expected_amount:
+        raise StagingValidationError(f"{label} amount {amount:,.2f} but the loader reported {expected_amount:,.2f}")
+
+
+def build_indexes(cursor, heap_table, indexes):
+    # indexes = [(index_name, column_list, clustered)]; clustered first so the heap is only rebuilt once
+    for indexName, columns, clustered in sorted(indexes, key=lambda index: not index[2]):
+        kind = 'CLUSTERED' if clustered else 'NONCLUSTERED'
+        cursor.execute(f"CREATE {kind} INDEX {indexName} ON {heap_table} ({columns})")
+
+
+def swap(cursor, heap_table, live_table):
+    schema, live = live_table.split('.', 1)
+    heap = heap_table.split('.', 1)[1]
+    oldTable = f"{live}_OLD"
+    cursor.execute(f"DROP TABLE IF EXISTS {schema}.{oldTable}")
+    cursor.execute("EXEC sp_rename ?, ?", [live_table, oldTable])
+    cursor.execute("EXEC sp_rename ?, ?", [heap_table, live])
+    return f"{schema}.{oldTable}"
+
+
+def merge(cursor, heap_table, live_table, date_field, replace_from_date):
+    if replace_from_date is not None:
+        cursor.execute(f"DELETE FROM {live_table} WHERE {date_field} >= ?", [replace_from_date])
+    copy_rows(cursor, heap_table, live_table, keep_identity=False)
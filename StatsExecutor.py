@@ -0,0 +1,175 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from Globals import *
+from Utils import *
+from ConnectionPool import ConnectionPool
+from StageSwap import table_columns
+
+# Runs every loader's stat_queries concurrently and writes the results to the
+# TRUST stats tables (TRUST.UNMATCHED_STATS, TRUST.UNMATCHED, TRUST.STATS).
+#
+# Each loader's rows replace the rows of the SOURCE values its queries produce, in
+# their own savepoint, so a loader whose query or insert fails keeps its previous
+# stats and the other loaders are still refreshed. With dates only those
+# TRANSACTION_DATEs are recomputed and replaced (micro-batch refreshes).
+
+SOURCE_LITERAL = re.compile(r"'([^']+)'\s+AS\s+SOURCE\b", re.IGNORECASE)
+
+
+def normalize_stat_queries(loaders):
+    """Flatten loader.stat_queries into (target, loader name, sql). Loaders use both
+    the BaseLoader keys and upper case string keys, and single queries or lists."""
+    queries = []
+    for loaderName in loaders:
+        statQueries = getattr(loaders[loaderName], 'stat_queries', None) or {}
+        for target, sqls in statQueries.items():
+            if isinstance(sqls, str):
+                sqls = [sqls]
+            for sql in sqls:
+                queries.append((target.upper(), loaderName, sql))
+    return queries
+
+
+def date_filter(dates):
+    return f"TRANSACTION_DATE IN ({', '.join('?' for _ in dates)})"
+
+
+def run_query(pool, sql, dates=None):
+    conn = pool.acquire()
+    cursor = conn.cursor()
+    try:
+        startTime = time.perf_counter()
+        if dates:
+            cursor.execute(f"SELECT * FROM ({sql}) AS STAT_QUERY WHERE {date_filter(dates)}", list(dates))
+        else:
+            cursor.execute(sql)
+        columns = tuple(column[0] for column in cursor.description)
+        rows = [list(row) for row in cursor.fetchall()]
+        return columns, rows, time.perf_counter() - startTime
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def result_sources(sql, columns, rows):
+    # The SOURCE values a query writes: its 'X' AS SOURCE literals, plus any it returned
+    sources = set(SOURCE_LITERAL.findall(sql))
+    if 'SOURCE' in columns:
+        index = columns.index('SOURCE')
+        sources.update(row[index] for row in rows)
+    return sources
+
+
+def insert_columns(columns, tableColumns):
+    # Insert by name when every alias is a column of the table; otherwise positionally
+    # into the table's own column order, as CollectStats does (EMAF calls the merchant
+    # MERCHANT_ACCT where the other loaders say MERCHANT_ID)
+    names = {column.upper() for column in tableColumns}
+    if all(column.upper() in names for column in columns):
+        return list(columns)
+    if len(columns) > len(tableColumns):
+        raise ValueError(f"Stats query returns {len(columns)} columns, the table has {len(tableColumns)}")
+    return tableColumns[:len(columns)]
+
+
+def write_results(pool, target, results, log, dates=None):
+    # results = {loaderName: (sources, [(columns, rows)])}; returns (rows inserted, failed loaders)
+    table = f"TRUST.{target}"
+    conn = pool.acquire()
+    cursor = conn.cursor()
+    try:
+        cursor.fast_executemany = True
+        tableColumns = [column for column, isIdentity in table_columns(cursor, table) if not isIdentity]
+        rowCount = 0
+        failedLoaders = []
+        for loaderName, (sources, queryResults) in results.items():
+            cursor.execute("SAVE TRANSACTION LOADER_STATS")
+            try:
+                if sources:
+                    where = f"SOURCE IN ({', '.join('?' for _ in sources)})"
+                    parameters = sorted(sources)
+                    if dates:
+                        where += f" AND {date_filter(dates)}"
+                        parameters += list(dates)
+                    cursor.execute(f"DELETE FROM {table} WHERE {where}", parameters)
+                loaderRows = 0
+                for columns, rows in queryResults:
+                    if rows:
+                        columnList = ', '.join(insert_columns(columns, tableColumns))
+                        placeholders = ', '.join('?' for _ in columns)
+                        cursor.executemany(f"INSERT INTO {table} ({columnList}) VALUES ({placeholders})", rows)
+                        loaderRows += len(rows)
+                rowCount += loaderRows
+            except Exception as e:
+                cursor.execute("ROLLBACK TRANSACTION LOADER_STATS")
+                failedLoaders.append(loaderName)
+                log.error(f"{loaderName}: could not write {table}, its previous stats are kept: {repr(e)}")
+        conn.commit()
+        return rowCount, failedLoaders
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def collect(loaders, log, parallelism=None, pool=None, dates=None):
+    """Refresh the stats tables from every loader's stat_queries; with dates only
+    those TRANSACTION_DATEs. Returns the (target, loader) pairs left unrefreshed."""
+    parallelism = parallelism or stats_parallelism
+    queries = normalize_stat_queries(loaders)
+    scope = f" for {', '.join(dates)}" if dates else ""
+    log.info(f"Started collecting stats: {len(queries)} queries{scope} with parallelism {parallelism}")
+
+    ownPool = pool is None
+    if ownPool:
+        pool = ConnectionPool(lambda: db_conn(sql_server, sql_working_database, sql_working_username, sql_working_password), parallelism)
+
+    results = {}
+    failed = set()
+    try:
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            futures = {executor.submit(run_query, pool, sql, dates): (target, loaderName, sql)
+                       for target, loaderName, sql in queries}
+            for future in as_completed(futures):
+                target, loaderName, sql = futures[future]
+                try:
+                    columns, rows, elapsed = future.result()
+                except Exception as e:
+                    failed.add((target, loaderName))
+                    log.error(f"Stats query {target} for {loaderName} failed, its previous stats are kept: {repr(e)}")
+                    continue
+                log.debug(f"Stats query {target} for {loaderName} returned {len(rows)} rows in {elapsed:.2f}s")
+                sources, queryResults = results.setdefault(target, {}).setdefault(loaderName, (set(), []))
+                sources.update(result_sources(sql, columns, rows))
+                queryResults.append((columns, rows))
+
+        # A loader with a failed query keeps all of its previous rows in that table
+        for target, loaderName in failed:
+            results.get(target, {}).pop(loaderName, None)
+
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            futures = {executor.submit(write_results, pool, target, loaderResults, log, dates): target
+                       for target, loaderResults in results.items() if loaderResults}
+            for future in as_completed(futures):
+                target = futures[future]
+                try:
+                    rowCount, failedLoaders = future.result()
+                except Exception as e:
+                    failed.update((target, loaderName) for loaderName in results[target])
+                    log.error(f"Could not write TRUST.{target}, its previous stats are kept: {repr(e)}")
+                    continue
+                failed.update((target, loaderName) for loaderName in failedLoaders)
+                log.info(f"Inserted {rowCount} rows into TRUST.{target}")
+    finally:
+        if ownPool:
+            pool.close_all()
+
+    if failed:
+        log.error(f"Finished collecting stats; not refreshed: {', '.join(f'{loader} {target}' for target, loader in sorted(failed))}")
+    else:
+        log.info("Finished collecting stats")
+    return failed
@@ -1,14 +1,17 @@
 import os
 import tempfile
+import threading
 import logging
 import pyodbc
-import boto3
 import argparse
-import pytz
 from datetime import datetime, timedelta
-from pandas.tseries.holiday import USFederalHolidayCalendar
 from LogDbHandler import *
 from Globals import *
+from Instrumentation import metrics
+from ConnectionPool import ConnectionPool
+
+# boto3, pytz and pandas are imported inside the functions that use them so that
+# processes which never touch S3 or the holiday calendar start quickly
 
 # Define date formats
 format_yyyy_mm_dd = "%Y-%m-%d"
@@ -16,8 +19,18 @@ format_mm_dd_yyyy = "%m-%d-%Y"
 
 # Global variables
 session = None
+shared_s3_client = None
+s3_transfer_config = None
+s3_lock = threading.Lock()
+s3_cache = None
 logging_init_count = 0
 log_conn = None
+# While a long-running process (Daemon.py) has installed pools, db_conn hands out
+# pooled connections, one pool per server, database and login; close() returns them
+connection_pools = None
+connection_pool_size = None
+connection_pool_timeout = None
+connection_pools_lock = threading.Lock()
 
 def str2bool(v):
     if isinstance(v, bool):
@@ -31,17 +44,44 @@ def str2bool(v):
 
 def get_s3_session():
     global session
-    if session is None:
-        session = boto3.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key
-        )
+    with s3_lock:
+        if session is None:
+            import boto3
+            session = boto3.Session(
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key
+            )
     return session
 
+def get_s3_client():
+    # One client for the process: clients are thread-safe and own the connection pool,
+    # which is sized for the multipart transfer threads
+    global shared_s3_client
+    if shared_s3_client is None:
+        session = get_s3_session()
+        from botocore.config import Config as BotoConfig
+        with s3_lock:
+            if shared_s3_client is None:
+                shared_s3_client = session.client('s3', config=BotoConfig(
+                    max_pool_connections=max(s3_max_pool_connections, s3_max_concurrency),
+                    retries={'max_attempts': s3_retry_attempts, 'mode': 'adaptive'}
+                ))
+    return shared_s3_client
+
+def get_s3_transfer_config():
+    global s3_transfer_config
+    if s3_transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+        s3_transfer_config = TransferConfig(
+            multipart_threshold=s3_multipart_threshold_mb * 1024 * 1024,
+            multipart_chunksize=s3_multipart_chunksize_mb * 1024 * 1024,
+            max_concurrency=s3_max_concurrency,
+            use_threads=s3_max_concurrency > 1
+        )
+    return s3_transfer_config
+
 def open_s3_file(file_name):
-    # Create an S3 client session
-    session = get_s3_session()
-    s3_client = session.client('s3')
+    s3_client = get_s3_client()
 
     # Retrieve the file object from S3
     response = s3_client.get_object(Bucket=aws_bucket_name, Key=file_name)
@@ -51,14 +91,48 @@ def open_s3_file(file_name):
     file_content = response['Body'].iter_lines()
     return file_content
 
-def s3_download(s3_client, file_key):
+def get_s3_cache():
+    # None when S3_CACHE_MAX_MB is 0
+    global s3_cache
+    if s3_cache is None and s3_cache_max_mb > 0:
+        from S3Cache import S3Cache
+        with s3_lock:
+            if s3_cache is None:
+                s3_cache = S3Cache(s3_cache_folder, s3_cache_max_mb * 1024 * 1024)
+    return s3_cache
+
+def s3_download_to(s3_client, file_key, path):
+    with metrics.timer('S3', 'file_io'):
+        s3_client.download_file(aws_bucket_name, file_key, path, Config=get_s3_transfer_config())
+    metrics.count('S3', bytes=os.path.getsize(path))
+
+def s3_download(s3_client, file_key, etag=None):
+    # With an ETag the object comes from (or goes into) the local cache; the caller
+    # hands the returned path to release_s3_download() once it has been processed
+    cache = get_s3_cache()
+    if cache is not None and etag:
+        misses = cache.misses
+        path = cache.fetch(aws_bucket_name, file_key, etag, lambda path: s3_download_to(s3_client, file_key, path))
+        log.debug(f"S3 cache {'miss' if cache.misses > misses else 'hit'} for {file_key}: {path}")
+        return path
+
     f = tempfile.mkstemp(suffix='.tmp')
     tmpPath = f[1]
     os.close(f[0])
-    s3_client.download_file(aws_bucket_name, file_key, tmpPath)
+    s3_download_to(s3_client, file_key, tmpPath)
     return tmpPath
 
-def load_from_s3_response(response, file_object_check, process_file, startDate, endDate, s3_client):
+def is_s3_cached(path):
+    return s3_cache is not None and s3_cache.contains(path)
+
+def release_s3_download(path):
+    # Unpins a cached object so it can be evicted again, or deletes the tmp file
+    if is_s3_cached(path):
+        s3_cache.release(path)
+    else:
+        os.remove(path)
+
+def load_from_s3_response(response, file_object_check, process_file, startDate, endDate, s3_client, skip_check=None):
     foundCount = response['KeyCount']
     if foundCount > 0:
         file_objects = response['Contents']
@@ -67,25 +141,28 @@ def load_from_s3_response(response, file_object_check, process_file, startDate,
             if doProcess:
                 # Get the key (file path) of the object
                 file_key = file_object['Key']
-                log.info("Started File: " + file_key + " for date: " + str(fileDate))
 
-                # Copy file from S3 to tmp file
-                tmpPath = s3_download(s3_client, file_key)
-                process_file(tmpPath, file_key, fileDate, startDate)
+                # skip_check(key, etag, fileDate) lets the caller skip a file before it is downloaded
+                if skip_check and skip_check(file_key, file_object.get('ETag'), fileDate):
+                    continue
+                log.info("Started File: " + file_key + " for date: " + str(fileDate))
 
-                # Delete tmp file
-                os.remove(tmpPath)
+                # Copy file from S3 to the local cache, or a tmp file when the cache is off
+                tmpPath = s3_download(s3_client, file_key, file_object.get('ETag'))
+                try:
+                    process_file(tmpPath, file_key, fileDate, startDate)
+                finally:
+                    release_s3_download(tmpPath)
     else:
         log.warning("No files found in: " + response['Prefix'])
 
-def load_from_s3(fileFolder, file_object_check, process_file, startDate, endDate):
+def load_from_s3(fileFolder, file_object_check, process_file, startDate, endDate, skip_check=None):
     log.info("Using S3 bucket: " + fileFolder)
-    session = get_s3_session()
-    s3_client = session.client('s3')
+    s3_client = get_s3_client()
     response = s3_client.list_objects_v2(Bucket=aws_bucket_name, Prefix=fileFolder)
 
     while True:
-        load_from_s3_response(response, file_object_check, process_file, startDate, endDate, s3_client)
+        load_from_s3_response(response, file_object_check, process_file, startDate, endDate, s3_client, skip_check)
         
         # S3 returns IsTruncated == True whenever there are more than 1000 file objects left
         isTruncated = response['IsTruncated']
@@ -94,8 +171,8 @@ def load_from_s3(fileFolder, file_object_check, process_file, startDate, endDate
         continuationToken = response['NextContinuationToken']
         response = s3_client.list_objects_v2(Bucket=aws_bucket_name, Prefix=fileFolder, ContinuationToken=continuationToken)
 
-def load_from_directory(fileFolder, dir_entry_check, process_file, startDate, endDate):
-    fileDir = os.path.join(data_input_folder, fileFolder)
+def load_from_directory(fileFolder, dir_entry_check, process_file, startDate, endDate, inputFolder=None):
+    fileDir = os.path.join(inputFolder or data_input_folder, fileFolder)
     log.info("Using file directory: " + fileDir)
     
     for dirEntry in os.scandir(fileDir):
@@ -104,7 +181,37 @@ def load_from_directory(fileFolder, dir_entry_check, process_file, startDate, en
             log.info("Started File: " + dirEntry.path + " for date: " + str(fileDate))
             process_file(dirEntry.path, dirEntry.path, fileDate, startDate)
 
+def install_connection_pool(size, timeout=None):
+    global connection_pools
+    global connection_pool_size
+    global connection_pool_timeout
+
+    with connection_pools_lock:
+        connection_pools = {}
+        connection_pool_size = size
+        connection_pool_timeout = timeout
+
+def close_connection_pools():
+    global connection_pools
+
+    with connection_pools_lock:
+        pools, connection_pools = connection_pools, None
+    for pool in (pools or {}).values():
+        pool.close_all()
+
 def db_conn(sql_server, sql_database, sql_username, sql_password, use_sql_trusted_connection=sql_trusted_connection_enabled):
+    if connection_pools is None:
+        return open_connection(sql_server, sql_database, sql_username, sql_password, use_sql_trusted_connection)
+    key = (sql_server, sql_database, sql_username, use_sql_trusted_connection)
+    with connection_pools_lock:
+        pool = connection_pools.get(key)
+        if pool is None:
+            pool = connection_pools[key] = ConnectionPool(
+                lambda: open_connection(sql_server, sql_database, sql_username, sql_password, use_sql_trusted_connection),
+                connection_pool_size, connection_pool_timeout)
+    return pool.acquire()
+
+def open_connection(sql_server, sql_database, sql_username, sql_password, use_sql_trusted_connection=sql_trusted_connection_enabled):
     if use_sql_trusted_connection:
         return pyodbc.connect("Driver={" + sql_driver + "};"
                               "Server=" + sql_server + ";"
@@ -143,6 +250,7 @@ def filter_file_by_modified_time(dirEntry, startDate, endDate):
     return True, fileDate
 
 def filter_file_by_modified_time_s3(file_object, startDate, endDate, s3_client):
+    import pytz
     fileStartDateTime = datetime.strptime(startDate, format_yyyy_mm_dd) + timedelta(days=+1)
     fileEndDateTime = datetime.strptime(endDate, format_yyyy_mm_dd) + timedelta(days=+1)
 
@@ -238,6 +346,9 @@ def init_logger():
     
     logger = logging.getLogger('TRUST_LOGGER')
     if logger.hasHandlers():
+        # A long-running process initialises the logger once per run; release the old files
+        for handler in logger.handlers:
+            handler.close()
         logger.handlers.clear()
     
     logger.addHandler(console)
@@ -261,6 +372,8 @@ def files_available_check(startDate, endDate, dirEntry, log):
         log.warning('End date supplied is later than today. Setting End Date to today and continuing.')
         endDate = today
     
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+
     files = ['AmericanExpress']
     cal = USFederalHolidayCalendar()
     holidays = cal.holidays(start='2022-01-01', end='2099-12-31').to_pydatetime()
@@ -3,15 +3,22 @@ import sys
 import traceback
 import logging
 import csv
+import time
 import pyodbc
 from pprint import pprint
-from datetime import datetime
+from datetime import datetime, timedelta
 import argparse
 
 # Fetch the Global Variables
 from Globals import *
 from LogDbHandler import *
 from Utils import *
+import PartitionSwitch
+import StageSwap
+from AdaptiveBatch import AdaptiveBatchSizer, estimate_row_bytes
+from Instrumentation import metrics
+import IncrementalStats
+from IncrementalStats import StatsAccumulator
 
 class BaseLoader:
     UNMATCHED_STATS = 'unmatched_stats'
@@ -21,26 +28,162 @@ class BaseLoader:
     def __init__(self, name, log: logging.Logger, startDate, endDate) -> None:
         self.log = log
         self.db_conn = db_conn
-        self.sql_server = sql_server
-        self.sql_working_database = sql_working_database
-        self.sql_working_username = sql_working_username
-        self.sql_working_password = sql_working_password
         self.trim_date_field = "transaction_date"
-        self.sql_batch_size = sql_batch_size
         self.startDate = startDate
         self.endDate = endDate
         self.name = name
-        
+        self.configure(trust_config.for_loader(name))
+
+        # Date-partitioned targets: setting partition_function and partition_scheme makes the
+        # loader fill TRUST.<name>_STAGE and switch whole days into TRUST.<name> on publish()
+        self.partition_function = None
+        self.partition_scheme = None
+        self.partition_filegroup = 'PRIMARY'
+        self.partition_retention_days = self.config.matching_window_in_days
+
+        # Stage-and-swap targets: staging_mode 'swap' or 'merge' makes the loader fill the heap
+        # TRUST.<name>_LOAD, which publish() validates, indexes and swaps/merges into TRUST.<name>
+        self.staging_mode = None
+        self.staging_indexes = []
+        self.amount_field = 'AMOUNT'
+        self.replace_from_date = None
+        self.trimmed = False
+        self.staged_base_totals = (0, 0)
+
+        # Totals reported by load() for validation; None means the loader does not report them.
+        # Loaders that set reconcile_date_field have them checked against COUNT(*)/SUM(AMOUNT)
+        # of the reloaded date range of the live table after publish(). reconcile_date_field should
+        # be the trim column; a loader that selects its source by another date sets
+        # reconcile_totals to the (count, amount) of the loaded rows in the window by that column
+        self.reconcile_date_field = None
+        self.reconcile_totals = None
+
+        # (source, target) LoadVerifier.Checksum pair for per-date verification against DATADB;
+        # reload_dates() re-extracts the dates that differ straight into the live table
+        self.verification = None
+        self.reloading = False
+
+        # Loaders with a load_incremental() merge only new source rows into the live table when
+        # incremental is set (load.py --incremental): no trim, staging or partition switching
+        self.incremental = False
+
+        # Dates whose rows changed in this run, for micro-batch matching and stats (MicroBatch)
+        self.affected_dates = set()
+        self.loaded_count = None
+        self.loaded_amount = None
+        self.load_failed = False
+
+        # Loaders that capture per-date/per-merchant stats from their insert batches set these
+        # through use_incremental_stats(); full_stat_queries keeps the full-table queries
+        self.incremental_stats = None
+        self.full_stat_queries = None
+
         self.matching_tables_to_clean = {
             self.UNMATCHED_STATS: [],
             self.UNMATCHED: [],
             self.STATS: []
         }
+        # How micro-batch refreshes match again: get_matchers(matchDate) selects either that
+        # one day (TRANSACTION_DATE = ?) or every transaction on or after it (>= ?)
+        self.matches_on_or_after = False
+        # TRUST tables other than target_table that the matchers read; a refresh of the
+        # loader that owns one of them matches this loader again too
+        self.matching_source_tables = []
+
+    def configure(self, config):
+        """Apply a TrustConfig (normally trust_config.for_loader(name)) to this loader:
+        connection settings, batch sizing, data source and parallelism."""
+        self.config = config
+        self.sql_server = config.sql_server
+        self.sql_working_database = config.sql_working_database
+        self.sql_working_username = config.sql_working_username
+        self.sql_working_password = config.sql_working_password
+        self.sql_datastore_server = config.sql_datastore_server
+        self.sql_datastore_database = config.sql_datastore_database
+        self.sql_datastore_username = config.sql_datastore_username
+        self.sql_datastore_password = config.sql_datastore_password
+        self.sql_batch_size = config.sql_batch_size
+        self.use_s3_buckets = config.use_s3_buckets_enabled
+        self.data_input_folder = config.data_input_folder
+        self.parallelism = config.parallelism
+        self.async_ingestion = config.async_ingestion
+
+        # executemany batch size per target table, tuned from the insert latency and row width;
+        # a per-loader SQL_BATCH_SIZE override wins over the learned size and caps it
+        self.batch_sizer = AdaptiveBatchSizer(self.target_table, config.sql_batch_size, config.sql_batch_memory_mb * 1024 * 1024,
+                                              config.sql_batch_target_seconds, config.batch_size_history_path,
+                                              config.sql_batch_adaptive,
+                                              cap=config.loader_override('sql_batch_size') is not None)
+
+    @property
+    def is_partitioned(self):
+        return self.partition_function is not None and self.partition_scheme is not None
+
+    @property
+    def switches_partitions(self):
+        # trim() prepares the stage; without a trim rows go straight into the live table
+        return self.is_partitioned and self.trimmed
+
+    @property
+    def supports_incremental(self):
+        return callable(getattr(self, 'load_incremental', None))
+
+    @property
+    def supports_micro_batch(self):
+        # Whether the loader can refresh the live table repeatedly without a trim
+        return self.supports_incremental
+
+    @property
+    def target_table(self):
+        return f"TRUST.{self.name}"
+
+    @property
+    def load_table(self):
+        # The table the loader's INSERT statements should write to
+        if self.reloading:
+            return self.target_table
+        if self.switches_partitions:
+            return f"TRUST.{self.name}_STAGE"
+        if self.staging_mode:
+            return f"TRUST.{self.name}_LOAD"
+        return self.target_table
+
+    def connect_working(self):
+        return self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+
+    def connect_datastore(self):
+        return self.db_conn(self.sql_datastore_server, self.sql_datastore_database, self.sql_datastore_username, self.sql_datastore_password)
+
+    def insert_batch(self, cursor, conn, sql, rows, before_commit=None, commit=True):
+        # executemany + commit one batch and let the batch sizer adjust to how long it took;
+        # before_commit(cursor) adds statements that must commit with these rows, commit=False
+        # leaves them in the caller's transaction
+        if not rows:
+            return
+        startTime = time.perf_counter()
+        with metrics.timer(self.name, 'insert'):
+            cursor.executemany(sql, rows)
+        if before_commit:
+            before_commit(cursor)
+        if commit:
+            with metrics.timer(self.name, 'commit'):
+                conn.commit()
+        self.batch_sizer.record(len(rows), time.perf_counter() - startTime, rows[0])
+        metrics.count(self.name, rows=len(rows), bytes=estimate_row_bytes(rows[0]) * len(rows))
 
     def load(self):
         raise NotImplementedError(f"Loader {self.name} has not implemented the load method")
 
     def trim(self):
+        self.trimmed = True
+        if self.is_partitioned:
+            self.prepare_partitions()
+            return
+        if self.staging_mode:
+            # The live table is trimmed when the staged rows are published
+            self.replace_from_date = self.startDate
+            return
+
         conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
         cursor = conn.cursor()
         try:
@@ -52,6 +195,256 @@ class BaseLoader:
             cursor.close()
             conn.close()
 
+    def prepare_partitions(self):
+        # Empty the staging table and split out a partition per day before rows arrive, so the
+        # splits never have to move data
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            self.log.info(f'Preparing partitions on {self.load_table} for {self.startDate} to but not including {self.endDate}')
+            cursor.execute(f'TRUNCATE TABLE {self.load_table}')
+            dates = []
+            currentDate = datetime.strptime(self.startDate, "%Y-%m-%d")
+            while currentDate < datetime.strptime(self.endDate, "%Y-%m-%d"):
+                dates.append(currentDate.strftime("%Y-%m-%d"))
+                currentDate += timedelta(days=1)
+            PartitionSwitch.ensure_daily_boundaries(cursor, self.partition_function, self.partition_scheme,
+                                                    self.partition_filegroup, dates)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def prepare_load(self):
+        # Called before load(); creates the heap the staged loaders insert into
+        if self.incremental or self.is_partitioned or not self.staging_mode:
+            return
+
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            self.log.info(f'Creating staging heap {self.load_table} for {self.target_table}')
+            StageSwap.create_heap(cursor, self.load_table, self.target_table)
+            if self.staging_mode == StageSwap.SWAP:
+                # The heap replaces the live table, so it starts with the rows a trim would keep
+                if self.replace_from_date is None:
+                    StageSwap.copy_rows(cursor, self.target_table, self.load_table)
+                else:
+                    StageSwap.copy_rows(cursor, self.target_table, self.load_table,
+                                        f'{self.trim_date_field} < ?', [self.replace_from_date])
+            self.staged_base_totals = StageSwap.totals(cursor, self.load_table, self.amount_field)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def publish(self):
+        # Called after load(); a failed load leaves the live table as it was. Returns
+        # whether the loaded rows are now in the live table
+        self.batch_sizer.save()
+        if self.load_failed:
+            if self.switches_partitions or self.staging_mode:
+                self.log.error(f'{self.name}: load failed, {self.target_table} left unchanged')
+            elif self.incremental_stats is not None:
+                self.log.warning(f'{self.name}: load failed, incremental stats are stale until rebuilt with --rebuildStats')
+            return False
+
+        if self.incremental:
+            # load_incremental() merged into the live table and rebuilt the stats it touched
+            return True
+
+        published = True
+        if self.switches_partitions:
+            published = self.publish_partitions()
+        elif self.staging_mode:
+            published = self.publish_staging()
+
+        if published and self.incremental_stats is not None:
+            self.merge_incremental_stats()
+        # Staged loads were validated before they were swapped in
+        if published and self.reconcile_date_field and not self.staging_mode and self.trimmed:
+            self.reconcile()
+        return published
+
+    def reconcile(self):
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            with metrics.timer(self.name, 'reconcile'):
+                cursor.execute(f"""
+                    SELECT COUNT(*), COALESCE(SUM({self.amount_field}), 0) FROM {self.target_table} WITH (NOLOCK)
+                    WHERE {self.reconcile_date_field} >= ? AND {self.reconcile_date_field} < ?
+                """, [self.startDate, self.endDate])
+                count, amount = cursor.fetchone()
+            expectedCount, expectedAmount = self.reconcile_totals or (self.loaded_count, self.loaded_amount)
+            StageSwap.validate((count, amount), expectedCount, expectedAmount, label=self.target_table)
+            self.log.info(f'{self.name}: {self.target_table} reconciles with the load: {count} rows, amount {amount:,.2f}')
+            return True
+        except StageSwap.StagingValidationError as e:
+            self.log.error(f'{self.name}: {self.target_table} does not reconcile for {self.startDate} to but not including {self.endDate}: {e}')
+            return False
+        finally:
+            cursor.close()
+            conn.close()
+
+    def publish_staging(self):
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            count, amount = StageSwap.totals(cursor, self.load_table, self.amount_field)
+            baseCount, baseAmount = self.staged_base_totals
+            stagedAmount = None if amount is None else amount - (baseAmount or 0)
+            StageSwap.validate((count - baseCount, stagedAmount), self.loaded_count, self.loaded_amount)
+
+            self.log.info(f'Building indexes on {self.load_table}')
+            StageSwap.build_indexes(cursor, self.load_table, self.staging_indexes)
+            conn.commit()
+
+            if self.staging_mode == StageSwap.SWAP:
+                self.log.info(f'Swapping {self.load_table} in as {self.target_table}')
+                oldTable = StageSwap.swap(cursor, self.load_table, self.target_table)
+                conn.commit()
+                cursor.execute(f'DROP TABLE {oldTable}')
+            else:
+                self.log.info(f'Merging {self.load_table} into {self.target_table}')
+                StageSwap.merge(cursor, self.load_table, self.target_table, self.trim_date_field, self.replace_from_date)
+                conn.commit()
+                cursor.execute(f'DROP TABLE {self.load_table}')
+            conn.commit()
+            self.log.info(f'Published {count - baseCount} staged rows to {self.target_table}')
+            return True
+        except StageSwap.StagingValidationError as e:
+            conn.rollback()
+            self.log.error(f'{self.name}: staged load failed validation, {self.target_table} left unchanged: {e}')
+            return False
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def publish_partitions(self):
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            # The daily boundaries were split by prepare_partitions() while the stage was empty
+            self.log.info(f'Switching staged partitions from {self.load_table} into {self.target_table} on or after: {self.startDate}')
+            switched = PartitionSwitch.switch_in(cursor, self.load_table, self.target_table,
+                                                 self.partition_function, self.trim_date_field, self.startDate)
+            conn.commit()
+            self.log.info(f'Switched {len(switched)} partitions into {self.target_table}')
+
+            if self.partition_retention_days:
+                cutoffDate = (datetime.now() - timedelta(days=self.partition_retention_days)).strftime("%Y-%m-%d")
+                expired = PartitionSwitch.switch_out_expired(cursor, [self.target_table, self.load_table],
+                                                             self.partition_function, cutoffDate)
+                conn.commit()
+                if expired:
+                    self.log.info(f'Switched out {len(expired)} expired partitions from {self.target_table} before: {cutoffDate}')
+                if self.incremental_stats is not None:
+                    cursor.execute(f'DELETE FROM {IncrementalStats.STATS_TABLE} WHERE SOURCE = ? AND TRANSACTION_DATE < ?',
+                                   [self.incremental_stats.source, cutoffDate])
+                    conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def reload_dates(self, dates):
+        """Delete and load again single days of the live table, normally the dates
+        LoadVerifier found to differ from the source. Returns the dates that failed."""
+        dateField = self.verification[1].date
+        window = (self.startDate, self.endDate)
+        incremental = self.incremental
+        failed = []
+        self.reloading = True
+        self.incremental = False
+        try:
+            for date in dates:
+                nextDate = (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+                conn = self.connect_working()
+                cursor = conn.cursor()
+                try:
+                    statsDates = set()
+                    if self.incremental_stats is not None:
+                        # The stats of every date the deleted rows counted towards are rebuilt
+                        cursor.execute(f"SELECT DISTINCT CONVERT(CHAR(10), {self.incremental_stats.date_field}, 126) FROM {self.target_table} "
+                                       f"WHERE {dateField} >= ? AND {dateField} < ?", [date, nextDate])
+                        statsDates = {row[0] for row in cursor.fetchall()}
+                    self.log.info(f'{self.name}: reloading {date} into {self.target_table}')
+                    cursor.execute(f"DELETE FROM {self.target_table} WHERE {dateField} >= ? AND {dateField} < ?", [date, nextDate])
+                    conn.commit()
+
+                    self.startDate, self.endDate = date, nextDate
+                    self.load_failed = False
+                    with metrics.timer(self.name, 'reload'):
+                        self.load()
+                    if self.load_failed:
+                        self.log.error(f'{self.name}: reload of {date} failed, it is incomplete until reloaded')
+                        failed.append(date)
+
+                    if self.incremental_stats is not None:
+                        statsDates.update(self.incremental_stats.dates())
+                        self.incremental_stats.clear()
+                        self.incremental_stats.rebuild(cursor, sorted(date for date in statsDates if date))
+                        conn.commit()
+                finally:
+                    cursor.close()
+                    conn.close()
+        finally:
+            self.startDate, self.endDate = window
+            self.reloading = False
+            self.incremental = incremental
+        return failed
+
+    def use_incremental_stats(self, accumulator: StatsAccumulator, stat_queries):
+        self.incremental_stats = accumulator
+        self.full_stat_queries = self.stat_queries
+        self.stat_queries = stat_queries
+
+    def use_full_stat_queries(self):
+        # On demand: aggregate over the whole TRUST table again
+        if self.full_stat_queries is not None:
+            self.stat_queries = self.full_stat_queries
+
+    def merge_incremental_stats(self):
+        # Trimmed dates are replaced, dates before the trim only had rows appended
+        replaceFromDate = self.startDate if self.trimmed else None
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            self.incremental_stats.merge(cursor, replaceFromDate)
+            conn.commit()
+            self.affected_dates.update(self.incremental_stats.dates())
+            self.log.info(f'Merged {len(self.incremental_stats.aggregates)} {self.name} stats groups into {IncrementalStats.STATS_TABLE}')
+            self.incremental_stats.clear()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def rebuild_incremental_stats(self):
+        if self.incremental_stats is None:
+            return
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            self.log.info(f'Rebuilding {self.name} stats in {IncrementalStats.STATS_TABLE} from {self.target_table}')
+            self.incremental_stats.rebuild(cursor)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
     def clean_matching_tables(self):
         tables_to_clean = self.matching_tables_to_clean
         if len(tables_to_clean) > 0:
@@ -65,6 +458,36 @@ class BaseLoader:
                 cursor.close()
                 conn.close()
 
+    def clean_matching_dates(self, dates):
+        # Micro-batch counterpart of clean_matching_tables for per-day matchers
+        tables_to_clean = self.matching_tables_to_clean
+        if len(tables_to_clean) > 0 and dates:
+            conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+            cursor = conn.cursor()
+            try:
+                placeholders = ', '.join('?' * len(dates))
+                for table_to_clean in tables_to_clean:
+                    cursor.execute(f"DELETE FROM TRUST.{table_to_clean} WHERE TRANSACTION_DATE IN ({placeholders})", list(dates))
+                conn.commit()
+            finally:
+                cursor.close()
+                conn.close()
+
+    def clean_matching_from(self, matchDate):
+        # Micro-batch counterpart of clean_matching_tables for matchers that insert every
+        # transaction on or after matchDate, so everything from there is matched again
+        tables_to_clean = self.matching_tables_to_clean
+        if len(tables_to_clean) > 0:
+            conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+            cursor = conn.cursor()
+            try:
+                for table_to_clean in tables_to_clean:
+                    cursor.execute(f"DELETE FROM TRUST.{table_to_clean} WHERE TRANSACTION_DATE >= ?", [matchDate])
+                conn.commit()
+            finally:
+                cursor.close()
+                conn.close()
+
     def match(self, matchDate, notIncluded):
         matchers = self.get_matchers(matchDate)  # Getting the matchers for this loader
         if len(matchers) > 0:
@@ -73,7 +496,8 @@ class BaseLoader:
             try:
                 for matcher in matchers:
                     self.log.info(f"Started identifying Unmatched transactions ({matcher}) on TRUST tables on or after: {matchDate} up to and not including: {notIncluded}")
-                    matchCursor.execute(matchers[matcher]['sql'], matchers[matcher]['parameters'])
+                    with metrics.timer(self.name, 'match'):
+                        matchCursor.execute(matchers[matcher]['sql'], matchers[matcher]['parameters'])
                     self.log.info(f'Finished identifying Unmatched transactions ({matcher}) on TRUST tables on or after: {matchDate} up to and not including: {notIncluded}')
                 matchConn.commit()
             finally:
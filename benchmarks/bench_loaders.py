@@ -0,0 +1,421 @@
+"""
+Loader benchmarks against a local database stand-in.
+
+Generates synthetic source data at the requested scales and runs the real
+CardPayment, EMAF, Benevity and FileLoader code paths with db_conn replaced by a
+fake pyodbc connection. The fake serves the DATADB SELECTs from generated rows
+and records every executemany call. Each case runs in its own process so peak
+RSS is per case; a case that fails is reported and the others still run.
+Module names are resolved by repo_modules (DBLoader is stood in for when it is
+not installed).
+
+    python benchmarks/bench_loaders.py --loaders CardPayment,EMAF --scales 10k,100k
+    python benchmarks/bench_loaders.py --scales 1M --save baseline.json
+    python benchmarks/bench_loaders.py --scales 1M --baseline baseline.json --threshold 10
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from decimal import Decimal
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import repo_modules
+
+repo_modules.install()
+
+START_DATE = '2024-01-01'
+END_DATE = '2024-01-08'
+LOADERS = ('CardPayment', 'EMAF', 'Benevity', 'FileLoader', 'FileLoaderColumnar')
+
+CardPaymentRow = namedtuple('CardPaymentRow', [
+    'AMOUNT', 'CARD_TYPE', 'PAYMENT_TYPE', 'MERCHANT_ID', 'MERCHANT_REF_NBR', 'REQUEST_ID',
+    'TRANSACTION_DATE', 'CARD_SUFFIX', 'BIN', 'TRANSACTION_TIME', 'TRANSACTION_ID'])
+
+EmafRow = namedtuple('EmafRow', [
+    'AMOUNT', 'CARD_NBR', 'LAST4', 'CARD_TYPE', 'EMAF_ID', 'MERCHANT_ACCT', 'MERCHANT_REF_NBR',
+    'RECONCILIATION_ID', 'TERMINAL_NBR', 'BATCH_NBR', 'REGISTER_NBR', 'TRANSACTION_DATE', 'POSTED_DATE',
+    'TRAN_TM', 'TRAN_TYPE_CD', 'EXP_DT'])
+
+BENEVITY_COLUMNS = [
+    'COMPANY', 'PROJECT', 'DONATIONDATE', 'FIRSTNAME', 'LASTNAME', 'EMAIL', 'ADDRESS', 'CITY',
+    'STATECODE', 'ZIPCODE', 'ACTIVITY', 'COMMENT', 'TRANSACTIONID', 'DONATIONFREQUENCY', 'CURRENCY',
+    'PROJECTREMOTEID', 'SOURCE', 'REASON', 'TOTALDONATIONTOBEACKNOWLEDGED', 'MATCHAMOUNT',
+    'CAUSESUPPORTFEE', 'MERCHANT_FEE', 'FEECOMMENT']
+
+
+def parse_scale(value):
+    value = value.strip().lower()
+    multiplier = 1
+    if value.endswith('k'):
+        multiplier, value = 1000, value[:-1]
+    elif value.endswith('m'):
+        multiplier, value = 1000000, value[:-1]
+    return int(float(value) * multiplier)
+
+
+def window_dates():
+    startDate = datetime.strptime(START_DATE, '%Y-%m-%d')
+    days = (datetime.strptime(END_DATE, '%Y-%m-%d') - startDate).days
+    return [(startDate + timedelta(days=day)).strftime('%Y-%m-%d') for day in range(days)]
+
+
+# Synthetic source data
+
+def card_payment_rows(count, seed=1):
+    rand = random.Random(seed)
+    dates = window_dates()
+    brands = [('VISA', 'VISA'), ('MCRD', 'MASTERCARD'), ('AMEX', 'AMERICANEXPRESS'), ('DISC', 'DISCOVER')]
+    for i in range(count):
+        cardType, brand = brands[i % len(brands)]
+        yield CardPaymentRow(
+            Decimal(rand.randint(100, 500000)) / 100, cardType, brand, f'M{rand.randint(1, 40):04d}',
+            f'REF{i:012d}', f'{rand.getrandbits(64):020d}', dates[i * len(dates) // count],
+            f'{rand.randint(0, 9999):04d}', f'{rand.randint(400000, 599999)}',
+            f'{rand.randint(0, 23):02d}:{rand.randint(0, 59):02d}:{rand.randint(0, 59):02d}', f'TX{i:016d}')
+
+
+def emaf_rows(count, seed=2):
+    rand = random.Random(seed)
+    dates = window_dates()
+    for i in range(count):
+        date = dates[i * len(dates) // count]
+        cardNumber = f'{rand.randint(400000, 599999)}{rand.randint(0, 9999999999):010d}'
+        yield EmafRow(
+            Decimal(rand.randint(100, 500000)) / 100, cardNumber, cardNumber[-4:], 'VI', f'E{i:014d}',
+            f'{rand.randint(1, 40):010d}', f'REF{i:012d}', f'R{rand.getrandbits(48):015d}', f'{rand.randint(1, 99):04d}',
+            f'{rand.randint(1, 999):06d}', f'{rand.randint(1, 9):03d}', date, date,
+            f'{rand.randint(0, 23):02d}{rand.randint(0, 59):02d}', '01', f'{rand.randint(1, 12):02d}{rand.randint(25, 30)}')
+
+
+def write_benevity_workbook(path, count, seed=3):
+    import openpyxl
+    rand = random.Random(seed)
+    dates = window_dates()
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('DonationReport_2024')
+    sheet.append(BENEVITY_COLUMNS)
+    for i in range(count):
+        sheet.append([
+            f'Company {i % 500}', 'St. Jude', dates[i * len(dates) // count], f'First{i}', f'Last{i}',
+            f'donor{i}@example.com', f'{i} Main Street', 'Memphis', 'TN', f'{rand.randint(10000, 99999)}',
+            'Donation', 'In memory of a friend ' * rand.randint(0, 3), f'BEN{i:012d}', 'One-time', 'USD',
+            'PRJ-1', 'Payroll', '', round(rand.uniform(1, 500), 2), round(rand.uniform(0, 100), 2),
+            round(rand.uniform(0, 5), 2), round(rand.uniform(0, 3), 2), ''])
+    workbook.save(path)
+
+
+FIXED_WIDTH_RECORD = 80
+
+
+def write_fixed_width_file(path, count, seed=4):
+    # H: file date; D: date, account, reference, amount in cents; T: record count and total in cents
+    rand = random.Random(seed)
+    dates = window_dates()
+    total = 0
+    with open(path, 'w', newline='') as fixedFile:
+        fixedFile.write(f"H{START_DATE.replace('-', '')}".ljust(FIXED_WIDTH_RECORD) + '\r\n')
+        lines = []
+        for i in range(count):
+            cents = rand.randint(100, 500000)
+            total += cents
+            lines.append(f"D{dates[i * len(dates) // count].replace('-', '')}{rand.randint(1, 40):010d}"
+                         f"{i:020d}{cents:012d}".ljust(FIXED_WIDTH_RECORD) + '\r\n')
+            if len(lines) >= 10000:
+                fixedFile.write(''.join(lines))
+                lines = []
+        fixedFile.write(''.join(lines))
+        fixedFile.write(f"T{count:010d}{total:015d}".ljust(FIXED_WIDTH_RECORD) + '\r\n')
+
+
+# Database stand-in
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.fast_executemany = False
+        self.source = iter(())
+        self.description = None
+
+    def execute(self, sql, parameters=None):
+        if 'CARDPAYMENT.TRANSACTIONS' in sql:
+            self.source = card_payment_rows(self.connection.scale)
+            self.description = [(field,) for field in CardPaymentRow._fields]
+        elif 'EMAF.CREDIT_RECN_DETAIL' in sql:
+            self.source = emaf_rows(self.connection.scale)
+            self.description = [(field,) for field in EmafRow._fields]
+        else:
+            self.source = iter(())
+            self.description = None
+        self.connection.statements += 1
+        return self
+
+    def executemany(self, sql, rows):
+        startTime = time.perf_counter()
+        # Touch every value the way a driver binding parameters would
+        for row in rows:
+            for value in row:
+                pass
+        self.connection.executemany_calls.append((len(rows), time.perf_counter() - startTime))
+
+    def fetchmany(self, size):
+        rows = []
+        for row in self.source:
+            rows.append(row)
+            if len(rows) >= size:
+                break
+        return rows
+
+    def fetchone(self):
+        return next(self.source, None)
+
+    def fetchall(self):
+        return list(self.source)
+
+    def __iter__(self):
+        return iter(self.source)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, scale):
+        self.scale = scale
+        self.statements = 0
+        self.executemany_calls = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def fake_db_conn_factory(scale, connections):
+    def fake_db_conn(*args, **kwargs):
+        connection = FakeConnection(scale)
+        connections.append(connection)
+        return connection
+    return fake_db_conn
+
+
+# Cases
+
+def make_fixed_width_loader_class(columnar=False):
+    from FileLoader import FileLoader
+    from FixedWidthColumns import FixedWidthColumnParser, FixedWidthColumn, MONEY
+
+    class FixedWidthBenchLoader(FileLoader):
+        def __init__(self, name, log, startDate, endDate) -> None:
+            super().__init__(name, log, startDate, endDate)
+            self.filename_has_dashes = False
+            self.parser = FixedWidthColumnParser([
+                FixedWidthColumn('TRANSACTION_DATE', 1, 8),
+                FixedWidthColumn('MERCHANT_ID', 9, 10),
+                FixedWidthColumn('REFERENCE', 19, 20),
+                FixedWidthColumn('AMOUNT', 39, 12, MONEY),
+            ], trailer_count=(1, 10), trailer_total=(11, 15), total_column='AMOUNT')
+
+        def process_file(self, file_path, file_name, fileDate, startDate):
+            if columnar:
+                self.load_fixed_width_file(file_path, self.parser.insert_sql('TRUST.BENCH'), self.parser)
+                return
+            conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+            cursor = conn.cursor()
+            sql = 'INSERT INTO TRUST.BENCH (TRANSACTION_DATE, MERCHANT_ID, REFERENCE, AMOUNT) VALUES (?, ?, ?, ?)'
+            tuples = []
+            with open(file_path) as fixedFile:
+                for line in fixedFile:
+                    if line[0] != 'D':
+                        continue
+                    tuples.append([line[1:9], line[9:19], line[19:39], int(line[39:51]) / 100])
+                    if len(tuples) >= self.batch_sizer.size:
+                        self.insert_batch(cursor, conn, sql, tuples)
+                        tuples = []
+            self.insert_batch(cursor, conn, sql, tuples)
+            cursor.close()
+            conn.close()
+
+    return FixedWidthBenchLoader
+
+
+def build_loader(name, workDir, scale):
+    import logging
+    log = logging.getLogger('TRUST_BENCH')
+    if name == 'CardPayment':
+        from CardPayment import CardPayment
+        return CardPayment('CardPayment', log, START_DATE, END_DATE)
+    if name == 'EMAF':
+        from EMAF import EMAF
+        return EMAF('EMAF', log, START_DATE, END_DATE)
+
+    fileDate = (datetime.strptime(START_DATE, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    if name == 'Benevity':
+        from benevity import Benevity
+        loader = Benevity('Benevity', log, START_DATE, END_DATE)
+        path = os.path.join(workDir, f'Benevity_DonationReport_{fileDate}.xlsx')
+        write_benevity_workbook(path, scale)
+        # Benevity filters on modified time, one day after the start date
+        fileTime = time.mktime(datetime.strptime(fileDate, '%Y-%m-%d').replace(hour=12).timetuple())
+        os.utime(path, (fileTime, fileTime))
+    else:
+        loader = make_fixed_width_loader_class(name == 'FileLoaderColumnar')(name, log, START_DATE, END_DATE)
+        write_fixed_width_file(os.path.join(workDir, f'BENCH_{fileDate.replace("-", "")}.txt'), scale)
+    loader.file_folder = workDir
+    loader.can_use_s3 = False
+    return loader
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_case(name, scale, trace_memory=False):
+    connections = []
+    with tempfile.TemporaryDirectory() as workDir:
+        loader = build_loader(name, workDir, scale)
+        loader.db_conn = fake_db_conn_factory(scale, connections)
+        loader.batch_sizer.history_path = None
+
+        if trace_memory:
+            tracemalloc.start()
+        startTime = time.perf_counter()
+        loader.prepare_load()
+        loader.load()
+        loader.publish()
+        elapsed = time.perf_counter() - startTime
+        tracedPeak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+
+    calls = [call for connection in connections for call in connection.executemany_calls]
+    rows = sum(count for count, _ in calls)
+    latencies = [seconds for _, seconds in calls]
+    return {
+        'loader': name,
+        'scale': scale,
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else None,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'traced_peak_bytes': tracedPeak,
+        'traced_bytes_per_10k_rows': tracedPeak * 10000 // rows if tracedPeak and rows else None,
+        'executemany_calls': len(calls),
+        'batch_latency_p50': percentile(latencies, 0.50),
+        'batch_latency_p95': percentile(latencies, 0.95),
+        'batch_latency_p99': percentile(latencies, 0.99),
+        'final_batch_size': loader.batch_sizer.size,
+    }
+
+
+def run_isolated(name, scale, trace_memory):
+    command = [sys.executable, os.path.abspath(__file__), '--case', name, '--rows', str(scale)]
+    if trace_memory:
+        command.append('--traceMemory')
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        errorLines = completed.stderr.strip().splitlines()
+        return {'loader': name, 'scale': scale, 'error': errorLines[-1] if errorLines else f'exit code {completed.returncode}'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold):
+    # Returns the cases whose rows/sec dropped by more than threshold percent
+    previous = {(result['loader'], result['scale']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['loader'], result['scale']))
+        if not before or not before.get('rows_per_second') or not result.get('rows_per_second'):
+            continue
+        change = (result['rows_per_second'] - before['rows_per_second']) / before['rows_per_second'] * 100
+        result['rows_per_second_change_pct'] = change
+        if change < -threshold:
+            regressions.append(result)
+    return regressions
+
+
+def format_bytes(value):
+    return '-' if value is None else f'{value / (1024 * 1024):,.1f} MiB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TRUST loaders against a local database stand-in')
+    parser.add_argument('--loaders', default=','.join(LOADERS), help='Comma separated loaders: ' + ', '.join(LOADERS))
+    parser.add_argument('--scales', default='10k,100k', help='Comma separated row counts, e.g. 10k,1M,10M')
+    parser.add_argument('--traceMemory', action='store_true', help='Also report the tracemalloc peak (slower)')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare rows/sec against a JSON file written by --save')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Regression threshold in percent')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.rows, args.traceMemory)))
+        return 0
+
+    results = []
+    for name in [loader.strip() for loader in args.loaders.split(',') if loader.strip()]:
+        if name not in LOADERS:
+            parser.error(f'Unknown loader: {name}')
+        for scale in [parse_scale(scale) for scale in args.scales.split(',')]:
+            result = run_isolated(name, scale, args.traceMemory)
+            results.append(result)
+            if 'error' in result:
+                print(f"{name:<12} {scale:>10,} rows  failed: {result['error']}")
+                continue
+            print(f"{name:<12} {scale:>10,} rows  {result['rows_per_second'] or 0:>12,.0f} rows/s  "
+                  f"peak RSS {format_bytes(result['peak_rss_bytes']):>12}  "
+                  f"batch p50/p95/p99 {result['batch_latency_p50'] or 0:.4f}/{result['batch_latency_p95'] or 0:.4f}/"
+                  f"{result['batch_latency_p99'] or 0:.4f}s")
+            if result['traced_peak_bytes'] is not None:
+                print(f"{'':<12} traced peak {format_bytes(result['traced_peak_bytes'])}, "
+                      f"{format_bytes(result['traced_bytes_per_10k_rows'])} per 10k rows")
+
+    status = 1 if any('error' in result for result in results) else 0
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = compare(results, json.load(baselineFile), args.threshold)
+        for result in results:
+            if 'rows_per_second_change_pct' in result:
+                print(f"{result['loader']:<12} {result['scale']:>10,} rows  {result['rows_per_second_change_pct']:+.1f}% vs baseline")
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {args.threshold}%")
+            status = 1
+
+    if args.save:
+        with open(args.save, 'w') as saveFile:
+            json.dump(results, saveFile, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
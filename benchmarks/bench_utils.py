@@ -0,0 +1,126 @@
+"""
+Micro-benchmarks for the Utils date-filtering and file-selection helpers.
+
+Needs pytest-benchmark (pip install -r requirements-dev.txt). Run from the benchmarks folder so pytest.ini applies:
+
+    cd benchmarks
+    python -m pytest bench_utils.py
+
+Every run is saved under .benchmarks; pytest.ini shows how to compare a run
+against a saved baseline and fail on a slower mean. Use --benchmark-disable-gc /
+--benchmark-min-rounds for stabler numbers.
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import repo_modules
+
+repo_modules.install()
+
+import Utils
+
+END_DATE = '2024-06-01'
+FOLDER_SIZES = [100, 2000]
+DATE_SPANS = [1, 7, 120]
+
+
+def start_date_for(span):
+    return (datetime.strptime(END_DATE, '%Y-%m-%d') - timedelta(days=span)).strftime('%Y-%m-%d')
+
+
+def file_names(count, with_dashes=True, format='ymd'):
+    # One file per day going back from END_DATE, like a bank drop folder
+    names = []
+    endDate = datetime.strptime(END_DATE, '%Y-%m-%d')
+    for i in range(count):
+        date = endDate - timedelta(days=i % 365)
+        dateText = date.strftime('%Y-%m-%d' if format == 'ymd' else '%m-%d-%Y')
+        if not with_dashes:
+            dateText = dateText.replace('-', '')
+        names.append(f'SETTLEMENT_{i:05d}_{dateText}.txt')
+    return names
+
+
+@pytest.fixture(scope='module', params=FOLDER_SIZES, ids=lambda size: f'{size}files')
+def data_folder(request, tmp_path_factory):
+    folder = tmp_path_factory.mktemp(f'folder{request.param}')
+    endTime = datetime.strptime(END_DATE, '%Y-%m-%d')
+    for i, name in enumerate(file_names(request.param)):
+        path = folder / name
+        path.write_text('')
+        modifiedTime = (endTime - timedelta(days=i % 365, hours=-12)).timestamp()
+        os.utime(path, (modifiedTime, modifiedTime))
+    return folder
+
+
+@pytest.mark.parametrize('span', DATE_SPANS, ids=lambda span: f'{span}days')
+@pytest.mark.parametrize('with_dashes,format', [(True, 'ymd'), (False, 'ymd'), (True, 'mdy')])
+def bench_filter_file_by_filename_date_common(benchmark, span, with_dashes, format):
+    names = file_names(FOLDER_SIZES[-1], with_dashes, format)
+    startDate = start_date_for(span)
+
+    def run():
+        return [Utils.filter_file_by_filename_date_common(name, startDate, END_DATE, with_dashes, format) for name in names]
+
+    benchmark(run)
+
+
+@pytest.mark.parametrize('span', DATE_SPANS, ids=lambda span: f'{span}days')
+def bench_filter_file_by_modified_time(benchmark, data_folder, span):
+    entries = list(os.scandir(data_folder))
+    startDate = start_date_for(span)
+
+    def run():
+        return [Utils.filter_file_by_modified_time(entry, startDate, END_DATE) for entry in entries]
+
+    benchmark(run)
+
+
+@pytest.mark.parametrize('span', DATE_SPANS, ids=lambda span: f'{span}days')
+def bench_shift_dates(benchmark, span):
+    startDate = start_date_for(span)
+    benchmark(lambda: [Utils.shiftDates(startDate, END_DATE, offset) for offset in range(span)])
+
+
+class FakeCursor:
+    def execute(self, sql, parameters=None):
+        return self
+
+    def fetchone(self):
+        return [50000]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+    def close(self):
+        pass
+
+
+class NullLog:
+    def info(self, message):
+        pass
+
+    def debug(self, message):
+        pass
+
+    def warning(self, message):
+        pass
+
+
+def bench_files_available_check(benchmark, data_folder, monkeypatch):
+    # files_available_check builds the holiday calendar with pandas
+    pytest.importorskip('pandas')
+    # The EMAF check queries DATADB; the benchmark measures the calendar and folder work
+    monkeypatch.setattr(Utils, 'db_conn', lambda *args, **kwargs: FakeConnection())
+    startDate = (datetime.today() - timedelta(days=1)).strftime('%Y-%m-%d')
+    endDate = datetime.today().strftime('%Y-%m-%d')
+    benchmark(Utils.files_available_check, startDate, endDate, str(data_folder), NullLog())
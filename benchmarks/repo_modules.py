@@ -0,0 +1,80 @@
+"""
+Makes the repository's modules importable for the benchmarks.
+
+The loaders import modules by names that only resolve on a case-insensitive
+Windows checkout (Globals is GLOBALS.PY, BaseLoader is baseloader.py) or by the
+name of a module that lives elsewhere (FileLoader is fileLoder.py here, DBLoader
+is not in this repository). install() maps those names to the files in the
+repository root. When DBLoader, pyodbc or LogDbHandler cannot be imported,
+install() also adds a minimal stand-in, because the benchmarks replace db_conn
+and never open a real connection or log to the database:
+
+    import repo_modules
+    repo_modules.install()
+    from CardPayment import CardPayment
+"""
+import os
+import sys
+import types
+import importlib.abc
+import importlib.util
+from importlib.machinery import SourceFileLoader
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module name -> file name in the repository root
+ALIASES = {
+    'Globals': 'GLOBALS.PY',
+    'BaseLoader': 'baseloader.py',
+    'FileLoader': 'fileLoder.py',
+    'EMAF': 'EMAF.PY',
+}
+
+
+class AliasFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path=None, target=None):
+        fileName = ALIASES.get(name)
+        if fileName is None:
+            return None
+        filePath = os.path.join(REPO_ROOT, fileName)
+        if not os.path.exists(filePath):
+            return None
+        return importlib.util.spec_from_file_location(name, filePath, loader=SourceFileLoader(name, filePath))
+
+
+def importable(name):
+    return name in sys.modules or importlib.util.find_spec(name) is not None
+
+
+def stand_in(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    module.BENCHMARK_STAND_IN = True
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    if not any(isinstance(finder, AliasFinder) for finder in sys.meta_path):
+        # Appended, so a real Globals.py or FileLoader.py on the path still wins
+        sys.meta_path.append(AliasFinder())
+
+    if not importable('pyodbc'):
+        class Error(Exception):
+            pass
+
+        def connect(*args, **kwargs):
+            raise Error('pyodbc is not installed; the benchmarks use a fake connection')
+
+        stand_in('pyodbc', Error=Error, OperationalError=Error, connect=connect)
+    if not importable('LogDbHandler'):
+        stand_in('LogDbHandler', __all__=[])
+    if not importable('DBLoader'):
+        from BaseLoader import BaseLoader
+
+        class DBLoader(BaseLoader):
+            pass
+
+        stand_in('DBLoader', DBLoader=DBLoader)
@@ -1,7 +1,6 @@
 import os
-import openpyxl
-import pandas as pd
 from FileLoader import FileLoader, FilterBy
+from Instrumentation import metrics
 import logging
 from datetime import datetime, timedelta
 from FixedWidthTextParser.Parser import Parser
@@ -18,6 +17,7 @@ class Benevity(FileLoader):
 
         # Setting up the loader
         self.matching_tables_to_clean = ['BENEVITY_DMS']
+        self.matching_source_tables = ['TRUST.DMS']
         self.stat_queries = {
             'UNMATCHED_STATS': """
                 SELECT 'Benevity' AS SOURCE, DonationDate AS TRANSACTION_DATE, MERCHANT_ID,
@@ -72,6 +72,10 @@ class Benevity(FileLoader):
             conn.close()
 
     def process_file(self, file_path, file_name, file_date, start_date):
+        # openpyxl and pandas are only needed once there is a workbook to read
+        import openpyxl
+        import pandas as pd
+
         # Check if the file has already been processed
         if self.is_file_processed(file_name):
             self.log.info(f"Skipping already processed file: {file_name}")
@@ -96,7 +100,8 @@ class Benevity(FileLoader):
             self.log.info(f"Processing file: {file_name}")
             record_count = 0
             tuples = []
-            file = openpyxl.load_workbook(file_path)
+            with metrics.timer(self.name, 'file_io'):
+                file = openpyxl.load_workbook(file_path)
 
             # Find the sheet whose name starts with 'DonationReport'
             donation_report_sheet = None
@@ -127,12 +132,12 @@ class Benevity(FileLoader):
             # Convert DataFrame to a list of tuples
             tuples = [tuple(x) for x in df.itertuples(index=False, name=None)]
 
-            # Insert records into the database in batches
-            batch_size = self.sql_batch_size
-            for i in range(0, len(tuples), batch_size):
-                batch = tuples[i:i + batch_size]
-                cursor.executemany(sql, batch)
-                conn.commit()
+            # Insert records into the database in batches sized for Benevity's wide rows
+            i = 0
+            while i < len(tuples):
+                batch = tuples[i:i + self.batch_sizer.size]
+                self.insert_batch(cursor, conn, sql, batch)
+                i += len(batch)
 
             self.log.info(f"Finished processing BENEVITY FILE with {len(tuples)} records.")
 
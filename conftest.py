@@ -0,0 +1,82 @@
+import pytest
+
+
+class RecordingCursor:
+    """Stands in for a pyodbc cursor: records every statement with its whitespace
+    collapsed, and serves rows from fetchall/fetchone."""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+        self.fast_executemany = False
+
+    def execute(self, sql, parameters=None):
+        self.executed.append((' '.join(sql.split()), parameters))
+        return self
+
+    def executemany(self, sql, rows):
+        self.executed.append((' '.join(sql.split()), rows))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self, rows=()):
+        self.cursor_ = RecordingCursor(rows)
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self.cursor_
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+class RecordingLog:
+    def __init__(self):
+        self.messages = []
+
+    def log(self, level, message):
+        self.messages.append((level, message))
+
+    def debug(self, message):
+        self.log('debug', message)
+
+    def info(self, message):
+        self.log('info', message)
+
+    def warning(self, message):
+        self.log('warning', message)
+
+    def error(self, message):
+        self.log('error', message)
+
+
+@pytest.fixture
+def cursor():
+    return RecordingCursor()
+
+
+@pytest.fixture
+def connection():
+    """connection(rows=()) makes a connection whose cursor serves rows."""
+    return RecordingConnection
+
+
+@pytest.fixture
+def log():
+    return RecordingLog()
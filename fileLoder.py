@@ -1,5 +1,7 @@
 import os
 import sys
+import asyncio
+import threading
 import traceback
 import csv
 import logging
@@ -13,6 +15,13 @@ from Globals import *
 from LogDbHandler import *
 from Utils import *
 from BaseLoader import BaseLoader
+from Instrumentation import metrics
+from FixedWidthColumns import FixedWidthColumnParser, FixedWidthColumn, FixedWidthValidationError
+from MappedFile import MappedFile
+from CybersourceReport import TransactionDetailReader
+from IngestionLedger import IngestionLedger, file_hash, etag_hash
+import AsyncIngestion
+from Money import from_cents
 
 class FilterBy(Enum):
     MODIFIED_TIME = 1
@@ -27,6 +36,29 @@ class FileLoader(BaseLoader):
         self.filename_has_dashes = True
         self.filename_date_format = "ymd"
 
+        # Content-addressed ingestion ledger: a file whose content is already recorded
+        # for this loader is not loaded again, and a rerun over unchanged files skips
+        # both trim and load
+        self.use_ledger = True
+        self.ledger = IngestionLedger(name)
+        self.ledger_hashes = set()
+        # Hashes of the files being processed, claimed under totals_lock so two files with
+        # the same content are never both loaded by concurrent workers
+        self.claimed_hashes = set()
+        self.ingestion_state = threading.local()
+        self.pending_ingestions = []
+        self.file_hashes = {}
+        self.s3_etags = {}
+        self.skip_load = False
+        # Set by loaders whose process_file loads through load_fixed_width_file or
+        # load_cybersource_report: on the live table each file then commits in one
+        # transaction with its ledger entry, so they can load without a trim (micro-batch)
+        self.transactional_files = False
+
+        # load_async() processes files concurrently, so per-file state is per thread
+        # and the loaded totals are updated under a lock
+        self.totals_lock = threading.Lock()
+
     def file_object_check(self, file_object, startDate, endDate, s3_client):
         (startDate, endDate) = self.transform_dates(startDate, endDate)
         if self.filter_by == FilterBy.FILENAME_DATE:
@@ -66,13 +98,327 @@ class FileLoader(BaseLoader):
     def process_file(self, file_path, file_name, fileDate, startDate):
         raise NotImplementedError(f"Loader {self.name} has not implemented the process file method")
 
+    def timed_process_file(self, file_path, file_name, fileDate, startDate):
+        contentHash = None
+        if self.use_ledger:
+            contentHash = self.content_hash(file_path, file_name)
+            if not self.claim_hash(contentHash):
+                self.log.info(f"{self.name}: skipping {file_name}, its content was already loaded")
+                return
+            self.current_ingestion = (contentHash, file_name, fileDate)
+
+        self.ingestion_state.file_failed = False
+        loaded = False
+        try:
+            with metrics.timer(self.name, 'process_file'):
+                self.process_file(file_path, file_name, fileDate, startDate)
+            loaded = not self.ingestion_state.file_failed
+            if self.current_ingestion and loaded:
+                self.finish_ingestion()
+        finally:
+            self.current_ingestion = None
+            if contentHash and not loaded:
+                # A failed file gives its content up for a retry
+                with self.totals_lock:
+                    self.claimed_hashes.discard(contentHash)
+
+    def claim_hash(self, contentHash):
+        with self.totals_lock:
+            if contentHash in self.ledger_hashes or contentHash in self.claimed_hashes:
+                return False
+            self.claimed_hashes.add(contentHash)
+            return True
+
+    @property
+    def load_failed(self):
+        return self.any_file_failed
+
+    @load_failed.setter
+    def load_failed(self, value):
+        # process_file implementations report a bad file with self.load_failed = True. That
+        # fails the load, and also marks the file this thread is processing, so the ledger
+        # only ever records a file for its own outcome. BaseLoader.__init__ sets it before
+        # the lock and the per-thread state exist
+        lock = getattr(self, 'totals_lock', None)
+        if lock is None:
+            self.any_file_failed = value
+            return
+        with lock:
+            self.any_file_failed = value
+        if value:
+            self.ingestion_state.file_failed = True
+
+    @property
+    def current_ingestion(self):
+        # (hash, key, fileDate) of the file this thread is processing
+        return getattr(self.ingestion_state, 'current', None)
+
+    @current_ingestion.setter
+    def current_ingestion(self, value):
+        self.ingestion_state.current = value
+
+    def add_loaded(self, count, amount=None):
+        with self.totals_lock:
+            self.loaded_count = (self.loaded_count or 0) + count
+            if amount is not None:
+                self.loaded_amount = (self.loaded_amount or 0) + amount
+
+    @property
+    def supports_micro_batch(self):
+        # New files are told apart by the ledger, and a file that fails part way must leave
+        # nothing behind to be retried safely; staged tables need a trim
+        return self.use_ledger and self.transactional_files and not self.staging_mode
+
+    def content_hash(self, file_path, file_key):
+        etag = self.s3_etags.get(file_key)
+        if etag:
+            return etag_hash(etag)
+        stat = os.stat(file_path)
+        cacheKey = (file_path, stat.st_size, stat.st_mtime_ns)
+        if cacheKey not in self.file_hashes:
+            with metrics.timer(self.name, 'hash'):
+                self.file_hashes[cacheKey] = file_hash(file_path)
+        return self.file_hashes[cacheKey]
+
+    def s3_skip_check(self, file_key, etag, fileDate):
+        if not self.use_ledger or not etag:
+            return False
+        self.s3_etags[file_key] = etag
+        if etag_hash(etag) in self.ledger_hashes:
+            self.log.info(f"{self.name}: skipping {file_key}, its content was already loaded")
+            return True
+        return False
+
+    def record_ingestion(self, cursor, row_count=None):
+        # Writes the ledger entry for the file being processed on cursor, uncommitted, so it
+        # commits with the file's last batch. Staged loads record their files on publish()
+        if not self.current_ingestion:
+            return
+        contentHash, fileKey, fileDate = self.current_ingestion
+        if self.switches_partitions or self.staging_mode:
+            with self.totals_lock:
+                self.pending_ingestions.append((contentHash, fileKey, fileDate, row_count))
+        else:
+            self.ledger.record(cursor, contentHash, fileKey, fileDate, row_count)
+        with self.totals_lock:
+            self.ledger_hashes.add(contentHash)
+        if fileDate:
+            self.affected_dates.add(str(fileDate)[:10])
+        self.current_ingestion = None
+
+    def finish_ingestion(self):
+        # For process_file implementations that commit on their own: record the file in its
+        # own transaction once process_file has returned. Their batches are committed as
+        # they go, so on a live table that was not trimmed a retry after a failure part way
+        # would add the rows again; such files stay out of the ledger
+        if self.load_table == self.target_table and not self.trimmed and not self.reloading:
+            self.current_ingestion = None
+            return
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            self.record_ingestion(cursor)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def candidate_hashes(self):
+        # Content hashes of the files load() would pick up for the window, without loading them
+        hashes = set()
+
+        def collect_file(file_path, file_name, fileDate, startDate):
+            hashes.add(self.content_hash(file_path, file_name))
+
+        def collect_object(file_key, etag, fileDate):
+            if etag:
+                self.s3_etags[file_key] = etag
+                hashes.add(etag_hash(etag))
+            else:
+                hashes.add(None)
+            return True
+
+        if self.can_use_s3 and self.use_s3_buckets:
+            load_from_s3(self.file_folder, self.file_object_check, None, self.startDate, self.endDate, collect_object)
+        else:
+            load_from_directory(self.file_folder, self.dir_entry_check, collect_file, self.startDate, self.endDate,
+                                self.data_input_folder)
+        return hashes
+
+    def trim(self):
+        if not self.use_ledger:
+            return super().trim()
+
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        try:
+            loadedHashes = self.ledger.hashes_from(cursor, self.startDate)
+            candidateHashes = self.candidate_hashes()
+            if candidateHashes and candidateHashes == loadedHashes:
+                self.log.info(f"{self.name}: all {len(candidateHashes)} files on or after {self.startDate} are already loaded "
+                              f"unchanged, skipping trim and load")
+                self.skip_load = True
+                return
+
+            # Forget the window before its rows are deleted, so a failed trim can only cause a reload
+            self.ledger.clear_from(cursor, self.startDate)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        super().trim()
+
+    def prepare_load(self):
+        if self.skip_load:
+            return
+        super().prepare_load()
+
+    def publish(self):
+        if self.skip_load:
+            return False
+        published = super().publish()
+        if published and self.pending_ingestions:
+            conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+            cursor = conn.cursor()
+            try:
+                for contentHash, fileKey, fileDate, rowCount in self.pending_ingestions:
+                    self.ledger.record(cursor, contentHash, fileKey, fileDate, rowCount)
+                conn.commit()
+                self.pending_ingestions = []
+            finally:
+                cursor.close()
+                conn.close()
+        return published
+
+    def open_mapped(self, file_path, encoding='ascii') -> MappedFile:
+        """Memory-map a local input or S3 temp download for process_file, e.g.
+        with self.open_mapped(file_path) as mapped: for line in mapped.lines(): ..."""
+        with metrics.timer(self.name, 'file_io'):
+            return MappedFile(file_path, encoding)
+
+    def insert_batches(self, sql, batches):
+        """executemany each batch from a parser generator into the loader's table, timing
+        the parsing separately from the inserts. The last batch is only inserted once the
+        parser has validated the whole file, and the file's ledger entry commits with it.
+        On the live table the whole file is one transaction, so a file that fails part way
+        (a trailer mismatch, a bad row) leaves no rows behind and is loaded whole when it is
+        retried. Staged loads commit each batch; a failed file fails the load and the stage
+        is not published."""
+        live = self.load_table == self.target_table
+        conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        rowCount = 0
+        try:
+            with metrics.timer(self.name, 'parse'):
+                rows = next(batches, None)
+            while rows is not None:
+                with metrics.timer(self.name, 'parse'):
+                    nextRows = next(batches, None)
+                rowCount += len(rows)
+                if nextRows is None:
+                    self.insert_batch(cursor, conn, sql, rows, lambda cursor: self.record_ingestion(cursor, rowCount))
+                else:
+                    self.insert_batch(cursor, conn, sql, rows, commit=not live)
+                rows = nextRows
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            batches.close()
+            cursor.close()
+            conn.close()
+
+    def load_fixed_width_file(self, file_path, sql, parser: FixedWidthColumnParser):
+        """Columnar load of a fixed-width file: parser batches go straight into executemany
+        (sql defaults to parser.insert_sql(self.load_table)). A file whose trailer count or
+        total does not match is rolled back on the live table and fails the load, so a
+        staged or partitioned target is not published."""
+        sql = sql or parser.insert_sql(self.load_table)
+        with self.open_mapped(file_path, parser.encoding) as mapped:
+            try:
+                self.insert_batches(sql, parser.batches(mapped, lambda: self.batch_sizer.size))
+            except FixedWidthValidationError as e:
+                self.log.error(f"{self.name}: {e}")
+                self.load_failed = True
+                return 0
+
+        self.add_loaded(parser.records, from_cents(parser.total_cents) if parser.total_index is not None else None)
+        self.log.info(f"Loaded {parser.records} records from {file_path}")
+        return parser.records
+
+    def load_cybersource_report(self, file_path, reader: TransactionDetailReader = None):
+        """Stream a Cybersource TransactionDetailReport XML file into the loader's table."""
+        reader = reader or TransactionDetailReader()
+        with self.open_mapped(file_path) as mapped:
+            self.insert_batches(reader.insert_sql(self.load_table), reader.batches(mapped.stream(), lambda: self.batch_sizer.size))
+
+        self.add_loaded(reader.records, reader.total_amount)
+        self.log.info(f"Loaded {reader.records} requests from {file_path}")
+        return reader.records
+
     def transform_dates(self, startDate, endDate):
         return startDate, endDate
 
     def load(self):
+        if self.skip_load:
+            self.log.info(f"Skipped {self.name} Load, no new or changed files")
+            return
         self.log.info(f"Started {self.name} from files for {self.startDate} to but not including {self.endDate}")
-        if self.can_use_s3 and use_s3_buckets_enabled:
-            load_from_s3(self.file_folder, self.file_object_check, self.process_file, self.startDate, self.endDate)
+        if self.use_ledger:
+            conn = self.db_conn(self.sql_server, self.sql_working_database, self.sql_working_username, self.sql_working_password)
+            cursor = conn.cursor()
+            try:
+                self.ledger_hashes = self.ledger.hashes(cursor)
+                self.claimed_hashes = set()
+            finally:
+                cursor.close()
+                conn.close()
+        if self.async_ingestion:
+            asyncio.run(self.load_async())
+        elif self.can_use_s3 and self.use_s3_buckets:
+            load_from_s3(self.file_folder, self.file_object_check, self.timed_process_file, self.startDate, self.endDate,
+                         self.s3_skip_check)
         else:
-            load_from_directory(self.file_folder, self.dir_entry_check, self.process_file, self.startDate, self.endDate)
+            load_from_directory(self.file_folder, self.dir_entry_check, self.timed_process_file, self.startDate, self.endDate,
+                                self.data_input_folder)
         self.log.info(f"Finished {self.name} Load")
+
+    async def load_async(self):
+        """Async ingestion: listing, downloads and process_file run as tasks, with at most
+        config.parallelism files being processed (and writing to the database) at once."""
+        limiter = AsyncIngestion.ResourceLimiter({
+            AsyncIngestion.LIST: self.config.async_list_concurrency,
+            AsyncIngestion.DOWNLOAD: self.config.async_download_concurrency,
+            AsyncIngestion.PROCESS: self.parallelism,
+        })
+        try:
+            if self.can_use_s3 and self.use_s3_buckets:
+                s3_client = get_s3_client()
+                self.log.info("Using S3 bucket: " + self.file_folder)
+                objects = await AsyncIngestion.list_s3_objects(limiter, s3_client, aws_bucket_name, self.file_folder,
+                                                               self.file_object_check, self.startDate, self.endDate)
+                tasks = [self.ingest_s3_object(limiter, s3_client, *fileObject) for fileObject in objects]
+            else:
+                fileDir = os.path.join(self.data_input_folder, self.file_folder)
+                self.log.info("Using file directory: " + fileDir)
+                files = await AsyncIngestion.list_directory(limiter, fileDir, self.dir_entry_check, self.startDate, self.endDate)
+                tasks = [self.ingest_file(limiter, *entry) for entry in files]
+            self.log.info(f"{self.name}: ingesting {len(tasks)} files, {self.parallelism} at a time")
+            await AsyncIngestion.run_all(tasks)
+        finally:
+            limiter.close()
+
+    async def ingest_file(self, limiter, file_path, file_name, fileDate):
+        self.log.info("Started File: " + file_path + " for date: " + str(fileDate))
+        await limiter.run(AsyncIngestion.PROCESS, self.timed_process_file, file_path, file_name, fileDate, self.startDate)
+
+    async def ingest_s3_object(self, limiter, s3_client, file_key, etag, fileDate):
+        if self.s3_skip_check(file_key, etag, fileDate):
+            return
+        self.log.info("Started File: " + file_key + " for date: " + str(fileDate))
+        tmpPath = await limiter.run(AsyncIngestion.DOWNLOAD, s3_download, s3_client, file_key, etag)
+        try:
+            await limiter.run(AsyncIngestion.PROCESS, self.timed_process_file, tmpPath, file_key, fileDate, self.startDate)
+        finally:
+            release_s3_download(tmpPath)
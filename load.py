@@ -1,6 +1,5 @@
 import os
 import sys
-import importlib
 import argparse
 from datetime import datetime
 import time
@@ -9,40 +8,14 @@ import time
 from Globals import *
 from Utils import *
 import JobExecHistory
-import GiftMatch
-import CollectStats
-import ReceiptLedgerUnresolved
-import DiscrepanciesFromXLS
-from loaders import BAI, ACH, Wires, EFT, Amazon, AMEX, APG, ApplePay, Benevity, CardPayment, ChargeProcessing, Cybersource, EMAF, EPP, GooglePay, IPay, Metavante, Paypal, SHIFT4, SHIFT4_ACH, Telecheck, VSD, ReceiptLedger, BAIEnrichment, TriangleMatch
-
-# We need to import all the loaders so we can dynamically call them
-TRUSTED_LOADERS = {
-    "BAI": BAI,
-    "ACH": ACH,
-    "Wires": Wires,
-    "EFT": EFT,
-    "Amazon": Amazon,
-    "AMEX": AMEX,
-    "APG": APG,
-    "ApplePay": ApplePay,
-    "Benevity": Benevity,
-    "CardPayment": CardPayment,
-    "ChargeProcessing": ChargeProcessing,
-    "Cybersource": Cybersource,
-    "EMAF": EMAF,
-    "EPP": EPP,
-    "GooglePay": GooglePay,
-    "IPay": IPay,
-    "Metavante": Metavante,
-    "Paypal": Paypal,
-    "SHIFT4": SHIFT4,
-    "SHIFT4_ACH": SHIFT4_ACH,
-    "Telecheck": Telecheck,
-    "VSD": VSD,
-    "ReceiptLedger": ReceiptLedger,
-    "BAIEnrichment": BAIEnrichment,
-    "TriangleMatch": TriangleMatch
-}
+from Instrumentation import metrics
+import Profiling
+import LoadVerifier
+import MicroBatch
+from LoaderRegistry import TRUSTED_LOADERS, get_loader_class, import_timed, import_times
+
+# Loaders, matching and stats modules (and their pandas/openpyxl/boto3 dependencies)
+# are imported on first use through LoaderRegistry, which also times each import
 
 def get_sanitized_loader(input_loader):
     sanitized_input_loader = input_loader.strip()
@@ -53,6 +26,59 @@ def get_sanitized_loader(input_loader):
 def str2bool(value):
     return value.lower() in ['true', '1', 't', 'y', 'yes']
 
+def run_loaders(loaders):
+    for loader in loaders:
+        log.info(f">>>>Starting the {loader} loader<<<<<<")
+        if args.trim and not loaders[loader].incremental:
+            with metrics.timer(loader, 'trim'):
+                loaders[loader].trim()
+        if args.addRecords:
+            with metrics.timer(loader, 'load'):
+                loaders[loader].prepare_load()
+                if args.profile:
+                    Profiling.profile_call(loader, loaders[loader].load,
+                                           os.path.join(os.path.dirname(log_file_path), 'TRUST_PROFILES'), args.profile, log)
+                else:
+                    loaders[loader].load()
+            with metrics.timer(loader, 'publish'):
+                loaders[loader].publish()
+        log.info(f">>>>Finishing the {loader} loader<<<<")
+
+def verify_and_reload(loaders):
+    with metrics.timer('ALL', 'verify'):
+        mismatched = LoadVerifier.verify_loaders(loaders, log, stats_parallelism)
+    for loader, dates in mismatched.items():
+        log.info(f"{loader}: reloading {len(dates)} dates that differ from the source")
+        failedDates = loaders[loader].reload_dates(dates)
+        if failedDates:
+            log.error(f"{loader}: could not reload {', '.join(failedDates)}")
+
+def collect_stats(loaders, startDate, endDate):
+    if stats_parallelism > 1:
+        import_timed('StatsExecutor', log).collect(loaders, log, stats_parallelism)
+    else:
+        import_timed('CollectStats', log).collect(loaders, startDate, endDate, log)
+
+def refresh_stats(loaders, dates):
+    # Micro-batch cycles recompute only the dates they matched again
+    import_timed('StatsExecutor', log).collect(loaders, log, stats_parallelism, dates=dates)
+
+def match_and_collect_stats(loaders, startDate, endDate):
+    DiscrepanciesFromXLS = import_timed('DiscrepanciesFromXLS', log)
+    GiftMatch = import_timed('GiftMatch', log)
+    ReceiptLedgerUnresolved = import_timed('ReceiptLedgerUnresolved', log)
+    DiscrepanciesFromXLS.load()
+    with metrics.timer('ALL', 'match'):
+        GiftMatch.load(loaders, endDate)
+    with metrics.timer('ALL', 'stats'):
+        for loader in loaders:
+            if args.rebuildStats:
+                loaders[loader].rebuild_incremental_stats()
+            if args.fullStats:
+                loaders[loader].use_full_stat_queries()
+        collect_stats(loaders, startDate, endDate)
+    ReceiptLedgerUnresolved.load()
+
 # Initialize argument parser
 parser = argparse.ArgumentParser()
 parser.add_argument("-l", "--loader", type=str, help='Specify the Loader Name')
@@ -60,6 +86,14 @@ parser.add_argument("-s", "--startDate", type=str, help='Specify Start Date to i
 parser.add_argument("-e", "--endDate", type=str, help='Specify End Date up to but not including YYYY-MM-DD')
 parser.add_argument("-t", "--trim", type=str2bool, nargs='?', const=True, default=True, help="Specify True or False to have the loaders trim their tables or not.")
 parser.add_argument("-a", "--addRecords", type=str2bool, nargs='?', const=True, default=True, help="Specify True or False to have the loaders add records or not.")
+parser.add_argument("--fullStats", type=str2bool, nargs='?', const=True, default=False, help="Specify True to compute stats by aggregating the full TRUST tables instead of the incremental stats table.")
+parser.add_argument("--rebuildStats", type=str2bool, nargs='?', const=True, default=False, help="Specify True to rebuild the incremental stats table from the TRUST tables before collecting stats.")
+parser.add_argument("--profile", type=str, nargs='?', const=Profiling.SAMPLE, default=None, choices=Profiling.PROFILE_MODES, help="Profile each loader's load (sample or cprofile) and write the profiles under the log directory.")
+parser.add_argument("--asyncIngest", type=str2bool, nargs='?', const=True, default=None, help="Specify True or False to list, download and process each loader's files concurrently (defaults to ASYNC_INGESTION).")
+parser.add_argument("--verify", type=str2bool, nargs='?', const=True, default=False, help="Specify True to compare each loader's dates with its DATADB source after loading and reload the dates that differ.")
+parser.add_argument("--incremental", type=str2bool, nargs='?', const=True, default=False, help="Specify True to merge only source rows newer than each loader's watermark instead of trimming and reloading (loaders without an incremental mode load as usual).")
+parser.add_argument("--interval", type=int, default=None, help="Run as an intra-day micro-batch refresh every INTERVAL minutes: incremental extracts and new files only, then matching and stats for the affected dates (covers today unless dates are given).")
+parser.add_argument("--cycles", type=int, default=None, help="With --interval, stop after this many refreshes instead of running until stopped.")
 args = parser.parse_args()
 
 startDate = None
@@ -79,6 +113,9 @@ if args.startDate and args.endDate:
     
     startDate = args.startDate
     endDate = args.endDate
+elif args.interval and args.startDate is None and args.endDate is None:
+    # Micro-batch refreshes cover today; MicroBatch moves the window on at midnight
+    startDate, endDate = MicroBatch.today_window()
 elif args.startDate is None and args.endDate is None:
     log.info('Getting Start and End Date from Job_Exec_History table')
     tmpStartDate, tmpEndDate, jobExecID = JobExecHistory.start_next_execution_from_db()
@@ -102,89 +139,111 @@ if startDate is not None and endDate is None:
 
 # Initialize logger
 init_logger()
+loaders = {}
+# Non-zero when the run or one of its loads failed, so schedulers and Daemon.py see it
+exit_code = 0
+metrics.run_info.update({'startDate': startDate, 'endDate': endDate, 'loader': args.loader, 'jobExecID': jobExecID})
 
-if jobExecID:
-    log.info(f'Job Exec ID: {str(jobExecID)}')
+try:
+    if jobExecID:
+        log.info(f'Job Exec ID: {str(jobExecID)}')
 
-# Start run
-log.info(f'Initiating TRUST loadAll for startDate: {startDate} to but not including: {endDate}')
+    # Start run
+    log.info(f'Initiating TRUST loadAll for startDate: {startDate} to but not including: {endDate}')
 
-# Only check for files being available if running a full load without date overrides
-if args.loader is None and args.startDate is None and args.endDate is None:
-    while filesAvailableCheck(startDate, endDate, data_input_folder, log) != 1:
-        time.sleep(60)
+    # Only check for files being available if running a full load without date overrides
+    if args.loader is None and args.startDate is None and args.endDate is None and not args.interval:
+        while files_available_check(startDate, endDate, data_input_folder, log) == 1:
+            time.sleep(60)
 
-execute_match_and_stats = False
+    execute_match_and_stats = False
 
-if args.loader:
-    sanitized_loader = get_sanitized_loader(args.loader)
-    if sanitized_loader not in TRUSTED_LOADERS:
-        raise ValueError(f"Loader {sanitized_loader} is not trusted")
-    else:
-        for loader in TRUSTED_LOADERS:
-            if f"loaders.{sanitized_loader}" == f"loaders.{loader}":
-                sanitized_loader = f"loaders.{loader}"
-                break
-        class_loader = TRUSTED_LOADERS[sanitized_loader]
+    if args.loader:
+        sanitized_loader = get_sanitized_loader(args.loader)
+        class_loader = get_loader_class(sanitized_loader, log)
         loaders[sanitized_loader] = class_loader(sanitized_loader, log, startDate, endDate)
         execute_match_and_stats = True
-else:
-    loader_files = []
-    loader_priority = []
-    try:
-        with open('./loaders/priority.txt') as loader_priority_file:
-            loader_priority = [line.rstrip("\n") for line in loader_priority_file.readlines()]
-    except:
-        log.info('Could not read loader priority file.')
-
-    loader_files = []
-    for f in os.listdir("./loaders/"):
-        loaderName, extension = os.path.splitext(f)
-        if loaderName == "_pycache_" or loaderName == "priority":
-            continue
-        order = 100
+    else:
+        loader_files = []
+        loader_priority = []
         try:
-            order = loader_priority.index(loaderName)
-            loader_files.append({
-                'loader': next(filter(lambda x: x == loaderName, TRUSTED_LOADERS)),
-                'order': order
-            })
-        except ValueError:
-            log.info(f'Loader file "{loaderName}" wasn\'t found in the priority.txt file. This loader won\'t be processed.')
-    
-    loader_files.sort(key=lambda x: x['order'])
-
-    for sorted_loader in loader_files:
-        loaderName = sorted_loader['loader']
-        module = importlib.import_module(f"loaders.{loaderName}")
-        class_loader = getattr(module, loaderName)
-        loaders[loaderName] = class_loader(loaderName, log, startDate, endDate)
-
-# Execute loaders
-for loader in loaders:
-    log.info(f">>>>Starting the {loader} loader<<<<<<")
-    if args.trim:
-        loaders[loader].trim()
-    if args.addRecords:
-        loaders[loader].load()
-    log.info(f">>>>Finishing the {loader} loader<<<<")
-
-if execute_match_and_stats:
-    DiscrepanciesFromXLS.load()
-    GiftMatch.load(loaders, endDate)
-    CollectStats.collect(loaders, startDate, endDate, log)
-    ReceiptLedgerUnresolved.load()
+            with open('./loaders/priority.txt') as loader_priority_file:
+                loader_priority = [line.rstrip("\n") for line in loader_priority_file.readlines()]
+        except:
+            log.info('Could not read loader priority file.')
+
+        loader_files = []
+        for f in os.listdir("./loaders/"):
+            loaderName, extension = os.path.splitext(f)
+            if loaderName == "_pycache_" or loaderName == "priority":
+                continue
+            order = 100
+            try:
+                order = loader_priority.index(loaderName)
+                loader_files.append({
+                    'loader': next(filter(lambda x: x == loaderName, TRUSTED_LOADERS)),
+                    'order': order
+                })
+            except ValueError:
+                log.info(f'Loader file "{loaderName}" wasn\'t found in the priority.txt file. This loader won\'t be processed.')
+        
+        loader_files.sort(key=lambda x: x['order'])
+
+        for sorted_loader in loader_files:
+            loaderName = sorted_loader['loader']
+            class_loader = get_loader_class(loaderName, log)
+            loaders[loaderName] = class_loader(loaderName, log, startDate, endDate)
+
+    if args.incremental:
+        for loader in loaders:
+            loaders[loader].incremental = loaders[loader].supports_incremental
+
+    if args.asyncIngest is not None:
+        for loader in loaders:
+            loaders[loader].async_ingestion = args.asyncIngest
+
+    if args.interval:
+        MicroBatch.run(loaders, log, args.interval, refresh_stats,
+                       args.startDate and startDate, args.endDate and endDate, args.cycles)
+    else:
+        # Execute loaders
+        run_loaders(loaders)
+
+        if args.verify:
+            verify_and_reload(loaders)
 
-# Update Job History
-if jobExecID:
-    JobExecHistory.end_current_execution_db(jobExecID, 'Success')
-    log.info(f'Completed TRUST loadAll for startDate: {startDate} to but not including: {endDate}')
+        if execute_match_and_stats:
+            match_and_collect_stats(loaders, startDate, endDate)
+
+        failedLoaders = [loader for loader in loaders if loaders[loader].load_failed]
+        if failedLoaders:
+            log.error(f"Loads failed: {', '.join(failedLoaders)}")
+            exit_code = 1
+
+    # Update Job History
+    if jobExecID:
+        JobExecHistory.end_current_execution_db(jobExecID, 'Success')
+        log.info(f'Completed TRUST loadAll for startDate: {startDate} to but not including: {endDate}')
 
 except pyodbc.OperationalError as e:
+    exit_code = 1
     log.error(f"Error on line {sys.exc_info()[-1].tb_lineno}: {repr(e)}")
     log.error(str(traceback.format_exc().splitlines())[0:2000])
 except Exception as e:
+    exit_code = 1
     log.error(f"Error on line {sys.exc_info()[-1].tb_lineno}: {repr(e)}")
     log.error(str(traceback.format_exc().splitlines())[0:2000])
 finally:
+    # Timing report for the run: where the time went per loader and phase
+    if import_times:
+        log.info('Import times: ' + ', '.join(f'{module} {seconds * 1000:.0f} ms' for module, seconds in import_times.items()))
+    try:
+        if metrics_report_path:
+            metrics.write_json(metrics_report_path)
+        if metrics_prometheus_path:
+            metrics.write_prometheus(metrics_prometheus_path)
+    except OSError as e:
+        log.warning(f"Could not write run metrics: {repr(e)}")
     term_logger()
+
+sys.exit(exit_code)
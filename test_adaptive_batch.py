@@ -0,0 +1,60 @@
+import json
+
+from AdaptiveBatch import AdaptiveBatchSizer
+
+
+def sizer(tmp_path, **kwargs):
+    kwargs.setdefault('history_path', str(tmp_path / 'sizes.json'))
+    return AdaptiveBatchSizer('TRUST.X', 1000, 10 ** 9, 1.0, min_size=100, max_size=100000, **kwargs)
+
+
+def test_size_at_most_doubles_towards_the_latency_target(tmp_path):
+    batchSizer = sizer(tmp_path)
+    # 1000 rows in 0.1s: the target is 10000 rows, reached by doubling
+    assert batchSizer.record(1000, 0.1) == 2000
+    assert batchSizer.record(2000, 0.2) == 4000
+
+
+def test_size_at_most_halves_and_respects_min_size(tmp_path):
+    batchSizer = sizer(tmp_path)
+    assert batchSizer.record(1000, 100.0) == 500
+    for _ in range(5):
+        batchSizer.record(batchSizer.size, 100.0)
+    assert batchSizer.size == 100
+
+
+def test_memory_budget_caps_the_size(tmp_path):
+    batchSizer = AdaptiveBatchSizer('TRUST.X', 1000, 1, 1.0, min_size=100)
+    assert batchSizer.record(1000, 0.001, sample_row=('a', 1)) == 500
+
+
+def test_disabled_sizer_keeps_its_size(tmp_path):
+    batchSizer = sizer(tmp_path, enabled=False)
+    assert batchSizer.record(1000, 0.001) == 1000
+    batchSizer.save()
+    assert not (tmp_path / 'sizes.json').exists()
+
+
+def test_size_is_saved_per_table_and_reused(tmp_path):
+    path = tmp_path / 'sizes.json'
+    path.write_text(json.dumps({'TRUST.OTHER': 700}))
+    batchSizer = sizer(tmp_path)
+    batchSizer.record(1000, 0.1)
+    batchSizer.save()
+    assert json.loads(path.read_text()) == {'TRUST.OTHER': 700, 'TRUST.X': 2000}
+    assert sizer(tmp_path).size == 2000
+
+
+def test_operator_size_wins_over_history_and_caps(tmp_path):
+    (tmp_path / 'sizes.json').write_text(json.dumps({'TRUST.X': 50000}))
+    batchSizer = AdaptiveBatchSizer('TRUST.X', 2000, 10 ** 9, 1.0, str(tmp_path / 'sizes.json'), cap=True)
+    assert batchSizer.size == 2000
+    assert batchSizer.record(2000, 0.01) == 2000
+    assert batchSizer.record(2000, 10.0) == 1000
+    batchSizer.save()
+    assert json.loads((tmp_path / 'sizes.json').read_text()) == {'TRUST.X': 50000}
+
+
+def test_unreadable_history_is_ignored(tmp_path):
+    (tmp_path / 'sizes.json').write_text('not json')
+    assert sizer(tmp_path).size == 1000
@@ -0,0 +1,79 @@
+import pickle
+from datetime import datetime
+
+import pytest
+
+from Config import TrustConfig
+
+NOW = datetime(2024, 6, 2, 8, 30)
+
+
+def config_from(**environ):
+    return TrustConfig.from_environment(environ=environ, hostname='test-host', platform='linux', now=NOW)
+
+
+def test_matching_window_defaults():
+    assert config_from().matching_window_in_days == 120
+    assert config_from(MATCHING_WINDOW_IN_DAYS='90').matching_window_in_days == 90
+
+
+def test_invalid_matching_window_falls_back_to_60():
+    warnings = []
+
+    class Log:
+        def warning(self, message):
+            warnings.append(message)
+
+    config = TrustConfig.from_environment(environ={'MATCHING_WINDOW_IN_DAYS': 'abc'}, log=Log(),
+                                          hostname='test-host', platform='linux', now=NOW)
+    assert config.matching_window_in_days == 60
+    assert warnings == ['Invalid MATCHING_WINDOW_IN_DAYS [abc], defaulting to 60']
+
+
+def test_invalid_number_uses_default_and_minimum_applies():
+    config = config_from(SQL_BATCH_SIZE='lots', STATS_PARALLELISM='0')
+    assert config.sql_batch_size == 10000
+    assert config.stats_parallelism == 1
+
+
+def test_config_is_frozen():
+    config = config_from()
+    with pytest.raises(AttributeError):
+        config.sql_batch_size = 1
+    with pytest.raises(AttributeError):
+        del config.sql_batch_size
+
+
+def test_unknown_setting_is_rejected():
+    with pytest.raises(TypeError):
+        TrustConfig(no_such_setting=1)
+
+
+def test_replace_returns_a_copy():
+    config = config_from()
+    runConfig = config.replace(start_date='2024-01-01')
+    assert runConfig.start_date == '2024-01-01'
+    assert config.start_date != '2024-01-01'
+
+
+def test_loader_overrides():
+    config = config_from(LOADER_BENEVITY_SQL_BATCH_SIZE='2000',
+                         LOADER_SHIFT4_ACH_USE_S3_BUCKETS='true',
+                         LOADER_EMAF_PARALLELISM='many')
+    benevity = config.for_loader('Benevity')
+    assert benevity.sql_batch_size == 2000
+    assert benevity.loader_name == 'Benevity'
+    assert config.for_loader('SHIFT4_ACH').use_s3_buckets_enabled is True
+    assert benevity.loader_override('sql_batch_size') == 2000
+    assert config.for_loader('CardPayment').loader_override('sql_batch_size') is None
+    assert config.loader_override('sql_batch_size') is None
+    # Invalid overrides are ignored, other loaders keep the run settings
+    assert config.for_loader('EMAF').parallelism == config.parallelism
+    assert config.for_loader('CardPayment').sql_batch_size == config.sql_batch_size
+
+
+def test_pickles_and_hides_secrets():
+    config = config_from(SQL_WORKING_PASSWORD='hunter2', DAEMON_TOKEN='swordfish')
+    assert pickle.loads(pickle.dumps(config)) == config
+    assert 'hunter2' not in repr(config)
+    assert 'swordfish' not in repr(config)
@@ -0,0 +1,23 @@
+import pytest
+
+from ConnectionPool import ConnectionPool, PoolTimeout
+
+
+def test_acquire_times_out_when_the_pool_is_exhausted(connection):
+    pool = ConnectionPool(connection, 1, timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    conn.close()
+    pool.acquire().close()
+    assert pool.created == 1
+
+
+def test_failed_connect_frees_its_slot():
+    def connect():
+        raise OSError('login failed')
+
+    pool = ConnectionPool(connect, 1, timeout=0.05)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            pool.acquire()
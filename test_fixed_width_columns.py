@@ -0,0 +1,109 @@
+import pytest
+
+from FixedWidthColumns import (FixedWidthColumnParser, FixedWidthColumn, FixedWidthValidationError,
+                               MONEY, CENTS, INT, np)
+from Money import SCALED_AMOUNT
+
+COLUMNS = [
+    FixedWidthColumn('TRANSACTION_DATE', 1, 8),
+    FixedWidthColumn('MERCHANT_ID', 9, 10),
+    FixedWidthColumn('REFERENCE', 19, 20),
+    FixedWidthColumn('AMOUNT', 39, 12, MONEY),
+]
+WIDTH = 51
+
+
+def detail(date, merchant, reference, cents):
+    return f"D{date}{merchant:<10}{reference:<20}{cents:012d}"
+
+
+def trailer(count, cents):
+    return f"T{count:010d}{cents:015d}".ljust(WIDTH)
+
+
+def write_file(tmp_path, records, encoding='ascii', name='input.txt'):
+    path = tmp_path / name
+    path.write_bytes(''.join(record + '\n' for record in records).encode(encoding))
+    return str(path)
+
+
+def parser(**kwargs):
+    kwargs.setdefault('use_numpy', False)
+    return FixedWidthColumnParser(COLUMNS, trailer_count=(1, 10), trailer_total=(11, 15), total_column='AMOUNT', **kwargs)
+
+
+def read_all(fixedParser, path, batch_size=2):
+    return [row for rows in fixedParser.batches(path, batch_size) for row in rows]
+
+
+def numpy_modes():
+    return [False, pytest.param(True, marks=pytest.mark.skipif(np is None, reason='numpy not installed'))]
+
+
+@pytest.mark.parametrize('use_numpy', numpy_modes())
+def test_money_is_yielded_as_integer_cents(tmp_path, use_numpy):
+    path = write_file(tmp_path, [
+        detail('20240101', 'M1', 'REF1', 10),
+        detail('20240101', 'M2', 'REF2', 20),
+        detail('20240102', 'M1', 'REF3', 999999),
+        trailer(3, 10 + 20 + 999999),
+    ])
+    fixedParser = parser(use_numpy=use_numpy)
+    rows = read_all(fixedParser, path)
+    assert rows == [('20240101', 'M1', 'REF1', 10), ('20240101', 'M2', 'REF2', 20), ('20240102', 'M1', 'REF3', 999999)]
+    assert all(type(row[3]) is int for row in rows)
+    assert (fixedParser.records, fixedParser.total_cents) == (3, 1000029)
+
+
+def test_insert_sql_scales_money_columns():
+    assert parser().insert_sql('TRUST.X') == (
+        f"INSERT INTO TRUST.X (TRANSACTION_DATE, MERCHANT_ID, REFERENCE, AMOUNT) VALUES (?, ?, ?, {SCALED_AMOUNT})")
+    cents = FixedWidthColumnParser([FixedWidthColumn('AMOUNT', 0, 5, CENTS), FixedWidthColumn('N', 5, 2, INT)])
+    assert cents.insert_sql('T') == "INSERT INTO T (AMOUNT, N) VALUES (?, ?)"
+
+
+def test_trailer_count_mismatch_fails_before_the_first_batch(tmp_path):
+    path = write_file(tmp_path, [detail('20240101', 'M1', 'REF1', 10), trailer(2, 10)])
+    batches = parser().batches(path, 10)
+    with pytest.raises(FixedWidthValidationError) as error:
+        next(batches)
+    assert (error.value.expected, error.value.actual) == (2, 1)
+
+
+def test_trailer_total_mismatch_fails_after_the_last_batch(tmp_path):
+    path = write_file(tmp_path, [detail('20240101', 'M1', 'REF1', 10), detail('20240101', 'M1', 'REF2', 15), trailer(2, 30)])
+    batches = parser().batches(path, 1)
+    assert len(next(batches)) == 1
+    assert len(next(batches)) == 1
+    # The caller only inserts the last batch once the generator has moved past it
+    with pytest.raises(FixedWidthValidationError) as error:
+        next(batches)
+    assert (error.value.expected, error.value.actual) == (30, 25)
+
+
+def test_missing_trailer(tmp_path):
+    path = write_file(tmp_path, [detail('20240101', 'M1', 'REF1', 10)])
+    with pytest.raises(FixedWidthValidationError):
+        read_all(parser(), path)
+
+
+def test_blank_amount_counts_as_zero(tmp_path):
+    path = write_file(tmp_path, [f"D20240101{'M1':<10}{'REF1':<20}{'':12}", trailer(1, 0)])
+    assert read_all(parser(), path) == [('20240101', 'M1', 'REF1', 0)]
+
+
+def test_varying_line_lengths(tmp_path):
+    path = write_file(tmp_path, [detail('20240101', 'M1', 'REF1', 10), 'H short header', trailer(1, 10).rstrip()])
+    assert read_all(parser(), path) == [('20240101', 'M1', 'REF1', 10)]
+
+
+@pytest.mark.parametrize('use_numpy', numpy_modes())
+def test_text_uses_the_configured_encoding(tmp_path, use_numpy):
+    path = write_file(tmp_path, [detail('20240101', 'CAFÉ', 'RÉF', 10), trailer(1, 10)], encoding='latin-1')
+    assert read_all(parser(encoding='latin-1', use_numpy=use_numpy), path) == [('20240101', 'CAFÉ', 'RÉF', 10)]
+
+
+def test_adaptive_batch_size(tmp_path):
+    path = write_file(tmp_path, [detail('20240101', 'M1', f'REF{i}', i) for i in range(5)] + [trailer(5, 10)])
+    sizes = iter([2, 3])
+    assert [len(rows) for rows in parser().batches(path, lambda: next(sizes))] == [2, 3]
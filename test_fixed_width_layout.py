@@ -0,0 +1,61 @@
+import io
+
+import pytest
+
+from FixedWidthLayout import FixedWidthLayout, FixedWidthFieldError, compiled_layout, TRUNCATE, KEEP
+
+
+def test_format_pads_and_justifies():
+    layout = FixedWidthLayout([('ACCOUNT', 4), ('AMOUNT', 6, 'R'), ('MEMO', 5, 'C')])
+    assert layout.format(['AB', '1.50', 'x']) == 'AB    1.50  x  '
+
+
+def test_centred_fields_match_str_center():
+    # format's '^' puts the odd pad on the other side
+    layout = FixedWidthLayout([('MEMO', 6, 'C')])
+    assert layout.format(['abc']) == 'abc'.center(6)
+
+
+def test_extra_fields_are_rejected():
+    layout = FixedWidthLayout([('A', 3), ('B', 5)])
+    with pytest.raises(FixedWidthFieldError):
+        layout.format(['a', 'b', 'EXTRA'])
+    with pytest.raises(FixedWidthFieldError) as error:
+        layout.format_records([['a', 'b'], ['a', 'b', 'EXTRA']])
+    assert error.value.record_number == 2
+
+
+def test_short_record_with_centred_field_is_rejected():
+    layout = FixedWidthLayout([('A', 3), ('B', 5, 'C')])
+    with pytest.raises(FixedWidthFieldError):
+        layout.format(['a'])
+    with pytest.raises(FixedWidthFieldError) as error:
+        layout.format_records(iter([['a']]), first_record_number=7)
+    assert error.value.record_number == 7
+
+
+def test_overflow_modes():
+    fields = [('A', 3), ('B', 2)]
+    with pytest.raises(FixedWidthFieldError) as error:
+        FixedWidthLayout(fields).format(['abcd', 'x'])
+    assert (error.value.field_name, error.value.length) == ('A', 3)
+    assert FixedWidthLayout(fields, overflow=TRUNCATE).format(['abcd', 12345]) == 'abc12'
+    assert FixedWidthLayout(fields, overflow=KEEP).format(['abcd', 'x']) == 'abcdx '
+
+
+def test_none_value_is_reported():
+    with pytest.raises(FixedWidthFieldError) as error:
+        FixedWidthLayout([('A', 3), ('B', 2)]).format_records([['a', None]])
+    assert error.value.field_index == 1
+
+
+def test_write_records_batches():
+    layout = FixedWidthLayout([('A', 2), ('B', 2)], newline='\r\n')
+    out = io.StringIO()
+    assert layout.write_records(out, [['a', 'b'], ['c', 'd'], ['e', 'f']], batch_size=2) == 3
+    assert out.getvalue() == 'a b \r\nc d \r\ne f \r\n'
+
+
+def test_compiled_layout_is_cached():
+    assert compiled_layout((2, 3)) is compiled_layout((2, 3))
+    assert compiled_layout((2, 3)).format(['abc', 'de']) == 'abcde '
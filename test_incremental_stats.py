@@ -0,0 +1,43 @@
+from datetime import datetime
+from decimal import Decimal
+
+from IncrementalStats import StatsAccumulator, STATS_TABLE
+
+
+def test_batches_aggregate_per_date_and_merchant():
+    stats = StatsAccumulator('EMAF', 'TRUST.EMAF')
+    stats.add_batch([(datetime(2024, 1, 1, 9), 'M1', 1.10), ('2024-01-01', 'M1', Decimal('2.20')),
+                     ('2024-01-02', None, None)], 0, 1, 2)
+    stats.add('2024-01-02', None, 0.05)
+    assert stats.aggregates == {('2024-01-01', 'M1'): [2, 330], ('2024-01-02', ''): [2, 5]}
+    assert stats.dates() == ['2024-01-01', '2024-01-02']
+    assert stats.totals('2024-01-02', '2024-01-03') == (2, 5)
+    assert stats.totals('2023-12-01', '2024-02-01') == (4, 335)
+    stats.clear()
+    assert stats.aggregates == {}
+
+
+def test_merge_replaces_trimmed_dates_and_always_drops_the_temp_table(cursor):
+    stats = StatsAccumulator('EMAF', 'TRUST.EMAF')
+    stats.add_cents(['2024-01-01'], ['M1'], [150])
+    stats.merge(cursor, '2024-01-01')
+    statements = [sql.split(' ')[0] for sql, _ in cursor.executed]
+    assert statements == ['CREATE', 'INSERT', 'DELETE', 'MERGE', 'DROP']
+    assert cursor.executed[1][1] == [['2024-01-01', 'M1', 1, 150]]
+    assert cursor.executed[2][1] == ['EMAF', '2024-01-01']
+
+
+def test_merge_without_trim_only_adds(cursor):
+    StatsAccumulator('EMAF', 'TRUST.EMAF').merge(cursor)
+    assert [sql.split(' ')[0] for sql, _ in cursor.executed] == ['CREATE', 'MERGE', 'DROP']
+
+
+def test_rebuild_limited_to_dates(cursor):
+    stats = StatsAccumulator('Benevity', 'TRUST.BENEVITY', date_field='DONATION_DATE')
+    stats.rebuild(cursor, [])
+    assert cursor.executed == []
+    stats.rebuild(cursor, ['2024-01-01', '2024-01-02'])
+    (delete, deleteParameters), (insert, insertParameters) = cursor.executed
+    assert delete == f"DELETE FROM {STATS_TABLE} WHERE SOURCE = ? AND TRANSACTION_DATE IN (?, ?)"
+    assert 'DONATION_DATE IN (?, ?)' in insert
+    assert deleteParameters == insertParameters == ['Benevity', '2024-01-01', '2024-01-02']
@@ -0,0 +1,43 @@
+import hashlib
+from datetime import datetime
+
+from IngestionLedger import IngestionLedger, file_hash, etag_hash
+
+
+def test_file_hash_is_content_addressed(tmp_path):
+    first = tmp_path / 'a.txt'
+    renamed = tmp_path / 'b.txt'
+    first.write_bytes(b'x' * 3000)
+    renamed.write_bytes(b'x' * 3000)
+    expected = 'sha256:' + hashlib.sha256(b'x' * 3000).hexdigest()
+    # Reading in small chunks gives the same digest as one read
+    assert file_hash(str(first), chunk_size=1024) == expected
+    assert file_hash(str(renamed)) == expected
+
+
+def test_etag_hash_strips_quotes():
+    assert etag_hash('"abc-2"') == 'etag:abc-2'
+    assert etag_hash('abc') == 'etag:abc'
+
+
+def test_record_does_not_commit_and_normalises_values(cursor):
+    IngestionLedger('EMAF').record(cursor, 'sha256:1', 'k' * 2000, datetime(2024, 1, 2, 13, 45), 10)
+    sql, parameters = cursor.executed[0]
+    assert sql.startswith('INSERT INTO TRUST.INGESTION_LEDGER')
+    assert parameters == ['EMAF', 'sha256:1', 'k' * 1024, '2024-01-02', 10]
+
+
+def test_record_without_file_date(cursor):
+    IngestionLedger('EMAF').record(cursor, 'etag:1', 'key', None)
+    assert cursor.executed[0][1] == ['EMAF', 'etag:1', 'key', None, None]
+
+
+def test_hashes_are_per_loader(cursor):
+    cursor.rows = [('sha256:1',), ('etag:2',)]
+    ledger = IngestionLedger('Benevity', table='TRUST.TEST_LEDGER')
+    assert ledger.hashes(cursor) == {'sha256:1', 'etag:2'}
+    assert ledger.hashes_from(cursor, '2024-01-01') == {'sha256:1', 'etag:2'}
+    ledger.clear_from(cursor, '2024-01-01')
+    assert [parameters for sql, parameters in cursor.executed] == [
+        ['Benevity'], ['Benevity', '2024-01-01'], ['Benevity', '2024-01-01']]
+    assert all('TRUST.TEST_LEDGER' in sql for sql, parameters in cursor.executed)
@@ -0,0 +1,44 @@
+from LoadVerifier import Checksum, checksum_query, differing_dates, verify_loaders
+
+
+def test_differing_dates():
+    source = {'2024-01-01': (2, 300, 7), '2024-01-02': (1, 100, 3), '2024-01-03': (1, 5, 1)}
+    target = {'2024-01-01': (2, 300, 7), '2024-01-02': (1, 100, 4), '2024-01-04': (1, 5, 1)}
+    assert differing_dates(source, target) == ['2024-01-02', '2024-01-03', '2024-01-04']
+    assert differing_dates(source, dict(source)) == []
+
+
+def test_checksum_query():
+    sql = ' '.join(checksum_query(Checksum('TRUST.EMAF', 'TRANSACTION_DATE', 'AMOUNT', ['MERCHANT_ID', 'REF'],
+                                           'TRANSACTION_DATE >= ? AND TRANSACTION_DATE < ?')).split())
+    assert "CONCAT(CAST(MERCHANT_ID AS VARCHAR(200)), '|', CAST(REF AS VARCHAR(200)), '|', " \
+           "CAST(CAST(ROUND(AMOUNT * 100, 0) AS BIGINT) AS VARCHAR(20)))" in sql
+    assert sql.endswith("FROM TRUST.EMAF WITH (NOLOCK) WHERE TRANSACTION_DATE >= ? AND TRANSACTION_DATE < ? "
+                        "GROUP BY CONVERT(CHAR(10), TRANSACTION_DATE, 126)")
+
+
+class FakeLoader:
+    startDate, endDate = '2024-01-01', '2024-01-03'
+
+    def __init__(self, connection, sourceRows, targetRows):
+        self.source = connection(sourceRows)
+        self.target = connection(targetRows)
+        yyyymmdd = lambda startDate, endDate: [startDate.replace('-', ''), endDate.replace('-', '')]
+        self.verification = (Checksum('DATADB.EMAF', 'ALSAC_FILE_ID', 'AMOUNT', ['ID'], 'W', yyyymmdd),
+                             Checksum('TRUST.EMAF', 'TRANSACTION_DATE', 'AMOUNT', ['ID'], 'W'))
+
+    def connect_datastore(self):
+        return self.source
+
+    def connect_working(self):
+        return self.target
+
+
+def test_verify_loaders_returns_the_dates_that_differ(connection, log):
+    loader = FakeLoader(connection, [('2024-01-01', 2, 300, 7), ('2024-01-02 ', 1, 100, 3)],
+                        [('2024-01-01', 2, 300, 7), ('2024-01-02', 1, 100, 4)])
+    matching = FakeLoader(connection, [('2024-01-01', 1, 1, 1)], [('2024-01-01', 1, 1, 1)])
+    assert verify_loaders({'EMAF': loader, 'OTHER': matching, 'NONE': object()}, log) == {'EMAF': ['2024-01-02']}
+    assert loader.source.cursor_.executed[-1][1] == ['20240101', '20240103']
+    assert loader.target.cursor_.executed[-1][1] == ['2024-01-01', '2024-01-03']
+    assert [level for level, _ in log.messages] == ['warning', 'info']
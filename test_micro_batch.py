@@ -0,0 +1,69 @@
+import MicroBatch
+
+
+class FakeLoader:
+    def __init__(self, name, dates, matches_on_or_after=False, matching_source_tables=(), micro_batch=True):
+        self.target_table = f'TRUST.{name}'
+        self.dates = dates
+        self.matches_on_or_after = matches_on_or_after
+        self.matching_source_tables = list(matching_source_tables)
+        self.supports_micro_batch = micro_batch
+        self.calls = []
+
+    def prepare_load(self):
+        pass
+
+    def load(self):
+        self.affected_dates = set(self.dates)
+
+    def publish(self):
+        pass
+
+    def clean_matching_dates(self, dates):
+        self.calls.append(('clean', list(dates)))
+
+    def clean_matching_from(self, matchDate):
+        self.calls.append(('clean from', matchDate))
+
+    def match(self, matchDate, notIncluded):
+        self.calls.append(('match', matchDate, notIncluded))
+
+
+def test_days():
+    assert MicroBatch.days('2024-02-28', '2024-03-02') == ['2024-02-28', '2024-02-29', '2024-03-01']
+    assert MicroBatch.days('2024-01-01', '2024-01-01') == []
+
+
+def test_per_day_matchers_match_each_date(log):
+    loaders = {'CardPayment': FakeLoader('CardPayment', ['2024-01-03', '2024-01-01'])}
+    refreshed = []
+    dates = MicroBatch.run_cycle(loaders, log, '2024-01-01', '2024-01-04', lambda _, dates: refreshed.append(dates))
+    assert dates == ['2024-01-01', '2024-01-03']
+    assert loaders['CardPayment'].calls == [('clean', ['2024-01-01', '2024-01-03']),
+                                            ('match', '2024-01-01', '2024-01-02'),
+                                            ('match', '2024-01-03', '2024-01-04')]
+    assert refreshed == [['2024-01-01', '2024-01-02', '2024-01-03']]
+
+
+def test_on_or_after_matchers_match_once_from_the_earliest_date(log):
+    loaders = {'EMAF': FakeLoader('EMAF', ['2024-01-03', '2024-01-01'], matches_on_or_after=True)}
+    MicroBatch.run_cycle(loaders, log, '2024-01-01', '2024-01-04', lambda *_: None)
+    assert loaders['EMAF'].calls == [('clean from', '2024-01-01'), ('match', '2024-01-01', '2024-01-04')]
+
+
+def test_only_refreshed_and_dependent_loaders_match_again(log):
+    loaders = {
+        'Cybersource': FakeLoader('Cybersource', ['2024-01-02']),
+        'CardPayment': FakeLoader('CardPayment', [], matching_source_tables=['TRUST.CYBERSOURCE'], micro_batch=False),
+        'Benevity': FakeLoader('Benevity', [], matching_source_tables=['TRUST.DMS']),
+    }
+    MicroBatch.run_cycle(loaders, log, '2024-01-01', '2024-01-04', lambda *_: None)
+    assert loaders['Cybersource'].calls == [('clean', ['2024-01-02']), ('match', '2024-01-02', '2024-01-03')]
+    assert loaders['CardPayment'].calls == loaders['Cybersource'].calls
+    assert loaders['Benevity'].calls == []
+
+
+def test_nothing_new_skips_match_and_stats(log):
+    loaders = {'A': FakeLoader('A', [])}
+    assert MicroBatch.run_cycle(loaders, log, '2024-01-01', '2024-01-02', None) == []
+    assert loaders['A'].calls == []
@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+import pytest
+
+from Money import to_cents, from_cents, cents_array, aggregate_cents
+
+
+@pytest.mark.parametrize('value, cents', [
+    (12, 1200),
+    (0.1 + 0.2, 30),
+    (1.005, 101),
+    (-2.5, -250),
+    (Decimal('19.99'), 1999),
+    (' 7.25 ', 725),
+    ('-0.01', -1),
+    (Decimal('0.125'), 13),
+])
+def test_to_cents(value, cents):
+    assert to_cents(value) == cents
+    assert type(to_cents(value)) is int
+
+
+def test_from_cents_round_trips():
+    assert from_cents(1999) == Decimal('19.99')
+    assert from_cents(to_cents('-123456789.01')) == Decimal('-123456789.01')
+
+
+def test_aggregate_cents():
+    aggregates = aggregate_cents(['a', 'b', 'a'], cents_array([100, 5, 250]))
+    assert aggregates == {'a': [2, 350], 'b': [1, 5]}
+    aggregate_cents(['b'], [10], aggregates)
+    assert aggregates['b'] == [2, 15]
+
+
+def test_exact_totals():
+    assert sum(to_cents(0.1) for _ in range(1000)) == 10000
@@ -0,0 +1,35 @@
+from RowBuffer import RowBuffer
+
+DESCRIPTION = [('ID',), ('amount',), ('CARD_TYPE',)]
+
+
+def test_columns_are_picked_by_name_and_converted():
+    buffer = RowBuffer.from_description(DESCRIPTION, ['AMOUNT', 'card_type'], {0: float})
+    assert buffer.fill([(1, '1.50', 'VISA'), (2, None, 'AMEX')]) == [[1.5, 'VISA'], [None, 'AMEX']]
+    assert buffer.column(1) == ['VISA', 'AMEX']
+
+
+def test_single_column():
+    buffer = RowBuffer([2])
+    assert buffer.fill([(1, 2, 3), (4, 5, 6)]) == [[3], [6]]
+
+
+def test_slots_are_reused_and_trimmed():
+    buffer = RowBuffer([0, 1])
+    first = buffer.fill([(1, 2), (3, 4), (5, 6), (7, 8)])
+    slot = first[0]
+    second = buffer.fill([(7, 8), (9, 10)])
+    assert second == [[7, 8], [9, 10]]
+    assert second[0] is slot
+    assert buffer.column(0) == [7, 9]
+    assert len(buffer.slots) == 4
+    # A batch under half the slots lets the unused slots go
+    buffer.fill([(0, 0)])
+    assert len(buffer.slots) == 1
+
+
+def test_empty_batch():
+    buffer = RowBuffer([0, 1])
+    buffer.fill([(1, 2)])
+    assert buffer.fill([]) == []
+    assert buffer.column(0) == []
@@ -0,0 +1,45 @@
+import os
+
+from S3Cache import S3Cache
+
+
+def writer(size):
+    def download(path):
+        with open(path, 'wb') as downloadFile:
+            downloadFile.write(b'x' * size)
+    return download
+
+
+def test_fetch_downloads_once_and_counts_hits(tmp_path):
+    cache = S3Cache(str(tmp_path), 1000)
+    path = cache.fetch('bucket', 'a.txt', '"etag1"', writer(10))
+    assert cache.fetch('bucket', 'a.txt', 'etag1', writer(99)) == path
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert os.path.getsize(path) == 10
+    assert cache.contains(path)
+
+
+def test_pinned_files_are_not_evicted(tmp_path):
+    cache = S3Cache(str(tmp_path), 150)
+    first = cache.fetch('bucket', 'a.txt', '1', writer(100))
+    # Another worker's download pushes the cache over its limit while a.txt is still in use
+    second = cache.fetch('bucket', 'b.txt', '1', writer(100))
+    assert os.path.exists(first) and os.path.exists(second)
+
+    cache.release(first)
+    cache.release(second)
+    cache.fetch('bucket', 'c.txt', '1', writer(100))
+    assert not os.path.exists(first)
+    assert not os.path.exists(second)
+
+
+def test_release_waits_for_every_user(tmp_path):
+    cache = S3Cache(str(tmp_path), 0)
+    path = cache.fetch('bucket', 'a.txt', '1', writer(10))
+    assert cache.fetch('bucket', 'a.txt', '1', writer(10)) == path
+    cache.release(path)
+    cache.evict()
+    assert os.path.exists(path)
+    cache.release(path)
+    cache.evict()
+    assert not os.path.exists(path)